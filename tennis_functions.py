@@ -3,14 +3,29 @@ import numpy as np
 import pandas as pd
 from math import exp, floor
 import time
-from matplotlib import pyplot as plt
 import requests
 from lxml.html import fromstring
 import os
+import json
+import csv
+import difflib
+import unicodedata
+import sqlite3
+import hashlib
+import importlib.util
+import inspect
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
 from typing import Tuple
+from collections import deque
 import warnings
-from sklearn.metrics import log_loss, brier_score_loss, mean_absolute_error
+try:
+    from numba import njit
+except ImportError: # numba is optional, without it elo_kernel runs as a plain Python loop
+    def njit(*args, **kwargs):
+        return lambda function: function
 
 #warnings.filterwarnings("ignore", message="The default value of regex will change from True to False in a future version.")
 
@@ -40,10 +55,62 @@ def tourney_id(years,names,dates):
     return tourney_ids
 
 def scores_clean(scores):
-    scores2 = scores.str.replace(pat = r"\(.*\)", repl = "", regex = True) # E.g. make "7-6(3)" into "7-6"
+    # There are a lot fewer different scores than matches, so we only clean every different score once
+    codes, uniques = pd.factorize(scores)
+    scores2 = pd.Series(uniques, dtype = scores.dtype)
+    scores2 = scores2.str.replace(pat = r"\(.*\)", repl = "", regex = True) # E.g. make "7-6(3)" into "7-6"
     scores2 = scores2.str.replace(pat = "[", repl = "", regex = False) # E.g. make "[10-5]" into "10-5"
     scores2 = scores2.str.replace(pat = "]", repl = "", regex = False)
-    return scores2
+    return scores2.reindex(codes).set_axis(scores.index) # code -1 (missing score) becomes NaN
+
+def parse_scores(scores: pd.Series) -> pd.DataFrame:
+    """Parses the variable score into a table of integers, one row per match (same order as scores)
+    The sets are read in the same way as in setwinner, so the columns "winner_setswon" and "loser_setswon" are the same as the output of sets_won_by_player.
+    Every different score is only parsed once.
+
+    Returns:
+        S (pandas dataframe): the columns "winner_games_1", ..., "winner_games_5" and "loser_games_1", ..., "loser_games_5" (games won in each set, 0 if the set wasn't played),
+        "tiebreak_points_1", ..., "tiebreak_points_5" (the number in brackets, e.g. 5 for "7-6(5)", -1 if there was no tiebreak), "retired" (score contains "RET"),
+        "walkover" (score contains "W/O"), "winner_setswon" and "loser_setswon"
+    """
+
+    codes, uniques = pd.factorize(scores.reset_index(drop=True))
+    uniques = pd.Series(uniques, dtype=object)
+    u = len(uniques)
+
+    # Put the first 5 sets of all the different scores below each other, so that every step is done once for all sets
+    tokens = uniques.str.split(" ", expand=True) if u > 0 else pd.DataFrame(index=range(0))
+    k = min(5, len(tokens.columns))
+    sets = pd.Series(tokens.iloc[:,:k].to_numpy(dtype=object).ravel(), dtype=object)
+    sets_clean = sets.str.replace(r"\(.*\)","", regex = True).str.replace("[","", regex = False).str.replace("]","", regex = False)
+    games = sets_clean.str.split("-", expand = True) if len(sets) > 0 else pd.DataFrame(index=range(0))
+    winner_games = np.zeros((u+1, 5), dtype=np.int16) # the last row is for missing scores
+    loser_games = np.zeros((u+1, 5), dtype=np.int16)
+    tiebreak_points = np.full((u+1, 5), -1, dtype=np.int16)
+    if 0 in games.columns:
+        winner_games[:u,:k] = pd.to_numeric(games[0], errors = "coerce").fillna(0).astype(int).to_numpy().reshape(u, k)
+    if 1 in games.columns:
+        loser_games[:u,:k] = pd.to_numeric(games[1], errors = "coerce").fillna(0).astype(int).to_numpy().reshape(u, k)
+    if len(sets) > 0:
+        tiebreak_points[:u,:k] = pd.to_numeric(sets.str.extract(r"\((\d+)\)", expand = False), errors = "coerce").fillna(-1).astype(int).to_numpy().reshape(u, k)
+
+    # Same rule as in setwinner: at least 6 games and a margin of 2, or 7-6
+    winner_won = ((winner_games > loser_games+1) & (winner_games >= 6)) | ((winner_games == 7) & (loser_games == 6))
+    loser_won = ((loser_games > winner_games+1) & (loser_games >= 6)) | ((loser_games == 7) & (winner_games == 6))
+
+    rows = np.where(codes >= 0, codes, u)
+    S = pd.DataFrame(index=scores.index)
+    for j in range(5):
+        S["winner_games_"+str(j+1)] = winner_games[rows,j]
+    for j in range(5):
+        S["loser_games_"+str(j+1)] = loser_games[rows,j]
+    for j in range(5):
+        S["tiebreak_points_"+str(j+1)] = tiebreak_points[rows,j]
+    S["retired"] = np.append(uniques.str.contains("RET", regex = False).to_numpy(dtype=bool), False)[rows]
+    S["walkover"] = np.append(uniques.str.contains("W/O", regex = False).to_numpy(dtype=bool), False)[rows]
+    S["winner_setswon"] = winner_won.sum(axis=1).astype(np.int8)[rows]
+    S["loser_setswon"] = loser_won.sum(axis=1).astype(np.int8)[rows]
+    return S
 
 def match_id(tourney_ids,winner_ids,loser_ids,scores):
     return tourney_ids + "-" + winner_ids + "-" + loser_ids + scores_clean(scores)
@@ -62,7 +129,131 @@ players_dtypes = {"id": "str", "name": "str", "given_name": "str", "surname": "s
     "elo_overall": "float", "match_number": "Int64", "elo_hard": "float", "match_number_hard": "Int64", \
     "elo_clay": "float", "match_number_clay": "Int64", "elo_grass": "float", "match_number_grass": "Int64", "previous_match": "str"}
 
-def read_matches() -> pd.DataFrame:
+def file_sha256(filename: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def reader_version(*parts) -> str:
+    """Returns a hash of the source code of the functions in parts (and of the other parts, e.g. dicts of dtypes), used as version of a reader in read_cached_table
+    """
+    sha256 = hashlib.sha256()
+    for part in parts:
+        sha256.update((inspect.getsource(part) if callable(part) else repr(part)).encode("utf-8"))
+    return sha256.hexdigest()
+
+def read_cached_table(name: str, filenames: list, reader, cache_folder: str = "cache", version: str = "") -> pd.DataFrame:
+    """Returns reader(), but stores the result as a parquet file in cache_folder and reads it from there as long as the files in filenames and the version of reader have not changed.
+    A file counts as unchanged if its size and modification time are the same as when the cache was written. If only the modification time changed (e.g. after a git checkout), the content hash decides.
+    Without pyarrow, the cache is not used and reader() is called every time.
+
+    Args:
+        name (string): name of the cache file (without extension)
+        filenames (list): the files reader reads
+        reader (function): function without arguments that reads the table from the files
+        cache_folder (string): folder in which the cache files are stored
+        version (string): version of reader (e.g. reader_version of the functions it uses), a cache written by another version is not used
+    """
+
+    if importlib.util.find_spec("pyarrow") is None:
+        return reader()
+
+    cache_filename = os.path.join(cache_folder, name + ".parquet")
+    info_filename = os.path.join(cache_folder, name + ".json")
+    sources = {filename: {"size": os.path.getsize(filename), "mtime_ns": os.stat(filename).st_mtime_ns} for filename in filenames}
+
+    info = {}
+    if os.path.isfile(cache_filename) and os.path.isfile(info_filename):
+        with open(info_filename) as f:
+            info = json.load(f)
+    fresh = info.get("version") == version and set(info.get("files", {})) == set(sources)
+    info = info.get("files", {})
+    for filename, source in sources.items():
+        if not fresh:
+            break
+        if info[filename]["size"] != source["size"]:
+            fresh = False
+        elif info[filename]["mtime_ns"] != source["mtime_ns"]:
+            fresh = (info[filename]["sha256"] == file_sha256(filename))
+        source["sha256"] = info[filename]["sha256"]
+
+    if fresh:
+        if info != sources: # only the modification times changed, remember the new ones
+            with open(info_filename, "w") as f:
+                json.dump({"version": version, "files": sources}, f)
+        return pd.read_parquet(cache_filename)
+
+    table = reader()
+    for filename, source in sources.items():
+        source["sha256"] = file_sha256(filename)
+    os.makedirs(cache_folder, exist_ok=True)
+    table.to_parquet(cache_filename + ".tmp", index=False) # write to a temporary file first so that an interrupted write can't leave a broken cache behind
+    os.replace(cache_filename + ".tmp", cache_filename)
+    with open(info_filename, "w") as f:
+        json.dump({"version": version, "files": sources}, f)
+    return table
+
+def excel_store_filenames(name: str) -> Tuple[str, str, str]:
+    """Returns the filenames of the table name (e.g. "players") in the primary store, of its Excel file and of the info file of the primary store
+    """
+    return name + ".parquet", name + ".xlsx", name + ".parquet.json"
+
+def excel_file_state(filename: str) -> dict:
+    return {"size": os.path.getsize(filename), "mtime_ns": os.stat(filename).st_mtime_ns, "sha256": file_sha256(filename)} if os.path.isfile(filename) else None
+
+def excel_file_changed(filename: str, state: dict) -> bool:
+    """Returns True if the content of the Excel file filename differs from state (see excel_file_state), a new modification time alone doesn't count as a change
+    """
+    if not os.path.isfile(filename):
+        return False
+    if state is None:
+        return True
+    if state["size"] == os.path.getsize(filename) and state["mtime_ns"] == os.stat(filename).st_mtime_ns:
+        return False
+    return state.get("sha256") != file_sha256(filename)
+
+def read_primary_table(name: str) -> pd.DataFrame:
+    """Returns the table name (e.g. "players") from the parquet file of the primary store, or None if it has to be read from the Excel file.
+    The Excel file is read instead if the info file of the primary store is missing or the content of the Excel file was changed (e.g. edited by hand) after the last export to Excel. If the primary store has been written since
+    the last export as well, a ValueError is raised, because reading either file would lose the changes of the other one.
+    """
+    parquet_filename, excel_filename, info_filename = excel_store_filenames(name)
+    if importlib.util.find_spec("pyarrow") is None or not os.path.isfile(parquet_filename):
+        return None
+    if not os.path.isfile(info_filename): # e.g. a fresh checkout with an old parquet file: the primary store is built again from the Excel file if there is one
+        return None if os.path.isfile(excel_filename) else pd.read_parquet(parquet_filename)
+    with open(info_filename) as f:
+        info = json.load(f)
+    if excel_file_changed(excel_filename, info.get("excel")):
+        if not info.get("exported_bool", False):
+            raise ValueError("Both \"{}\" and \"{}\" were changed since the last export to Excel. Delete \"{}\" to keep the changes in the Excel file, "
+                "or run export_excel([\"{}\"]) to overwrite the Excel file with the primary store.".format(excel_filename, parquet_filename, parquet_filename, os.path.basename(name)))
+        warnings.warn("\"{}\" was changed since the last export, it is read instead of \"{}\".".format(excel_filename, parquet_filename), UserWarning, stacklevel=2)
+        return None
+    return pd.read_parquet(parquet_filename)
+
+def write_primary_table(name: str, table: pd.DataFrame):
+    """Writes table to the parquet file of the primary store, which is read instead of the Excel file from now on (see read_primary_table)
+    """
+    parquet_filename, excel_filename, info_filename = excel_store_filenames(name)
+    table.to_parquet(parquet_filename + ".tmp", index = False) # write to a temporary file first so that an interrupted write can't leave a broken file behind
+    os.replace(parquet_filename + ".tmp", parquet_filename)
+    with open(info_filename, "w") as f:
+        json.dump({"excel": excel_file_state(excel_filename), "exported_bool": False}, f)
+
+def excel_export_done(name: str):
+    """Remembers that the Excel file of the table name has been written from the primary store, so it doesn't count as changed by hand
+    """
+    parquet_filename, excel_filename, info_filename = excel_store_filenames(name)
+    with open(info_filename, "w") as f:
+        json.dump({"excel": excel_file_state(excel_filename), "exported_bool": True}, f)
+
+def read_matches(cache_bool: bool = True) -> pd.DataFrame:
+    if cache_bool:
+        return read_cached_table("matches", ["matches_10_15.csv","matches_16_end.csv"], lambda: read_matches(cache_bool=False), \
+            version = reader_version(read_matches, match_id, matches_dtypes))
     M1 = pd.read_csv("matches_10_15.csv",dtype=matches_dtypes,parse_dates=["date"], encoding = "ISO-8859-1")
     M2 = pd.read_csv("matches_16_end.csv",dtype=matches_dtypes,parse_dates=["date"], encoding = "ISO-8859-1")
     M = pd.concat([M1,M2]).reset_index(drop=True)
@@ -82,7 +273,21 @@ def read_matches() -> pd.DataFrame:
             warnings.warn(warningmessage, UserWarning, stacklevel=2)
     return M
 
-def read_tournaments(filename: str = "tournaments.xlsx") -> pd.DataFrame:
+def read_match_scores(cache_bool: bool = True) -> pd.DataFrame:
+    """Returns parse_scores of the scores in the matches table (same row order as read_matches), cached like the matches table
+    """
+    if cache_bool:
+        return read_cached_table("match_scores", ["matches_10_15.csv","matches_16_end.csv"], lambda: read_match_scores(cache_bool=False), \
+            version = reader_version(read_match_scores, parse_scores, read_matches, matches_dtypes))
+    return parse_scores(tables.matches["score"])
+
+def read_tournaments(filename: str = "tournaments.xlsx", cache_bool: bool = True, store_bool: bool = True) -> pd.DataFrame:
+    T = read_primary_table(os.path.splitext(filename)[0]) if store_bool else None
+    if T is not None:
+        return T
+    if cache_bool:
+        return read_cached_table(os.path.splitext(os.path.basename(filename))[0], [filename], lambda: read_tournaments(filename, cache_bool=False, store_bool=False), \
+            version = reader_version(read_tournaments, tourney_id, tournaments_dtypes))
     T = pd.read_excel(filename,dtype=tournaments_dtypes,sheet_name="tournaments")
     T["id"] = tourney_id(T.year,T.name,T.date)
     duplicate_ids = T.loc[T.duplicated(["id"]),"id"]
@@ -102,7 +307,14 @@ def read_elos() -> pd.DataFrame:
     E = pd.read_csv('elos.csv',dtype=elos_dtypes)
     return E
 
-def read_players() -> pd.DataFrame:
+def read_players(cache_bool: bool = True, store_bool: bool = True) -> pd.DataFrame:
+    """Reads the players table from the primary store "players.parquet" (see write_player_table) or, if it doesn't exist or players.xlsx has been changed since, from players.xlsx
+    """
+    P = read_primary_table("players") if store_bool else None
+    if P is not None:
+        return P
+    if cache_bool:
+        return read_cached_table("players", ["players.xlsx"], lambda: read_players(cache_bool=False, store_bool=False), version = reader_version(read_players, players_dtypes))
     P = pd.read_excel("players.xlsx", sheet_name = "players", dtype = players_dtypes, parse_dates = ["birthday"])
     duplicate_ids = P.loc[P.duplicated(["id"]),"id"]
     if len(duplicate_ids)>10:
@@ -124,6 +336,172 @@ def read_cities() -> pd.DataFrame:
         warnings.warn("The column \"city\" in the table cities.csv is intended as a unique identifier but it has duplicate values.", UserWarning, stacklevel=2)
     return C 
 
+class TableLoader:
+    """Reads the tables of the database the first time they are needed and keeps them in memory afterwards, so that every file is parsed at most once per process.
+    E.g. tables.matches returns the same dataframe as read_matches(), but the csv files are only read on the first access.
+    The matches, tournaments and players tables get their integer keys when they are read (see add_keys).
+    """
+
+    def __init__(self):
+        self.readers = {"matches": read_matches, "scores": read_match_scores, "tournaments": read_tournaments, "cities": read_cities, "players": read_players}
+        self.loaded = {}
+
+    def get(self, name: str) -> pd.DataFrame:
+        if name not in self.loaded:
+            table = self.readers[name]()
+            self.loaded[name] = add_keys(name, table) if name in table_key_columns else table
+        return self.loaded[name]
+
+    def clear(self, name: str = None):
+        """Forgets the table name (or all tables if name is None), e.g. after the file has been changed, so that it is read again on the next access
+        """
+        if name is None:
+            self.loaded.clear()
+        else:
+            self.loaded.pop(name, None)
+
+    @property
+    def matches(self) -> pd.DataFrame:
+        return self.get("matches")
+
+    @property
+    def scores(self) -> pd.DataFrame:
+        return self.get("scores")
+
+    @property
+    def tournaments(self) -> pd.DataFrame:
+        return self.get("tournaments")
+
+    @property
+    def cities(self) -> pd.DataFrame:
+        return self.get("cities")
+
+    @property
+    def players(self) -> pd.DataFrame:
+        return self.get("players")
+
+tables = TableLoader()
+
+class KeyMap:
+    """Assigns stable int32 surrogate keys to the string ids of players, tournaments and matches, which stay the same between different runs of the program.
+    Keys are only assigned when the tables are read (add, see add_keys), the file keys/<kind>.csv is then rewritten while holding a lock file,
+    so that several programs can add keys at the same time. encode, codes and decode only look keys up.
+    E.g. keys.encode("players", M["winner_id"]) returns the keys of the winners, keys.decode("players", keys_array) returns the ids again.
+    """
+
+    kinds = ["players", "tournaments", "matches"]
+
+    def __init__(self, folder: str = "keys"):
+        self.folder = folder
+        self.loaded = {}
+
+    def filename(self, kind: str) -> str:
+        return os.path.join(self.folder, kind + ".csv")
+
+    def ids(self, kind: str) -> pd.Index:
+        """Returns all the ids of kind that have a key, the key of an id is its position
+        """
+        if kind not in self.kinds:
+            raise ValueError("kind has to be one of {}, not \"{}\".".format(self.kinds, kind))
+        if kind not in self.loaded:
+            if os.path.isfile(self.filename(kind)):
+                index = pd.Index(pd.read_csv(self.filename(kind), dtype = {"id": "str"}, keep_default_na = False)["id"])
+                if index.has_duplicates: # written by two programs at the same time by an older version
+                    warnings.warn("The file \"{}\" contains duplicate ids, only the first key of every id is used.".format(self.filename(kind)), UserWarning, stacklevel=2)
+                    index = index[~index.duplicated()]
+                self.loaded[kind] = index
+            else:
+                self.loaded[kind] = pd.Index([], dtype = "object")
+        return self.loaded[kind]
+
+    def encode(self, kind: str, ids, add_bool: bool = False) -> np.ndarray:
+        """Returns the keys of ids as int32 array. Missing ids (NaN or "") and unknown ids get the key -1.
+        If add_bool is True, unknown ids get new keys first (see add).
+        """
+        if add_bool:
+            return self.add(kind, ids)
+        ids = pd.Series(ids, dtype = "object").reset_index(drop = True)
+        return self.ids(kind).get_indexer(ids).astype(np.int32)
+
+    def codes(self, kind: str, *ids) -> list:
+        """Returns the keys of several lists of ids (one int32 array per list) like encode, but ids without a key (e.g. of a table that wasn't read through tables)
+        get codes after the last key instead of -1, the same code for the same id in all lists. These codes only hold for this call and nothing is saved.
+        """
+        values = pd.concat([pd.Series(np.asarray(i, dtype = "object")) for i in ids], ignore_index = True)
+        index = self.ids(kind)
+        codes = index.get_indexer(values)
+        unknown = (codes == -1) & values.notna().to_numpy() & (values != "").to_numpy()
+        if unknown.any():
+            codes[unknown] = len(index) + pd.factorize(values[unknown])[0]
+        return np.split(codes.astype(np.int32), np.cumsum([len(i) for i in ids])[:-1])
+
+    def add(self, kind: str, ids, timeout: float = 30) -> np.ndarray:
+        """Gives the unknown ids the next free keys and returns the keys of all ids like encode. The keys are read again from the file while holding the lock file
+        keys/<kind>.csv.lock (so keys added by another program in the meantime are kept) and the file is replaced at once with the new ids at the end.
+        """
+        ids = pd.Series(ids, dtype = "object").reset_index(drop = True)
+        codes = self.ids(kind).get_indexer(ids)
+        if not ((codes == -1) & ids.notna() & (ids != "")).any(): # the key of an id never changes, so the file only has to be read again for new ids
+            return codes.astype(np.int32)
+        os.makedirs(self.folder, exist_ok = True)
+        lock_filename = self.filename(kind) + ".lock"
+        start = time.time()
+        while True:
+            try:
+                lock = os.open(lock_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                if time.time() - start > timeout:
+                    raise TimeoutError("The lock file \"{}\" still exists after {} seconds. Delete it if no other program is running.".format(lock_filename, timeout))
+                time.sleep(0.05)
+        try:
+            self.loaded.pop(kind, None)
+            index = self.ids(kind)
+            codes = index.get_indexer(ids)
+            new = (codes == -1) & ids.notna() & (ids != "")
+            if new.any():
+                index = index.append(pd.Index(ids[new].unique()))
+                pd.DataFrame({"id": index}).to_csv(self.filename(kind) + ".tmp", index = False)
+                os.replace(self.filename(kind) + ".tmp", self.filename(kind))
+                self.loaded[kind] = index
+                codes = index.get_indexer(ids)
+        finally:
+            os.close(lock)
+            os.remove(lock_filename)
+        return codes.astype(np.int32)
+
+    def decode(self, kind: str, keys: np.ndarray) -> np.ndarray:
+        """Returns the ids belonging to keys, NaN for the key -1
+        """
+        ids = np.append(self.ids(kind).to_numpy(dtype = "object"), np.nan) # the key -1 picks the NaN at the end
+        return ids[np.asarray(keys)]
+
+keys = KeyMap()
+
+table_key_columns = {"matches": {"match_key": ("matches", "match_id"), "tourney_key": ("tournaments", "tourney_id"), "winner_key": ("players", "winner_id"), \
+    "loser_key": ("players", "loser_id"), "winner_previous_key": ("matches", "winner_previous_match"), "loser_previous_key": ("matches", "loser_previous_match")}, \
+    "tournaments": {"tourney_key": ("tournaments", "id")}, "players": {"player_key": ("players", "id")}} # key column -> (kind, id column) for every table
+key_column_names = sorted({column for columns in table_key_columns.values() for column in columns})
+
+def add_keys(name: str, table: pd.DataFrame, key_map: KeyMap = None) -> pd.DataFrame:
+    """Returns the table name ("matches", "tournaments" or "players") with the integer key columns of table_key_columns, e.g. winner_key for winner_id.
+    This is the ingestion step of KeyMap: ids that have no key yet get one (and are saved). Tables that already have the key columns are returned as they are.
+    The key columns are only kept in memory, drop them (key_column_names) before writing a table to a file.
+    """
+    key_columns = table_key_columns[name]
+    if set(key_columns).issubset(table.columns):
+        return table
+    key_map = key_map if key_map is not None else keys
+    table = table.copy()
+    for kind in key_map.kinds:
+        columns = [(key_column, id_column) for key_column, (key_kind, id_column) in key_columns.items() if key_kind == kind and id_column in table.columns]
+        if len(columns) == 0:
+            continue
+        codes = key_map.add(kind, pd.concat([table[id_column] for key_column, id_column in columns], ignore_index = True)) # one add per kind
+        for i, (key_column, id_column) in enumerate(columns):
+            table[key_column] = codes[i*len(table.index):(i+1)*len(table.index)]
+    return table
+
 def read_college_matches() -> pd.DataFrame:
     return pd.read_excel("college_tennis.xlsx",sheet_name="matches",dtype=matches_dtypes,parse_dates=["date"])
 
@@ -180,7 +558,7 @@ def winprobabilities_from_elo(surfaces: pd.Series, best_ofs: pd.Series, w_elo_be
         6*M.loc[best_of_5, "winner_setwinprob_surface"]**3*(1-M.loc[best_of_5, "winner_setwinprob_surface"])**2
     
     # Step 3 is to combine overall and surface specific winprobabilities
-    M["w_surface"] = 0 # Initialize as 0
+    M["w_surface"] = 0.0 # Initialize as 0
     M.loc[ M["surface"] == "Hard", "w_surface" ] = w_hard
     M.loc[ M["surface"] == "Clay", "w_surface" ] = w_clay
     high_tourney_levels={"ATP 1000","ATP 250","ATP 500","Minals","Grand Slam","Olympics"}
@@ -195,7 +573,7 @@ def tourney_id_to_year(tourney_ids: pd.Series):
     return (tourney_ids.str.slice(start=0,stop=4)).astype(int)
     
 
-def create_master_table(previous_columns_bool: bool = False, cities_bool: bool = False, matches_table: pd.DataFrame = read_matches(), tournaments_table: pd.DataFrame = read_tournaments(), cities_table: pd.DataFrame = read_cities()) -> pd.DataFrame:
+def create_master_table(previous_columns_bool: bool = False, cities_bool: bool = False, matches_table: pd.DataFrame = None, tournaments_table: pd.DataFrame = None, cities_table: pd.DataFrame = None) -> pd.DataFrame:
     """
     
     Args:
@@ -204,14 +582,26 @@ def create_master_table(previous_columns_bool: bool = False, cities_bool: bool =
         E (pandas dataframe): corresponds to elos.csv
         C (pandas dataframe): corresponds to cities.csv
         previous_columns_bool (boolean): If true, then the columns "winner_previous_surface", "loser_previous_surface", "winner_previous_won", "loser_previous_won", "winner_previous_score", "loser_previous_score" will be included in the final table
+        matches_table, tournaments_table, cities_table (pandas dataframes): if None, the tables are taken from tables (i.e. read from the files on first use)
     
     Returns:
         the table M joined with T, E and C
     """
 
+    if matches_table is None:
+        matches_table = tables.matches
+    if tournaments_table is None:
+        tournaments_table = tables.tournaments
+    if cities_table is None:
+        cities_table = tables.cities
+
+    # The tournaments are joined on the integer keys
+    matches_table = add_keys("matches", matches_table)
+    tournaments_table = add_keys("tournaments", tournaments_table)
     tournaments_table = tournaments_table.rename({"id": "tourney_id", "name": "tourney_name", "date": "tourney_date", "level": "tourney_level"}, axis=1)
+    tournaments_table = tournaments_table.drop(["tourney_id"], axis=1)
         
-    master_table = pd.merge(matches_table, tournaments_table, how = "left", left_on = "tourney_id", right_on = "tourney_id")
+    master_table = pd.merge(matches_table, tournaments_table, how = "left", on = "tourney_key")
 
     if cities_bool:
         C = cities_table.loc[:,["city","country","lat","long","elev"]]
@@ -220,38 +610,124 @@ def create_master_table(previous_columns_bool: bool = False, cities_bool: bool =
     master_table["year"] = tourney_id_to_year(master_table["tourney_id"])
 
     if previous_columns_bool:
-        matches_lookup = master_table.loc[:,["match_id","surface","winner_id","score","winner_elo","winner_elo_surface","loser_elo","loser_elo_surface"]]
-        matches_lookup_winner = matches_lookup.rename({"match_id": "winner_previous_match", "surface": "winner_previous_surface", "winner_id": "winner_previous_winner", \
+        # The Elos before the match are written by update_elo. Only for matches tables from before that, they have to be taken from the previous matches
+        elos_before_columns = ["winner_elo_before","loser_elo_before","winner_elo_surface_before","loser_elo_surface_before"]
+        elos_before_bool = set(elos_before_columns).issubset(master_table.columns)
+        if elos_before_bool:
+            master_table[elos_before_columns] = master_table[elos_before_columns].astype("float")
+        lookup_columns = ["surface","winner_id","score"] if elos_before_bool else ["surface","winner_id","score","winner_elo","winner_elo_surface","loser_elo","loser_elo_surface"]
+
+        # The previous matches are looked up by their integer keys: the row of every previous match is found by indexing an array, no join on the string ids is needed
+        matches_lookup = master_table.loc[:,lookup_columns]
+        match_keys = master_table["match_key"].to_numpy()
+        winner_previous_rows = key_positions(match_keys, master_table["winner_previous_key"].to_numpy())
+        loser_previous_rows = key_positions(match_keys, master_table["loser_previous_key"].to_numpy())
+
+        matches_lookup_winner = matches_lookup.reindex(winner_previous_rows).set_axis(master_table.index) # the row -1 does not exist, so the columns are NaN there
+        matches_lookup_winner = matches_lookup_winner.rename({"surface": "winner_previous_surface", "winner_id": "winner_previous_winner", \
             "score": "winner_previous_score", "winner_elo": "winner_previous_winner_elo", "winner_elo_surface": "winner_previous_winner_elo_surface", \
             "loser_elo": "winner_previous_loser_elo", "loser_elo_surface": "winner_previous_loser_elo_surface"}, axis=1)
-        master_table = pd.merge(master_table,matches_lookup_winner,how="left",on="winner_previous_match")
-
-        matches_lookup_loser = matches_lookup.rename({"match_id": "loser_previous_match", "surface": "loser_previous_surface", "winner_id": "loser_previous_winner", \
+        matches_lookup_loser = matches_lookup.reindex(loser_previous_rows).set_axis(master_table.index)
+        matches_lookup_loser = matches_lookup_loser.rename({"surface": "loser_previous_surface", "winner_id": "loser_previous_winner", \
            "score": "loser_previous_score", "winner_elo": "loser_previous_winner_elo", "winner_elo_surface": "loser_previous_winner_elo_surface", \
             "loser_elo": "loser_previous_loser_elo", "loser_elo_surface": "loser_previous_loser_elo_surface"}, axis=1)
-        master_table = pd.merge(master_table,matches_lookup_loser,how="left",on="loser_previous_match")
+        master_table = pd.concat([master_table,matches_lookup_winner,matches_lookup_loser],axis=1)
 
-        master_table["winner_previous_won"] = (master_table["winner_id"]==master_table["winner_previous_winner"])
-        master_table.loc[master_table["winner_previous_match"].isnull(),"winner_previous_won"] = np.nan
+        master_table["winner_previous_won"] = (master_table["winner_id"]==master_table["winner_previous_winner"]).where(master_table["winner_previous_match"].notna()) # NaN if there is no previous match
 
-        master_table["loser_previous_won"] = (master_table["loser_id"]==master_table["loser_previous_winner"])
-        master_table.loc[master_table["loser_previous_match"].isnull(),"loser_previous_won"] = np.nan
+        master_table["loser_previous_won"] = (master_table["loser_id"]==master_table["loser_previous_winner"]).where(master_table["loser_previous_match"].notna()) # NaN if there is no previous match
 
-        master_table["winner_elo_before"] = np.where(master_table['winner_previous_won'], master_table["winner_previous_winner_elo"], np.where(master_table['winner_previous_won'] == False, master_table["winner_previous_loser_elo"], np.nan))
-        master_table["loser_elo_before"] = np.where(master_table['loser_previous_won'], master_table["loser_previous_winner_elo"], np.where(master_table['loser_previous_won'] == False, master_table["loser_previous_loser_elo"], np.nan))
-        master_table["winner_elo_surface_before"] = np.where(master_table['winner_previous_won'], master_table["winner_previous_winner_elo_surface"], np.where(master_table['winner_previous_won'] == False, master_table["winner_previous_loser_elo_surface"], np.nan))
-        master_table["loser_elo_surface_before"] = np.where(master_table['loser_previous_won'], master_table["loser_previous_winner_elo_surface"], np.where(master_table['loser_previous_won'] == False, master_table["loser_previous_loser_elo_surface"], np.nan))
+        if not elos_before_bool:
+            master_table["winner_elo_before"] = np.where(master_table['winner_previous_won'], master_table["winner_previous_winner_elo"], np.where(master_table['winner_previous_won'] == False, master_table["winner_previous_loser_elo"], np.nan))
+            master_table["loser_elo_before"] = np.where(master_table['loser_previous_won'], master_table["loser_previous_winner_elo"], np.where(master_table['loser_previous_won'] == False, master_table["loser_previous_loser_elo"], np.nan))
+            master_table["winner_elo_surface_before"] = np.where(master_table['winner_previous_won'], master_table["winner_previous_winner_elo_surface"], np.where(master_table['winner_previous_won'] == False, master_table["winner_previous_loser_elo_surface"], np.nan))
+            master_table["loser_elo_surface_before"] = np.where(master_table['loser_previous_won'], master_table["loser_previous_winner_elo_surface"], np.where(master_table['loser_previous_won'] == False, master_table["loser_previous_loser_elo_surface"], np.nan))
 
         master_table = master_table.drop(["winner_previous_winner", "loser_previous_winner", "winner_previous_winner_elo", \
             "winner_previous_loser_elo", "winner_previous_winner_elo_surface", "winner_previous_loser_elo_surface", \
-            "loser_previous_winner_elo", "loser_previous_loser_elo", "loser_previous_winner_elo_surface", "loser_previous_loser_elo_surface"], axis=1)
+            "loser_previous_winner_elo", "loser_previous_loser_elo", "loser_previous_winner_elo_surface", "loser_previous_loser_elo_surface"], axis=1, errors="ignore")
         
         master_table["winner_winprob_elo"] = winprobabilities_from_elo(master_table["surface"],master_table["best_of"], master_table["winner_elo_before"], master_table["loser_elo_before"], \
             master_table["winner_elo_surface_before"], master_table["loser_elo_surface_before"], master_table["tourney_level"])
 
     return master_table
 
+class TennisDatabase:
+    """The tables matches, tournaments, players and cities of the ER diagram in an SQLite database, with indexes on the player ids, tourney ids and dates.
+    Questions about some players or a date range are answered with indexed queries, so the master table doesn't have to be built in memory for them.
+    E.g. TennisDatabase().head_to_head("rafael nadal-es-86", "novak djokovic-se-87") returns all the matches between Nadal and Djokovic.
+    The matches table has the additional column date2 (the date, or the date of the tournament if it is missing) like in sort_matches_table.
+    """
+
+    indexes = {"matches": ["winner_id", "loser_id", "tourney_id", "date2", "match_id"], "tournaments": ["id", "date"], "players": ["id", "name"], "cities": ["city"]}
+    date_columns = {"matches": ["date", "date2", "tourney_date"], "tournaments": ["date"], "players": ["birthday"], "cities": []}
+    tournament_columns = "t.name AS tourney_name, t.level AS tourney_level, t.surface, t.date AS tourney_date, t.city" # the columns of the tournament joined to every match
+
+    def __init__(self, filename: str = "tennis.sqlite"):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+
+    def close(self):
+        self.connection.close()
+
+    def build(self, matches_table: pd.DataFrame = None, tournaments_table: pd.DataFrame = None, players_table: pd.DataFrame = None, cities_table: pd.DataFrame = None):
+        """Writes the tables to the database (replacing the old ones) and creates the indexes. Tables that are None are taken from tables (i.e. read from the files on first use)
+        """
+        T = tournaments_table if tournaments_table is not None else tables.tournaments
+        M = (matches_table if matches_table is not None else tables.matches).copy()
+        T = add_keys("tournaments", T)
+        M = add_keys("matches", M)
+        tourney_rows = key_positions(T["tourney_key"].to_numpy(), M["tourney_key"].to_numpy())
+        M["date2"] = pd.to_datetime(M["date"]).fillna(pd.to_datetime(T["date"]).reindex(tourney_rows).set_axis(M.index))
+        database_tables = {"matches": M, "tournaments": T, "players": players_table if players_table is not None else tables.players, \
+            "cities": cities_table if cities_table is not None else tables.cities}
+        for name, table in database_tables.items():
+            table.to_sql(name, self.connection, if_exists = "replace", index = False, chunksize = 10000)
+            for column in self.indexes[name]:
+                self.connection.execute("CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({1})".format(name, column))
+        self.connection.commit()
+
+    def query(self, sql: str, parameters: tuple = (), date_columns: list = None) -> pd.DataFrame:
+        """Returns the result of the query sql (with ? as placeholders for parameters) as dataframe, the columns in date_columns are parsed as dates
+        """
+        return pd.read_sql_query(sql, self.connection, params = parameters, parse_dates = date_columns)
+
+    def read_table(self, name: str) -> pd.DataFrame:
+        """Returns the whole table name like read_matches, read_tournaments, read_players and read_cities
+        """
+        if name not in self.indexes:
+            raise ValueError("name has to be one of {}, not \"{}\".".format(list(self.indexes), name))
+        return self.query("SELECT * FROM {}".format(name), date_columns = [column for column in self.date_columns[name] if column != "tourney_date"])
+
+    def date_range_condition(self, start: datetime = None, end: datetime = None) -> Tuple[str, tuple]:
+        # The dates are stored as text "YYYY-MM-DD HH:MM:SS", the bounds have to be in the same format (a number like "9999" would be compared as number)
+        start = str(pd.Timestamp(start)) if start is not None else "0001-01-01 00:00:00"
+        end = str(pd.Timestamp(end)) if end is not None else "9999-12-31 23:59:59"
+        return "m.date2 >= ? AND m.date2 < ?", (start, end)
+
+    def player_matches(self, player_id: str, start: datetime = None, end: datetime = None) -> pd.DataFrame:
+        """Returns the matches of the player from start (inclusive) to end (exclusive) with the columns of the tournament, in chronological order
+        """
+        condition, dates = self.date_range_condition(start, end)
+        return self.query("SELECT m.*, {} FROM matches m LEFT JOIN tournaments t ON t.id = m.tourney_id WHERE (m.winner_id = ? OR m.loser_id = ?) AND {} ORDER BY m.date2".format(\
+            self.tournament_columns, condition), (player_id, player_id) + dates, self.date_columns["matches"])
+
+    def head_to_head(self, player1_id: str, player2_id: str, start: datetime = None, end: datetime = None) -> pd.DataFrame:
+        """Returns the matches between the two players from start (inclusive) to end (exclusive) with the columns of the tournament, in chronological order
+        """
+        condition, dates = self.date_range_condition(start, end)
+        return self.query("SELECT m.*, {} FROM matches m LEFT JOIN tournaments t ON t.id = m.tourney_id WHERE ((m.winner_id = ? AND m.loser_id = ?) OR (m.winner_id = ? AND m.loser_id = ?)) AND {} ORDER BY m.date2".format(\
+            self.tournament_columns, condition), (player1_id, player2_id, player2_id, player1_id) + dates, self.date_columns["matches"])
+
+    def matches_between(self, start: datetime = None, end: datetime = None) -> pd.DataFrame:
+        """Returns all the matches from start (inclusive) to end (exclusive) with the columns of the tournament, in chronological order
+        """
+        condition, dates = self.date_range_condition(start, end)
+        return self.query("SELECT m.*, {} FROM matches m LEFT JOIN tournaments t ON t.id = m.tourney_id WHERE {} ORDER BY m.date2".format(self.tournament_columns, condition), \
+            dates, self.date_columns["matches"])
+
 def prediction_metrics(winner_winprobabilities: pd.Series, years: pd.Series):
+    from sklearn.metrics import log_loss, brier_score_loss, mean_absolute_error # imported here because importing sklearn takes longer than everything else in this module
     M = pd.DataFrame({"winner_winprob_elo": winner_winprobabilities[winner_winprobabilities.notna()], "year": years[winner_winprobabilities.notna()]})
     outcomes = np.random.choice([0,1], size=len(M), p=[0.5, 0.5])
     predictions = np.where(outcomes==1, M["winner_winprob_elo"], 1-M["winner_winprob_elo"])
@@ -261,6 +737,7 @@ def prediction_metrics(winner_winprobabilities: pd.Series, years: pd.Series):
     return brierscore, log_score, mae
 
 def brierscore(winner_winprobabilities_comb: pd.Series, years: pd.Series):
+    from sklearn.metrics import log_loss, brier_score_loss, mean_absolute_error
     M = pd.DataFrame({"winner_winprob_comb": winner_winprobabilities_comb, "year": years})
     M = M.loc[~M["year"].isna(),:]
     brierscore_total = np.mean(((1-winner_winprobabilities_comb)**2))
@@ -374,23 +851,8 @@ def sets_won_by_player(scores: pd.Series):
         the two
     """
 
-    #scores_df = scores.str.split().apply(pd.Series) # produces a table, the entry in cell (i,j) is the i-th set of the j-th score
-    scores_df = scores.str.split(' ', expand=True)
-    m = len(scores_df.columns)
-    winner_no_setswon = np.zeros(len(scores)).astype(int) # initialize with zeros
-    loser_no_setswon = np.zeros(len(scores)).astype(int)
-    # For each column (i.e. for each set) find out who won that set, using the setwinner function and add the result to winner_setswon and loser_setswon
-    set_number = 1
-    for set in scores_df.columns:
-        if set_number > 5:
-            break
-        sets = scores_df.loc[:,set]
-        setwinner_names = setwinner(sets)
-        winner_no_setswon[setwinner_names == "winner"] = winner_no_setswon[setwinner_names == "winner"] + 1
-        loser_no_setswon[setwinner_names == "loser"] = loser_no_setswon[setwinner_names == "loser"] + 1
-        set_number += 1
-
-    return winner_no_setswon, loser_no_setswon
+    S = parse_scores(scores)
+    return S["winner_setswon"].to_numpy().astype(int), S["loser_setswon"].to_numpy().astype(int)
 
 def elo_factors(elo: float, match_number: int, recentmatches: int, penaltyfactor: float = 0.98):
     
@@ -443,13 +905,21 @@ def elo_new(w_elo_old: float, l_elo_old: float, w_K: float, l_K: float, w_setswo
     
     return w_elo_new, l_elo_new
 
+def key_positions(keys_lookup: np.ndarray, keys_searched: np.ndarray) -> np.ndarray:
+    """Returns for every key in keys_searched its position in keys_lookup (-1 if it is not there) by indexing an array instead of a hash join.
+    The keys are non-negative integers (see KeyMap), -1 means missing.
+    """
+    size = max(keys_lookup.max(initial = -1), keys_searched.max(initial = -1)) + 2
+    positions = np.full(size, -1, dtype = np.int64)
+    positions[keys_lookup[keys_lookup >= 0]] = np.flatnonzero(keys_lookup >= 0)
+    positions[-1] = -1 # the key -1 (missing id) is found nowhere
+    return positions[keys_searched]
+
 def winner_and_loser_row(winner_ids, loser_ids, ids_lookup):
-    df_winner = pd.DataFrame({"winner_id": ids_lookup, "winner_row": range(len(ids_lookup))})
-    df_loser = pd.DataFrame({"loser_id": ids_lookup, "loser_row": range(len(ids_lookup))})
-    df_left = pd.DataFrame({"winner_id": winner_ids, "loser_id": loser_ids})
-    df_merged = pd.merge(df_left, df_winner , how = "left", on = "winner_id")
-    df_merged = pd.merge(df_merged, df_loser, how = "left", on = "loser_id")
-    return df_merged.winner_row, df_merged.loser_row
+    player_keys, winner_keys, loser_keys = keys.codes("players", ids_lookup, winner_ids, loser_ids)
+    winner_rows = key_positions(player_keys, winner_keys)
+    loser_rows = key_positions(player_keys, loser_keys)
+    return pd.Series(winner_rows, name = "winner_row"), pd.Series(loser_rows, name = "loser_row")
 
 def fill_player_table(ids_total: set, P: pd.DataFrame, initial_elo: float):
     """ Adds rows and columns to the dataframe P, if necessary
@@ -481,10 +951,54 @@ def fill_player_table(ids_total: set, P: pd.DataFrame, initial_elo: float):
     return P_all
 
 
+def prepare_elo_matches(match_ids: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series, scores: pd.Series, tourney_dates: pd.Series, \
+    dates: pd.Series, surfaces: pd.Series, tourney_levels: pd.Series, rounds: pd.Series, best_ofs: pd.Series = None, score_table: pd.DataFrame = None) -> pd.DataFrame:
+    """Puts the match data needed by the Elo algorithm into one table, drops the rows the algorithm can't use, sorts it chronologically and adds the number of sets won by each player
+    If best_ofs is given, it is included as the column "best_of" (needed for win probabilities).
+    If score_table is given (parse_scores of scores in the same row order, e.g. tables.scores for the matches table), the sets won are taken from it instead of parsing the scores again.
+    
+    Returns:
+        M (pandas dataframe): the sorted table, including the columns "date2", "winner_setswon" and "loser_setswon"
+    """
+
+    # Create a dataframe from all the pandas series
+    M = pd.DataFrame({"match_id": match_ids, "winner_id": winner_ids, "loser_id": loser_ids, "score": scores, "tourney_date": tourney_dates, \
+        "date": dates, "surface": surfaces, "tourney_level": tourney_levels, "round": rounds})
+    if best_ofs is not None:
+        M["best_of"] = best_ofs
+    if score_table is not None:
+        if len(score_table.index) != len(M.index):
+            raise ValueError("score_table has {} rows, but there are {} matches.".format(len(score_table.index), len(M.index)))
+        M["winner_setswon"] = score_table["winner_setswon"].to_numpy(dtype=int)
+        M["loser_setswon"] = score_table["loser_setswon"].to_numpy(dtype=int)
+    
+    # Delete rows of M that do not need basic sanity checks
+    M = M.loc[(M["surface"] == "Hard") | (M["surface"] == "Clay") | (M["surface"] == "Grass") | (M["surface"] =="Carpet") ,:].reset_index(drop=True) # surface missing or does not make sense
+    M = M[~(M["match_id"].duplicated(keep=False))] # match_id duplicated
+
+    # Sort the table chronologically
+    M = sort_matches_table(M,drop_date2=False)
+    
+    # Calculate sets won by each player (we need this because we use a set-based algorithm)
+    if score_table is None:
+        M["winner_setswon"], M["loser_setswon"] = sets_won_by_player(M["score"])
+
+    return M
+
+
+def recent_matches_in_window(window: deque, date_cutoff: datetime) -> int:
+    """Removes the dates before date_cutoff from the start of window (a deque of dates in chronological order) and returns the number of remaining dates
+    Every date is removed at most once, so on average this takes constant time.
+    """
+    while len(window) > 0 and window[0] < date_cutoff:
+        window.popleft()
+    return len(window)
+
 def update_elo(match_ids: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series, scores: pd.Series, tourney_dates: pd.Series, \
     dates: pd.Series, surfaces: pd.Series, tourney_levels: pd.Series, rounds: pd.Series, player_table: pd.DataFrame, c: float = 250, \
     c_hard: float = 280, c_clay: float = 300, c_grass: float = 350, o: float = 20, s1: float = 0.6, initial_elo: float = 1400, \
-    recentdays_range: int = 75, penaltyfactor: float = 0.98) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    recentdays_range: int = 75, penaltyfactor: float = 0.98, fast_bool: bool = False, checkpoint_bool: bool = False, score_table: pd.DataFrame = None, \
+    processed_match_ids: pd.Series = None, start_table: pd.DataFrame = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
     
     """A function that calculates the Elo ratings for a given dataframe M and given parameters.
 
@@ -512,36 +1026,55 @@ def update_elo(match_ids: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series
         initial_elo (float): Elo rating assigned to new players (i.e. players that do not appear in player_table)
         recentdays_range (int): If player hasn't played a single match during this number of days, then we make his rating lower
         penaltyfactor (float): Parameter to determine how severely we punish absence
+        fast_bool (boolean): If true, the ratings are calculated by update_elo_arrays instead of the loop below (same results, much faster)
+        checkpoint_bool (boolean): If true, player_table can be a checkpoint from read_elo_checkpoint. Only the matches that are not in the checkpoint are processed and P contains the columns "recent_dates" and "last_matches", so it can be written as the new checkpoint with write_elo_checkpoint. Implies fast_bool
+        score_table (pandas dataframe): parse_scores of scores (e.g. tables.scores), see prepare_elo_matches
+        processed_match_ids (pd.Series): the ids of all the matches included in the checkpoint player_table (see read_checkpoint_match_ids). If given, exactly the other matches are processed,
+            otherwise the matches after the date of the checkpoint (and the ones on that date that are not in its column "last_matches")
+        start_table (pd.DataFrame): the player table to start from if the checkpoint can't be continued because there are matches dated before its last match that it doesn't include
+            (e.g. added later). Then all the matches are processed again from start_table with a warning, without start_table a ValueError is raised
     
     Returns:
-        N (pandas dataframe): A match by match table with the columns "match_id", "winner_previous_match", "loser_previous_match", "winner_elo", "loser_elo", "winner_elo_surface" and "loser_elo_surface"
+        N (pandas dataframe): A match by match table with the columns "match_id", "winner_previous_match", "loser_previous_match", "winner_elo", "loser_elo", "winner_elo_surface" and "loser_elo_surface" (the Elos after the match)
+            and "winner_elo_before", "loser_elo_before", "winner_elo_surface_before" and "loser_elo_surface_before" (the Elos before the match, NaN if the player has no previous match)
         P (pandas dataframe): An updated version of player_table with the final ratings and match numbers
     """
 
-    # Create a dataframe from all the pandas series
-    M = pd.DataFrame({"match_id": match_ids, "winner_id": winner_ids, "loser_id": loser_ids, "score": scores, "tourney_date": tourney_dates, \
-        "date": dates, "surface": surfaces, "tourney_level": tourney_levels, "round": rounds})
-    
-    # Delete rows of M that do not need basic sanity checks
-    M = M.loc[(M["surface"] == "Hard") | (M["surface"] == "Clay") | (M["surface"] == "Grass") | (M["surface"] =="Carpet") ,:].reset_index(drop=True) # surface missing or does not make sense
-    M = M[~(M["match_id"].duplicated(keep=False))] # match_id duplicated
-
-    # Sort the table chronologically and delete the columns "round", "date" and "tourney_date" because not needed anymore
-    M = sort_matches_table(M,drop_date2=False)
-    
-    # Calculate sets won by each player (we need this because we use a set-based algorithm)
-    M["winner_setswon"], M["loser_setswon"] = sets_won_by_player(M["score"])
+    # Filter, sort and add the sets won by each player
+    M = prepare_elo_matches(match_ids, winner_ids, loser_ids, scores, tourney_dates, dates, surfaces, tourney_levels, rounds, score_table = score_table)
+
+    # If we continue from a checkpoint, the matches up to the checkpoint are already included in the ratings
+    # Matches without a date have the date of the tournament, so the matches on the last date of the checkpoint are told apart by their ids
+    if checkpoint_bool:
+        last_date = checkpoint_date(player_table)
+        if pd.notna(last_date) and processed_match_ids is not None:
+            unprocessed = ~M["match_id"].isin(processed_match_ids)
+            if (unprocessed & (M["date2"] < last_date)).any(): # the ratings after these matches would have to change as well
+                message = "{} matches are dated before the last match of the checkpoint ({}) but are not included in it.".format((unprocessed & (M["date2"] < last_date)).sum(), last_date.date())
+                if start_table is None:
+                    raise ValueError(message + " Calculate the ratings from scratch without the checkpoint.")
+                warnings.warn(message + " All the ratings are calculated from scratch.", UserWarning, stacklevel=2)
+                player_table = start_table
+            else:
+                M = M.loc[unprocessed,:].reset_index(drop=True)
+        elif pd.notna(last_date) and "last_matches" in player_table.columns:
+            M = M.loc[(M["date2"] >= last_date) & ~M["match_id"].isin(checkpoint_match_ids(player_table)),:].reset_index(drop=True)
+        elif pd.notna(last_date): # checkpoint from before the column "last_matches" existed
+            M = M.loc[M["date2"] > last_date,:].reset_index(drop=True)
     
     # Create dataframe P that contains both the players from player_table and all the other players
     ids_total = set(M["winner_id"]).union(set(M["loser_id"]))
     P = fill_player_table(ids_total,player_table,initial_elo)
 
+    if fast_bool or checkpoint_bool:
+        return update_elo_arrays(M, P, c, c_hard, c_clay, c_grass, o, s1, recentdays_range, penaltyfactor, checkpoint_bool)
+
     # Convert P to a numpy array (will be much faster than pandas dataframe, we will convert it back in the end)
     P_arr = np.array(P.values)
 
-    # Create a dataframe that stores for each player the row indexes of M where that player appears
+    # Create a list that stores for each player the dates of their recent matches (in chronological order)
     # It will become clear later why we need this
-    players_row_indexes_in_M = pd.DataFrame({"list_of_indexes": [[] for _ in range(len(P.index))]}) # Initialize with only empty lists
+    recent_dates = [deque() for _ in range(len(P.index))] # Initialize with only empty deques
 
     # Add columns "winner_row" and "loser_row" to M (they tell us at which position in P the winner and loser are located respectively)
     M["winner_row"], M["loser_row"] = winner_and_loser_row(M["winner_id"],M["loser_id"],P["id"])
@@ -555,14 +1088,11 @@ def update_elo(match_ids: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series
     M = M.drop(["score","winner_id","loser_id","round","date","tourney_date"], axis=1)
 
     # Initialize the dataframe N (as with P, we work with a numpy array and will convert to pandas dataframe in the end)
-    N_arr = np.zeros((len(M.index), 7), dtype=object)
+    N_arr = np.zeros((len(M.index), 11), dtype=object)
     N_arr[:, 0] = "tmp"
     N_arr[:,5] = "tmp"
     N_arr[:,6] = "tmp"
 
-    # Create numpy array with the dates (we also do this because it's faster than accessing the column in M)
-    dates_arr = np.array(M["date2"].values)
-
     # Start iterating over rows of M
     for i, row in tqdm(M.iterrows(), total=M.shape[0]):
         
@@ -587,6 +1117,10 @@ def update_elo(match_ids: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series
         l_elo_old_surface = P_arr[loser_row,surface_elo_column_index]
         w_match_number_surface = P_arr[winner_row,(surface_elo_column_index+1)]
         l_match_number_surface = P_arr[loser_row,(surface_elo_column_index+1)]
+
+        # Remember the Elos before the match (before the penalty for absence), they are needed for the win probabilities
+        w_elos_before = (w_elo_old, w_elo_old_surface) if w_previous_match != "" else (np.nan, np.nan)
+        l_elos_before = (l_elo_old, l_elo_old_surface) if l_previous_match != "" else (np.nan, np.nan)
     
         # Calculate the K factors for winner and loser, both for the overall elo and the surface specific elo (so 4 different K's in total)
         w_K = K_factor(w_match_number,c,o,s1)
@@ -595,26 +1129,22 @@ def update_elo(match_ids: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series
         l_K_surface = K_factor(l_match_number_surface,c_surface,o,s1)
         
         # Calculate number of recent matches
-        # Since going through the whole dataframe to find out the number of matches would be highly inefficient, we make use of the dataframe df:
-        # In row winner_row of df, there's a list of all the row indexes where winner_id appears. So we only need to go through these indexes.
-        # That way, instead of going through a dataframe of more than 300k rows in each step, we go through dataframes of at most 1k rows.
+        # Since going through the whole dataframe to find out the number of matches would be highly inefficient, we make use of the list recent_dates:
+        # In position winner_row of recent_dates, there's a deque with the dates of the winner's matches. Because M is sorted chronologically, a date that is
+        # too old for the current match will also be too old for all later matches, so we can drop it for good and the length of the deque is the number of recent matches.
         
         date_cutoff = date2-timedelta(days=recentdays_range) # The date that was recentdays_range number of days in the past
 
         if w_match_number >= 40 or l_match_number >= 40: # only need to do this if at least one of the players has match_number >= 40
             if w_match_number>= 40 and l_match_number >=40:
-                df_sub_winner = dates_arr[players_row_indexes_in_M.at[winner_row,"list_of_indexes"]]
-                w_recentmatches = sum(df_sub_winner>=date_cutoff)
-                df_sub_loser = dates_arr[players_row_indexes_in_M.at[loser_row,"list_of_indexes"]]
-                l_recentmatches = sum(df_sub_loser>=date_cutoff)
+                w_recentmatches = recent_matches_in_window(recent_dates[winner_row],date_cutoff)
+                l_recentmatches = recent_matches_in_window(recent_dates[loser_row],date_cutoff)
             elif w_match_number >= 40 and l_match_number < 40:
-                df_sub_winner = dates_arr[players_row_indexes_in_M.at[winner_row,"list_of_indexes"]]
-                w_recentmatches = sum(df_sub_winner>=date_cutoff)
+                w_recentmatches = recent_matches_in_window(recent_dates[winner_row],date_cutoff)
                 l_recentmatches = 1
             elif w_match_number < 40 and l_match_number >= 40:
                 w_recentmatches = 1
-                df_sub_loser = dates_arr[players_row_indexes_in_M.at[loser_row,"list_of_indexes"]]
-                l_recentmatches = sum(df_sub_loser>=date_cutoff)
+                l_recentmatches = recent_matches_in_window(recent_dates[loser_row],date_cutoff)
             w_activityfactor, w_penaltyfactor = elo_factors(w_elo_old,w_match_number,w_recentmatches,penaltyfactor)
             l_activityfactor, l_penaltyfactor = elo_factors(l_elo_old,l_match_number,l_recentmatches,penaltyfactor)
             w_K *= w_activityfactor
@@ -624,9 +1154,9 @@ def update_elo(match_ids: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series
             w_elo_old *= w_penaltyfactor
             l_elo_old *= l_penaltyfactor
         
-        # Update df by appending the row of the current match to the two lists
-        players_row_indexes_in_M.at[winner_row,"list_of_indexes"].append(i)
-        players_row_indexes_in_M.at[loser_row,"list_of_indexes"].append(i)
+        # Update recent_dates by appending the date of the current match to the two deques
+        recent_dates[winner_row].append(date2)
+        recent_dates[loser_row].append(date2)
         
         # Results at exhibition tournaments are less indicative of player strength than any other tournament category.
         # Therefore, we reduce all the K factors (namely divide by 2)
@@ -641,7 +1171,8 @@ def update_elo(match_ids: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series
         winner_elo_new_surface, loser_elo_new_surface = elo_new(w_elo_old_surface, l_elo_old_surface, w_K_surface, l_K_surface, winner_setswon, loser_setswon )
         
         # Write everything to the i-th row of N
-        N_arr[i] = (match_id_current, winner_elo_new, loser_elo_new, winner_elo_new_surface, loser_elo_new_surface, w_previous_match, l_previous_match)
+        N_arr[i] = (match_id_current, winner_elo_new, loser_elo_new, winner_elo_new_surface, loser_elo_new_surface, w_previous_match, l_previous_match, \
+            w_elos_before[0], l_elos_before[0], w_elos_before[1], l_elos_before[1])
         
         # Write everything to P
         P_arr[winner_row,1] = winner_elo_new
@@ -656,22 +1187,1150 @@ def update_elo(match_ids: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series
         P_arr[loser_row,surface_elo_column_index] = loser_elo_new_surface
         P_arr[loser_row,(surface_elo_column_index+1)] = l_match_number_surface + 1
 
-    
+
+    return elo_output_tables(N_arr, P_arr)
+
+
+def elo_output_tables(N_arr: np.ndarray, P_arr: np.ndarray) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Converts the numpy arrays N_arr and P_arr used inside update_elo back to the dataframes N and P (P sorted by overall Elo)
+    """
+
     N = pd.DataFrame(N_arr)
     N = N.rename({0: "match_id", 1: "winner_elo", 2: "loser_elo", 3: "winner_elo_surface", 4: "loser_elo_surface", 5: "winner_previous_match", \
-        6: "loser_previous_match"}, axis=1)
+        6: "loser_previous_match", 7: "winner_elo_before", 8: "loser_elo_before", 9: "winner_elo_surface_before", 10: "loser_elo_surface_before"}, axis=1)
     
     P = pd.DataFrame(P_arr)
     P = P.rename({0: "id", 1: "elo_overall", 2: "match_number", 3: "elo_hard", 4: "match_number_hard", 5: "elo_clay", 6: "match_number_clay", \
-        7: "elo_grass", 8: "match_number_grass", 9: "previous_match"}, axis=1)
+        7: "elo_grass", 8: "match_number_grass", 9: "previous_match", 10: "recent_dates", 11: "last_matches"}, axis=1)
     P = P.sort_values(by=["elo_overall"], ascending = False)
     P = P.reset_index(drop=True)
 
     return N, P
 
+@njit(cache=True)
+def recent_matches_number(player_row, last_match, date_cutoff, winner_rows, previous_matches, dates, window_offsets, window_dates):
+    """Counts the matches of the player in row player_row of P that were played on or after date_cutoff
+    Starting from the player's last match, we follow the chain of previous matches backwards until we reach a match before date_cutoff. Since the matches are sorted chronologically, we only look at the recent matches.
+    If we reach the start of the chain, we continue with the player's dates from the checkpoint (window_dates[window_offsets[player_row]:window_offsets[player_row+1]], sorted ascending).
+    """
+    recentmatches = 0
+    j = last_match
+    while j >= 0:
+        if dates[j] < date_cutoff:
+            return recentmatches
+        recentmatches += 1
+        if winner_rows[j] == player_row:
+            j = previous_matches[j,0]
+        else:
+            j = previous_matches[j,1]
+    k = window_offsets[player_row+1] - 1
+    while k >= window_offsets[player_row] and window_dates[k] >= date_cutoff:
+        recentmatches += 1
+        k -= 1
+    return recentmatches
+
+@njit(cache=True)
+def elo_kernel(winner_rows, loser_rows, surface_columns, exhibition, dates, winner_setswon, loser_setswon, ratings, match_numbers, last_matches, \
+    window_offsets, window_dates, c_surfaces, c, o, s1, recentdays_range, penaltyfactor):
+    """The loop of update_elo on typed numpy arrays. The formulas are the same as in K_factor, elo_factors and elo_new and are applied in the same order, so the results are identical.
+    
+    Args:
+        winner_rows, loser_rows (int arrays): the rows of the winner and loser in ratings and match_numbers
+        surface_columns (int array): 1 for hard, 2 for clay and 3 for grass/carpet matches
+        exhibition (bool array): True for matches at exhibition tournaments
+        dates (int64 array): the variable date2 in nanoseconds
+        winner_setswon, loser_setswon (int arrays): the number of sets won by winner and loser
+        ratings (float64 array): one row per player with the columns overall, hard, clay and grass Elo, updated in place
+        match_numbers (int32 array): same as ratings but with the match numbers
+        last_matches (int64 array): for each player the index of their last match in this run (-1 if none yet), updated in place
+        window_offsets, window_dates (int64 arrays): the dates of the players' recent matches from the checkpoint, see recent_matches_number
+        c_surfaces (float64 array): c for overall Elo followed by c_hard, c_clay and c_grass
+        recentdays_range (int64): the variable recentdays_range in nanoseconds
+    
+    Returns:
+        N_ratings (float64 array): winner_elo, loser_elo, winner_elo_surface and loser_elo_surface after each match
+        N_ratings_before (float64 array): the same ratings before each match (before the penalty for inactivity)
+        previous_matches (int64 array): the index of the previous match of winner and loser (-1 if the player had no match before in this run)
+    """
+    n = len(winner_rows)
+    N_ratings = np.empty((n, 4))
+    N_ratings_before = np.empty((n, 4))
+    previous_matches = np.empty((n, 2), dtype=np.int64)
+
+    for i in range(n):
+        winner_row = winner_rows[i]
+        loser_row = loser_rows[i]
+        s = surface_columns[i]
+
+        w_elo_old = ratings[winner_row,0]
+        l_elo_old = ratings[loser_row,0]
+        w_match_number = match_numbers[winner_row,0]
+        l_match_number = match_numbers[loser_row,0]
+        w_elo_old_surface = ratings[winner_row,s]
+        l_elo_old_surface = ratings[loser_row,s]
+        w_match_number_surface = match_numbers[winner_row,s]
+        l_match_number_surface = match_numbers[loser_row,s]
+        N_ratings_before[i,0] = w_elo_old
+        N_ratings_before[i,1] = l_elo_old
+        N_ratings_before[i,2] = w_elo_old_surface
+        N_ratings_before[i,3] = l_elo_old_surface
+
+        w_K = c/(w_match_number+o)**s1
+        l_K = c/(l_match_number+o)**s1
+        w_K_surface = c_surfaces[s]/(w_match_number_surface+o)**s1
+        l_K_surface = c_surfaces[s]/(l_match_number_surface+o)**s1
+
+        date_cutoff = dates[i] - recentdays_range
+
+        if w_match_number >= 40:
+            w_recentmatches = recent_matches_number(winner_row, last_matches[winner_row], date_cutoff, winner_rows, previous_matches, dates, window_offsets, window_dates)
+            w_activityfactor = exp(-0.4*w_recentmatches)+1
+            w_K *= w_activityfactor
+            w_K_surface *= w_activityfactor
+            if w_recentmatches == 0:
+                w_elo_old *= 1-(1-penaltyfactor)/(1+exp(-0.05*(w_elo_old-1910))*((1/0.995)-1))
+        if l_match_number >= 40:
+            l_recentmatches = recent_matches_number(loser_row, last_matches[loser_row], date_cutoff, winner_rows, previous_matches, dates, window_offsets, window_dates)
+            l_activityfactor = exp(-0.4*l_recentmatches)+1
+            l_K *= l_activityfactor
+            l_K_surface *= l_activityfactor
+            if l_recentmatches == 0:
+                l_elo_old *= 1-(1-penaltyfactor)/(1+exp(-0.05*(l_elo_old-1910))*((1/0.995)-1))
+
+        previous_matches[i,0] = last_matches[winner_row]
+        previous_matches[i,1] = last_matches[loser_row]
+        last_matches[winner_row] = i
+        last_matches[loser_row] = i
+
+        if exhibition[i]:
+            w_K //= 2
+            l_K //= 2
+            w_K_surface //= 2
+            l_K_surface //= 2
+
+        w_setwinprob = 1/ (1 + 10**((l_elo_old - w_elo_old)/400))
+        winner_elo_new = w_elo_old + w_K*(1-w_setwinprob) * winner_setswon[i] - w_K*w_setwinprob * loser_setswon[i]
+        loser_elo_new = l_elo_old + l_K*w_setwinprob * loser_setswon[i] - l_K*(1-w_setwinprob) * winner_setswon[i]
+        w_setwinprob_surface = 1/ (1 + 10**((l_elo_old_surface - w_elo_old_surface)/400))
+        winner_elo_new_surface = w_elo_old_surface + w_K_surface*(1-w_setwinprob_surface) * winner_setswon[i] - w_K_surface*w_setwinprob_surface * loser_setswon[i]
+        loser_elo_new_surface = l_elo_old_surface + l_K_surface*w_setwinprob_surface * loser_setswon[i] - l_K_surface*(1-w_setwinprob_surface) * winner_setswon[i]
+
+        N_ratings[i,0] = winner_elo_new
+        N_ratings[i,1] = loser_elo_new
+        N_ratings[i,2] = winner_elo_new_surface
+        N_ratings[i,3] = loser_elo_new_surface
+
+        ratings[winner_row,0] = winner_elo_new
+        match_numbers[winner_row,0] = w_match_number+1
+        ratings[loser_row,0] = loser_elo_new
+        match_numbers[loser_row,0] = l_match_number+1
+        ratings[winner_row,s] = winner_elo_new_surface
+        match_numbers[winner_row,s] = w_match_number_surface+1
+        ratings[loser_row,s] = loser_elo_new_surface
+        match_numbers[loser_row,s] = l_match_number_surface+1
+
+    return N_ratings, N_ratings_before, previous_matches
+
+def recent_dates_arrays(recent_dates: pd.Series):
+    """Converts the column "recent_dates" of a checkpoint (for each player the dates of their recent matches, separated by "|") to the arrays window_offsets and window_dates used by elo_kernel
+    The dates of the player in row i are window_dates[window_offsets[i]:window_offsets[i+1]].
+    """
+    dates_long = recent_dates.fillna("").reset_index(drop=True).str.split("|").explode()
+    dates_long = dates_long.loc[dates_long != ""]
+    dates_long = pd.to_datetime(dates_long).sort_values(kind="stable")
+    rows = dates_long.index.to_numpy(dtype=np.int64)
+    order = np.argsort(rows, kind="stable") # sorted by player row, and by date for every player
+    window_dates = dates_long.values.astype("datetime64[ns]").astype(np.int64)[order]
+    window_offsets = np.zeros(len(recent_dates)+1, dtype=np.int64)
+    window_offsets[1:] = np.cumsum(np.bincount(rows, minlength=len(recent_dates)))
+    return window_offsets, window_dates
+
+def checkpoint_date(player_table: pd.DataFrame):
+    """Returns the date of the last match included in the checkpoint player_table (NaT if player_table is not a checkpoint)
+    """
+    if "recent_dates" not in player_table.columns:
+        return pd.NaT
+    window_dates = recent_dates_arrays(player_table["recent_dates"])[1]
+    if len(window_dates) == 0:
+        return pd.NaT
+    return pd.Timestamp(window_dates.max())
+
+def checkpoint_match_ids(player_table: pd.DataFrame) -> set:
+    """Returns the ids of the matches in the column "last_matches" of the checkpoint player_table (for every player the ids of the matches on the date of the player's last match, separated by "|")
+    """
+    match_ids = player_table["last_matches"].fillna("").str.split("|").explode()
+    return set(match_ids.loc[match_ids != ""])
+
+def read_elo_checkpoint(filename: str = "elo_checkpoint.csv") -> pd.DataFrame:
+    """Reads a checkpoint written by write_elo_checkpoint, it can be used as player_table in update_elo (with checkpoint_bool = True)
+    """
+    checkpoint_dtypes = {"id": "str", "elo_overall": "float", "match_number": "int", "elo_hard": "float", "match_number_hard": "int", \
+        "elo_clay": "float", "match_number_clay": "int", "elo_grass": "float", "match_number_grass": "int", "previous_match": "str", "recent_dates": "str", "last_matches": "str"}
+    return pd.read_csv(filename, dtype = checkpoint_dtypes, float_precision = "round_trip")
+
+def checkpoint_match_ids_filename(filename: str = "elo_checkpoint.csv") -> str:
+    """Returns the file with the ids of the matches included in the checkpoint filename, e.g. elo_checkpoint_matches.csv
+    """
+    return os.path.splitext(filename)[0] + "_matches.csv"
+
+def read_checkpoint_match_ids(filename: str = "elo_checkpoint.csv") -> pd.Series:
+    """Returns the ids of the matches included in the checkpoint filename (see write_elo_checkpoint), None if they weren't written
+    """
+    if not os.path.isfile(checkpoint_match_ids_filename(filename)):
+        return None
+    return pd.read_csv(checkpoint_match_ids_filename(filename), dtype = {"match_id": "str"}, keep_default_na = False)["match_id"]
+
+def write_elo_checkpoint(P: pd.DataFrame, filename: str = "elo_checkpoint.csv", match_ids: pd.Series = None):
+    """Writes the table P returned by update_elo (with checkpoint_bool = True) to a csv file, so that the next run only needs to process the new matches.
+    If given, the ids of all the matches included in P (match_ids) are written to the file checkpoint_match_ids_filename(filename), see processed_match_ids of update_elo
+    """
+    P.loc[:,["id","elo_overall","match_number","elo_hard","match_number_hard","elo_clay","match_number_clay","elo_grass","match_number_grass",\
+        "previous_match","recent_dates","last_matches"]].to_csv(filename, index = False)
+    # Written after the checkpoint: if the program stops in between, the old ids are missing matches of the checkpoint, which only leads to a calculation from scratch
+    if match_ids is not None:
+        pd.DataFrame({"match_id": pd.Series(match_ids, dtype = "object").drop_duplicates()}).to_csv(checkpoint_match_ids_filename(filename) + ".tmp", index = False)
+        os.replace(checkpoint_match_ids_filename(filename) + ".tmp", checkpoint_match_ids_filename(filename))
+
+class OnlineElo:
+    """Applies match results one at a time to the current ratings, e.g. while a tournament week is running, with the same formulas as update_elo (K_factor, elo_factors, elo_new).
+    Every match only touches the state of its two players, so an update takes constant time no matter how many matches have been played before.
+
+    Every processed match is appended to the log (one csv row with the match and the same columns as the table N of update_elo) and every snapshot_every matches
+    the ratings are written to the snapshot (a checkpoint file, see write_elo_checkpoint, together with the number of log rows it contains).
+    After a crash, OnlineElo with the same files starts from the snapshot and applies the log rows after it again, so no processed match is lost.
+    The snapshot can also be used as player_table for update_elo with checkpoint_bool = True.
+
+    The matches are applied in the order in which they arrive (not sorted like in update_elo). A match is a dict with the keys "winner_id", "loser_id", "score",
+    "surface", "tourney_level", "date" (or "tourney_date" if the date is unknown) and "match_id" (or "tourney_id", then the match id is calculated with match_id).
+    Matches on an unknown surface and matches whose id has already been processed are skipped.
+    """
+
+    player_columns = ["elo_overall","match_number","elo_hard","match_number_hard","elo_clay","match_number_clay","elo_grass","match_number_grass","previous_match"]
+    match_columns = ["match_id","winner_id","loser_id","score","surface","tourney_level","date"]
+    elo_columns = ["winner_elo","loser_elo","winner_elo_surface","loser_elo_surface","winner_previous_match","loser_previous_match",\
+        "winner_elo_before","loser_elo_before","winner_elo_surface_before","loser_elo_surface_before"]
+
+    def __init__(self, player_table: pd.DataFrame, log_filename: str = "elo_log.csv", snapshot_filename: str = "elo_snapshot.csv", snapshot_every: int = 100, \
+        c: float = 250, c_hard: float = 280, c_clay: float = 300, c_grass: float = 350, o: float = 20, s1: float = 0.6, initial_elo: float = 1400, \
+        recentdays_range: int = 75, penaltyfactor: float = 0.98):
+        self.log_filename = log_filename
+        self.snapshot_filename = snapshot_filename
+        self.snapshot_every = snapshot_every
+        self.c, self.o, self.s1, self.initial_elo = c, o, s1, initial_elo
+        self.c_surfaces = {"Hard": c_hard, "Clay": c_clay, "Grass": c_grass, "Carpet": c_grass}
+        self.recentdays_range, self.penaltyfactor = recentdays_range, penaltyfactor
+        self.setswon = {}
+
+        snapshot_rows = 0
+        if os.path.isfile(snapshot_filename) and os.path.isfile(snapshot_filename + ".json"): # continue where the last run stopped
+            with open(snapshot_filename + ".json") as f:
+                info = json.load(f)
+            if info["sha256"] == file_sha256(snapshot_filename): # otherwise the program crashed while replacing the snapshot, then the whole log is applied to player_table again
+                player_table = read_elo_checkpoint(snapshot_filename)
+                snapshot_rows = info["log_rows"]
+        P = fill_player_table(set(), player_table.copy(), initial_elo)
+        for column in ["recent_dates","last_matches"]:
+            if column not in P.columns:
+                P[column] = ""
+        self.players = {}
+        for row in P.loc[:,["id"] + self.player_columns + ["recent_dates","last_matches"]].itertuples(index = False):
+            self.players[row.id] = dict(zip(self.player_columns, row[1:-2]))
+            self.players[row.id]["recent_dates"] = deque(sorted(pd.Timestamp(date) for date in str(row.recent_dates).split("|") if date not in ["", "nan"]))
+            self.players[row.id]["last_matches"] = [match_id for match_id in str(row.last_matches).split("|") if match_id not in ["", "nan"]]
+
+        self.log_rows = 0
+        self.match_ids = set()
+        if os.path.isfile(log_filename):
+            with open(log_filename, "rb+") as f: # remove an incomplete last row (if the program crashed while writing it)
+                content = f.read()
+                if len(content) > 0 and not content.endswith(b"\n"):
+                    f.truncate(content.rfind(b"\n") + 1)
+        if os.path.isfile(log_filename) and os.path.getsize(log_filename) > 0:
+            L = pd.read_csv(log_filename, dtype = {"match_id": "str", "winner_id": "str", "loser_id": "str", "score": "str"}, float_precision = "round_trip")
+            self.match_ids.update(L["match_id"])
+            self.log_rows = len(L.index)
+            for match in L.iloc[snapshot_rows:].loc[:,self.match_columns].to_dict("records"): # the matches after the snapshot
+                self.apply(match)
+        header_bool = not os.path.isfile(log_filename) or os.path.getsize(log_filename) == 0
+        self.log = open(log_filename, "a", newline = "")
+        self.log_writer = csv.writer(self.log)
+        if header_bool:
+            self.log_writer.writerow(self.match_columns + self.elo_columns)
+
+    def player(self, player_id: str) -> dict:
+        if player_id not in self.players: # new player
+            self.players[player_id] = {"elo_overall": self.initial_elo, "match_number": 0, "elo_hard": self.initial_elo, "match_number_hard": 0, \
+                "elo_clay": self.initial_elo, "match_number_clay": 0, "elo_grass": self.initial_elo, "match_number_grass": 0, "previous_match": "", "recent_dates": deque(), "last_matches": []}
+        return self.players[player_id]
+
+    def apply(self, match: dict) -> dict:
+        """Updates the ratings of the two players of match (same formulas and order of operations as the loop in update_elo) and returns the row for N, without writing the log
+        """
+        winner, loser = self.player(match["winner_id"]), self.player(match["loser_id"])
+        surface_column = surface_elo_columns[match["surface"]]
+        surface_number_column = surface_column.replace("elo", "match_number")
+        date = pd.Timestamp(match["date"])
+        if match["score"] not in self.setswon: # there are few different scores, so every score is only parsed once
+            self.setswon[match["score"]] = tuple(int(sets[0]) for sets in sets_won_by_player(pd.Series([match["score"]], dtype = "object")))
+        winner_setswon, loser_setswon = self.setswon[match["score"]]
+
+        w_elo_old, l_elo_old = winner["elo_overall"], loser["elo_overall"]
+        w_elo_old_surface, l_elo_old_surface = winner[surface_column], loser[surface_column]
+        w_match_number, l_match_number = winner["match_number"], loser["match_number"]
+        row = {"winner_previous_match": winner["previous_match"], "loser_previous_match": loser["previous_match"], \
+            "winner_elo_before": w_elo_old if winner["previous_match"] != "" else np.nan, "loser_elo_before": l_elo_old if loser["previous_match"] != "" else np.nan, \
+            "winner_elo_surface_before": w_elo_old_surface if winner["previous_match"] != "" else np.nan, \
+            "loser_elo_surface_before": l_elo_old_surface if loser["previous_match"] != "" else np.nan}
+
+        w_K = K_factor(w_match_number, self.c, self.o, self.s1)
+        l_K = K_factor(l_match_number, self.c, self.o, self.s1)
+        w_K_surface = K_factor(winner[surface_number_column], self.c_surfaces[match["surface"]], self.o, self.s1)
+        l_K_surface = K_factor(loser[surface_number_column], self.c_surfaces[match["surface"]], self.o, self.s1)
+
+        date_cutoff = date - timedelta(days = self.recentdays_range)
+        if w_match_number >= 40 or l_match_number >= 40:
+            w_recentmatches = recent_matches_in_window(winner["recent_dates"], date_cutoff) if w_match_number >= 40 else 1
+            l_recentmatches = recent_matches_in_window(loser["recent_dates"], date_cutoff) if l_match_number >= 40 else 1
+            w_activityfactor, w_penaltyfactor = elo_factors(w_elo_old, w_match_number, w_recentmatches, self.penaltyfactor)
+            l_activityfactor, l_penaltyfactor = elo_factors(l_elo_old, l_match_number, l_recentmatches, self.penaltyfactor)
+            w_K *= w_activityfactor
+            l_K *= l_activityfactor
+            w_K_surface *= w_activityfactor
+            l_K_surface *= l_activityfactor
+            w_elo_old *= w_penaltyfactor
+            l_elo_old *= l_penaltyfactor
+        for player in [winner, loser]:
+            if len(player["recent_dates"]) == 0 or player["recent_dates"][-1] != date:
+                player["last_matches"] = []
+            player["last_matches"].append(match["match_id"])
+            player["recent_dates"].append(date)
+
+        if match["tourney_level"] == "Exhibition":
+            w_K //= 2
+            l_K //= 2
+            w_K_surface //= 2
+            l_K_surface //= 2
+
+        row["winner_elo"], row["loser_elo"] = elo_new(w_elo_old, l_elo_old, w_K, l_K, winner_setswon, loser_setswon)
+        row["winner_elo_surface"], row["loser_elo_surface"] = elo_new(w_elo_old_surface, l_elo_old_surface, w_K_surface, l_K_surface, winner_setswon, loser_setswon)
+
+        winner["elo_overall"], loser["elo_overall"] = row["winner_elo"], row["loser_elo"]
+        winner[surface_column], loser[surface_column] = row["winner_elo_surface"], row["loser_elo_surface"]
+        winner["match_number"] += 1
+        loser["match_number"] += 1
+        winner[surface_number_column] += 1
+        loser[surface_number_column] += 1
+        winner["previous_match"] = loser["previous_match"] = match["match_id"]
+        return row
+
+    def update(self, match: dict) -> dict:
+        """Processes one match: applies it, appends it to the log and writes a snapshot if necessary. Returns the row for N (None if the match is skipped)
+        """
+        match = {**match, "date": match.get("date") if pd.notna(match.get("date")) and match.get("date") != "" else match.get("tourney_date")}
+        if "match_id" not in match:
+            match["match_id"] = match_id(pd.Series([match["tourney_id"]]), pd.Series([match["winner_id"]]), pd.Series([match["loser_id"]]), pd.Series([match["score"]]))[0]
+        if match["surface"] not in surface_elo_columns or pd.isna(match["date"]) or match["match_id"] in self.match_ids:
+            return None
+        match["date"] = pd.Timestamp(match["date"]).strftime("%Y-%m-%d %H:%M:%S")
+
+        row = self.apply(match)
+        self.log_writer.writerow([match[column] for column in self.match_columns] + [row[column] for column in self.elo_columns])
+        self.log.flush() # the row is with the operating system now, so it survives a crash of this program
+        self.match_ids.add(match["match_id"])
+        self.log_rows += 1
+        if self.log_rows % self.snapshot_every == 0:
+            self.snapshot()
+        return {"match_id": match["match_id"], **row}
+
+    def run(self, matches) -> int:
+        """Processes all the matches of an iterable (e.g. read_match_stream(sys.stdin), follow_match_file(filename) or iter(queue.get, None)), returns the number of processed matches
+        """
+        processed = 0
+        for match in matches:
+            processed += self.update(match) is not None
+        self.snapshot()
+        return processed
+
+    def player_table(self) -> pd.DataFrame:
+        """Returns the current ratings in the same format as the table P of update_elo with checkpoint_bool = True
+        """
+        P = pd.DataFrame.from_dict(self.players, orient = "index").rename_axis("id").reset_index()
+        last_dates = [player["recent_dates"][-1] for player in self.players.values() if len(player["recent_dates"]) > 0]
+        window_cutoff = max(last_dates) - timedelta(days = self.recentdays_range) if len(last_dates) > 0 else pd.Timestamp.min
+        P["recent_dates"] = ["|".join(date.strftime("%Y-%m-%d %H:%M:%S") for date in dates if date >= window_cutoff) for dates in P["recent_dates"]]
+        P["last_matches"] = ["|".join(match_ids) for match_ids in P["last_matches"]]
+        P = P.sort_values(by = ["elo_overall"], ascending = False).reset_index(drop = True)
+        return P
+
+    def snapshot(self):
+        """Writes the current ratings to the snapshot file (first to a temporary file, so that a crash while writing leaves the old snapshot intact)
+        """
+        write_elo_checkpoint(self.player_table(), self.snapshot_filename + ".tmp")
+        with open(self.snapshot_filename + ".json.tmp", "w") as f:
+            json.dump({"log_rows": self.log_rows, "sha256": file_sha256(self.snapshot_filename + ".tmp")}, f)
+        os.replace(self.snapshot_filename + ".tmp", self.snapshot_filename)
+        os.replace(self.snapshot_filename + ".json.tmp", self.snapshot_filename + ".json")
+
+    def close(self):
+        self.snapshot()
+        self.log.close()
+
+def read_match_stream(lines) -> dict:
+    """Yields the matches of an iterable of JSON lines (e.g. sys.stdin or an open file), empty lines are skipped
+    """
+    for line in lines:
+        if line.strip() != "":
+            yield json.loads(line)
+
+def follow_match_file(filename: str, poll_interval: float = 1.0):
+    """Yields the matches of a JSONL file like read_match_stream, and then waits for new lines appended to the file (like tail -f), until it is interrupted
+    """
+    with open(filename) as f:
+        while True:
+            line = f.readline()
+            if line.endswith("\n"):
+                if line.strip() != "":
+                    yield json.loads(line)
+            else: # no complete new line yet
+                f.seek(f.tell() - len(line.encode("utf-8")))
+                time.sleep(poll_interval)
+
+def elo_arrays(M: pd.DataFrame, P: pd.DataFrame, checkpoint_bool: bool = False) -> dict:
+    """Encodes the tables M (output of prepare_elo_matches) and P (output of fill_player_table) as the typed numpy arrays elo_kernel works with, see elo_kernel for a description of the arrays.
+    ratings and match_numbers are always copies, because elo_kernel writes to them (to_numpy can return a read-only view of P with copy-on-write)
+    """
+    winner_rows, loser_rows = winner_and_loser_row(M["winner_id"],M["loser_id"],P["id"])
+    if checkpoint_bool and "recent_dates" in P.columns:
+        window_offsets, window_dates = recent_dates_arrays(P["recent_dates"])
+    else:
+        window_offsets, window_dates = np.zeros(len(P.index)+1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return {"winner_rows": winner_rows.to_numpy(dtype=np.int64), "loser_rows": loser_rows.to_numpy(dtype=np.int64), \
+        "surface_columns": np.select([M["surface"] == "Clay", (M["surface"] == "Grass") | (M["surface"] == "Carpet")], [2, 3], 1), \
+        "exhibition": (M["tourney_level"] == "Exhibition").to_numpy(dtype=bool), "dates": M["date2"].values.astype("datetime64[ns]").astype(np.int64), \
+        "winner_setswon": M["winner_setswon"].to_numpy(dtype=np.int64), "loser_setswon": M["loser_setswon"].to_numpy(dtype=np.int64), \
+        "ratings": np.array(P.loc[:,["elo_overall","elo_hard","elo_clay","elo_grass"]], dtype=np.float64), \
+        "match_numbers": np.array(P.loc[:,["match_number","match_number_hard","match_number_clay","match_number_grass"]], dtype=np.int32), \
+        "window_offsets": window_offsets, "window_dates": window_dates}
+
+def update_elo_arrays(M: pd.DataFrame, P: pd.DataFrame, c: float = 250, c_hard: float = 280, c_clay: float = 300, c_grass: float = 350, \
+    o: float = 20, s1: float = 0.6, recentdays_range: int = 75, penaltyfactor: float = 0.98, checkpoint_bool: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Same as the loop in update_elo, but the player ids and surfaces are encoded as integers and the ratings are calculated by elo_kernel on typed numpy arrays.
+    If numba is installed, elo_kernel is compiled, otherwise it runs as a plain Python loop (still a lot faster than iterrows).
+    
+    Args:
+        M (pandas dataframe): the output of prepare_elo_matches
+        P (pandas dataframe): the output of fill_player_table
+        checkpoint_bool (boolean): If true, the dates in the column "recent_dates" of P count as recent matches and the returned P contains the updated column "recent_dates"
+        The other arguments are the same as in update_elo
+    
+    Returns:
+        N, P (pandas dataframes): the same tables as update_elo
+    """
+
+    A = elo_arrays(M, P, checkpoint_bool)
+    winner_rows, loser_rows, dates = A["winner_rows"], A["loser_rows"], A["dates"]
+    window_offsets, window_dates = A["window_offsets"], A["window_dates"]
+    ratings, match_numbers = A["ratings"], A["match_numbers"]
+    last_matches = np.full(len(P.index), -1, dtype=np.int64)
+    recentdays_range_ns = np.int64(recentdays_range*86400*10**9)
+    c_surfaces = np.array([c, c_hard, c_clay, c_grass], dtype=np.float64)
+
+    N_ratings, N_ratings_before, previous_matches = elo_kernel(winner_rows, loser_rows, A["surface_columns"], A["exhibition"], dates, A["winner_setswon"], A["loser_setswon"], \
+        ratings, match_numbers, last_matches, window_offsets, window_dates, c_surfaces, float(c), float(o), float(s1), recentdays_range_ns, float(penaltyfactor))
+
+    # Convert back to the same object arrays the loop in update_elo produces
+    P_arr = np.array(P.loc[:,["id","elo_overall","match_number","elo_hard","match_number_hard","elo_clay","match_number_clay","elo_grass",\
+        "match_number_grass","previous_match"]].values)
+    match_ids = M["match_id"].to_numpy(dtype=object)
+    N_arr = np.zeros((len(M.index), 11), dtype=object)
+    N_arr[:,0] = match_ids
+    N_arr[:,1:5] = N_ratings
+    N_arr[:,5] = np.where(previous_matches[:,0] >= 0, match_ids[previous_matches[:,0]], P_arr[winner_rows,9])
+    N_arr[:,6] = np.where(previous_matches[:,1] >= 0, match_ids[previous_matches[:,1]], P_arr[loser_rows,9])
+    winner_first_match = (N_arr[:,5] == "")[:,np.newaxis] # players without a previous match get NaN as Elo before the match, like in the loop
+    loser_first_match = (N_arr[:,6] == "")[:,np.newaxis]
+    N_arr[:,[7,9]] = np.where(winner_first_match, np.nan, N_ratings_before[:,[0,2]])
+    N_arr[:,[8,10]] = np.where(loser_first_match, np.nan, N_ratings_before[:,[1,3]])
+
+    played = last_matches >= 0 # only the players that played in M get new values
+    P_arr[played,1] = ratings[played,0]
+    P_arr[played,2] = match_numbers[played,0]
+    P_arr[played,3] = ratings[played,1]
+    P_arr[played,4] = match_numbers[played,1]
+    P_arr[played,5] = ratings[played,2]
+    P_arr[played,6] = match_numbers[played,2]
+    P_arr[played,7] = ratings[played,3]
+    P_arr[played,8] = match_numbers[played,3]
+    P_arr[played,9] = match_ids[last_matches[played]]
+
+    if checkpoint_bool:
+        # Keep the dates that can still count as recent matches for the next run, i.e. the dates within recentdays_range of the last match
+        # Both the new matches and the dates from the old checkpoint are sorted chronologically, so we only need the last rows
+        last_dates = np.concatenate([dates[-1:], window_dates])
+        window_cutoff = last_dates.max() - recentdays_range_ns if len(last_dates) > 0 else 0
+        window_rows = np.repeat(np.arange(len(P.index)), np.diff(window_offsets))
+        recent = dates >= window_cutoff
+        recent_window = window_dates >= window_cutoff
+        R = pd.DataFrame({"row": np.concatenate([window_rows[recent_window], winner_rows[recent], loser_rows[recent]]), \
+            "date": np.concatenate([window_dates[recent_window], dates[recent], dates[recent]]).astype("datetime64[ns]")})
+        R = R.sort_values(by=["row","date"])
+        R["date"] = R["date"].dt.strftime("%Y-%m-%d %H:%M:%S")
+        recent_dates = np.full(len(P.index), "", dtype=object)
+        recent_dates_grouped = R.groupby("row")["date"].agg("|".join)
+        recent_dates[recent_dates_grouped.index.to_numpy()] = recent_dates_grouped.to_numpy()
+
+        # The ids of the matches on the date of every player's last match, the next run skips them (and processes the other matches on that date)
+        last_matches_ids = P["last_matches"].fillna("").to_numpy(dtype=object) if "last_matches" in P.columns else np.full(len(P.index), "", dtype=object)
+        L = pd.DataFrame({"row": np.concatenate([winner_rows, loser_rows]), "date": np.tile(dates, 2), "match_id": np.tile(match_ids, 2)})
+        L = L.loc[L["date"] == L.groupby("row")["date"].transform("max"),:]
+        L = L.groupby("row").agg(date = ("date", "first"), match_id = ("match_id", "|".join))
+        checkpoint_last_dates = pd.Series(window_dates).groupby(window_rows).max().reindex(L.index).to_numpy()
+        rows = L.index.to_numpy()
+        same_date = (checkpoint_last_dates == L["date"].to_numpy()) & (last_matches_ids[rows] != "")
+        last_matches_ids[rows] = np.where(same_date, last_matches_ids[rows] + "|" + L["match_id"].to_numpy(dtype=object), L["match_id"].to_numpy(dtype=object))
+        P_arr = np.column_stack([P_arr, recent_dates, last_matches_ids])
+
+    return elo_output_tables(N_arr, P_arr)
+
+elo_parameter_names = ["c","c_hard","c_clay","c_grass","o","s1","recentdays_range","penaltyfactor"]
+
+@njit(cache=True)
+def recent_matches_numbers(player_row, last_match, date_cutoffs, winner_rows, previous_matches, dates, window_offsets, window_dates):
+    """Same as recent_matches_number, but for an array of cutoff dates (one per parameter set), returns an array of numbers of recent matches
+    """
+    recentmatches = np.zeros(len(date_cutoffs), dtype=np.int64)
+    date_cutoff_min = date_cutoffs.min()
+    j = last_match
+    while j >= 0:
+        if dates[j] < date_cutoff_min:
+            return recentmatches
+        recentmatches += (dates[j] >= date_cutoffs)
+        if winner_rows[j] == player_row:
+            j = previous_matches[j,0]
+        else:
+            j = previous_matches[j,1]
+    k = window_offsets[player_row+1] - 1
+    while k >= window_offsets[player_row] and window_dates[k] >= date_cutoff_min:
+        recentmatches += (window_dates[k] >= date_cutoffs)
+        k -= 1
+    return recentmatches
+
+@njit(cache=True)
+def elo_kernel_batch(winner_rows, loser_rows, surface_columns, exhibition, dates, winner_setswon, loser_setswon, ratings, match_numbers, last_matches, \
+    window_offsets, window_dates, c_surfaces, o, s1, recentdays_range, penaltyfactor):
+    """Same as elo_kernel, but for several parameter sets at once: every rating has an additional last axis with one entry per parameter set and all the
+    formulas are applied to these vectors. So the matches are only traversed once and the work per match is shared by all the parameter sets.
+    The match numbers and the previous matches do not depend on the parameters, so they are the same as in elo_kernel.
+
+    Args:
+        ratings (float64 array): shape (number of players, 4, number of parameter sets), updated in place
+        c_surfaces (float64 array): shape (4, number of parameter sets), the values of c, c_hard, c_clay and c_grass
+        o, s1, recentdays_range, penaltyfactor (arrays): one value per parameter set (recentdays_range in nanoseconds)
+        The other arguments are the same as in elo_kernel
+    
+    Returns:
+        N_ratings, N_ratings_before (float64 arrays): shape (number of matches, 4, number of parameter sets), otherwise the same as in elo_kernel
+        previous_matches (int64 array): same as in elo_kernel
+    """
+    n = len(winner_rows)
+    m = ratings.shape[2]
+    N_ratings = np.empty((n, 4, m))
+    N_ratings_before = np.empty((n, 4, m))
+    previous_matches = np.empty((n, 2), dtype=np.int64)
+
+    for i in range(n):
+        winner_row = winner_rows[i]
+        loser_row = loser_rows[i]
+        s = surface_columns[i]
+
+        w_elo_old = ratings[winner_row,0].copy()
+        l_elo_old = ratings[loser_row,0].copy()
+        w_match_number = match_numbers[winner_row,0]
+        l_match_number = match_numbers[loser_row,0]
+        w_elo_old_surface = ratings[winner_row,s].copy()
+        l_elo_old_surface = ratings[loser_row,s].copy()
+        w_match_number_surface = match_numbers[winner_row,s]
+        l_match_number_surface = match_numbers[loser_row,s]
+        N_ratings_before[i,0] = w_elo_old
+        N_ratings_before[i,1] = l_elo_old
+        N_ratings_before[i,2] = w_elo_old_surface
+        N_ratings_before[i,3] = l_elo_old_surface
+
+        w_K = c_surfaces[0]/(w_match_number+o)**s1
+        l_K = c_surfaces[0]/(l_match_number+o)**s1
+        w_K_surface = c_surfaces[s]/(w_match_number_surface+o)**s1
+        l_K_surface = c_surfaces[s]/(l_match_number_surface+o)**s1
+
+        date_cutoffs = dates[i] - recentdays_range
+
+        if w_match_number >= 40:
+            w_recentmatches = recent_matches_numbers(winner_row, last_matches[winner_row], date_cutoffs, winner_rows, previous_matches, dates, window_offsets, window_dates)
+            w_activityfactor = np.exp(-0.4*w_recentmatches)+1
+            w_K *= w_activityfactor
+            w_K_surface *= w_activityfactor
+            w_elo_old *= np.where(w_recentmatches == 0, 1-(1-penaltyfactor)/(1+np.exp(-0.05*(w_elo_old-1910))*((1/0.995)-1)), 1.0)
+        if l_match_number >= 40:
+            l_recentmatches = recent_matches_numbers(loser_row, last_matches[loser_row], date_cutoffs, winner_rows, previous_matches, dates, window_offsets, window_dates)
+            l_activityfactor = np.exp(-0.4*l_recentmatches)+1
+            l_K *= l_activityfactor
+            l_K_surface *= l_activityfactor
+            l_elo_old *= np.where(l_recentmatches == 0, 1-(1-penaltyfactor)/(1+np.exp(-0.05*(l_elo_old-1910))*((1/0.995)-1)), 1.0)
+
+        previous_matches[i,0] = last_matches[winner_row]
+        previous_matches[i,1] = last_matches[loser_row]
+        last_matches[winner_row] = i
+        last_matches[loser_row] = i
+
+        if exhibition[i]:
+            w_K = np.floor_divide(w_K, 2)
+            l_K = np.floor_divide(l_K, 2)
+            w_K_surface = np.floor_divide(w_K_surface, 2)
+            l_K_surface = np.floor_divide(l_K_surface, 2)
+
+        w_setwinprob = 1/ (1 + 10.0**((l_elo_old - w_elo_old)/400))
+        w_setwinprob_surface = 1/ (1 + 10.0**((l_elo_old_surface - w_elo_old_surface)/400))
+        N_ratings[i,0] = w_elo_old + w_K*(1-w_setwinprob) * winner_setswon[i] - w_K*w_setwinprob * loser_setswon[i]
+        N_ratings[i,1] = l_elo_old + l_K*w_setwinprob * loser_setswon[i] - l_K*(1-w_setwinprob) * winner_setswon[i]
+        N_ratings[i,2] = w_elo_old_surface + w_K_surface*(1-w_setwinprob_surface) * winner_setswon[i] - w_K_surface*w_setwinprob_surface * loser_setswon[i]
+        N_ratings[i,3] = l_elo_old_surface + l_K_surface*w_setwinprob_surface * loser_setswon[i] - l_K_surface*(1-w_setwinprob_surface) * winner_setswon[i]
+
+        ratings[winner_row,0] = N_ratings[i,0]
+        match_numbers[winner_row,0] = w_match_number+1
+        ratings[loser_row,0] = N_ratings[i,1]
+        match_numbers[loser_row,0] = l_match_number+1
+        ratings[winner_row,s] = N_ratings[i,2]
+        match_numbers[winner_row,s] = w_match_number_surface+1
+        ratings[loser_row,s] = N_ratings[i,3]
+        match_numbers[loser_row,s] = l_match_number_surface+1
+
+    return N_ratings, N_ratings_before, previous_matches
+
+def elo_parameter_arrays(parameter_sets: pd.DataFrame) -> dict:
+    """Converts a table with one row per parameter set (columns: some of elo_parameter_names, the others get the default values of update_elo) to the arrays elo_kernel_batch needs
+    """
+    defaults = inspect.signature(update_elo).parameters
+    p = {name: (parameter_sets[name].to_numpy(dtype=np.float64) if name in parameter_sets.columns else np.full(len(parameter_sets.index), float(defaults[name].default))) \
+        for name in elo_parameter_names}
+    return {"c_surfaces": np.stack([p["c"], p["c_hard"], p["c_clay"], p["c_grass"]]), "o": p["o"], "s1": p["s1"], \
+        "recentdays_range": (p["recentdays_range"]*86400*10**9).astype(np.int64), "penaltyfactor": p["penaltyfactor"]}
+
+def update_elo_batch(match_ids: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series, scores: pd.Series, tourney_dates: pd.Series, dates: pd.Series, \
+    surfaces: pd.Series, tourney_levels: pd.Series, rounds: pd.Series, player_table: pd.DataFrame, parameter_sets: pd.DataFrame, initial_elo: float = 1400, \
+    score_table: pd.DataFrame = None):
+    """Calculates the Elo ratings for several parameter sets in one pass over the matches (see elo_kernel_batch). The ratings for the k-th parameter set are the same as those of update_elo with these parameters
+    (up to rounding in the last digit, because numpy may calculate exp and powers of whole arrays slightly differently).
+    Note that the table of ratings after each match needs 32 bytes per match and parameter set.
+
+    Args:
+        match_ids, ..., player_table: same as in update_elo
+        parameter_sets (pandas dataframe): one row per parameter set, the columns are some of "c", "c_hard", "c_clay", "c_grass", "o", "s1", "recentdays_range" and "penaltyfactor" (missing ones get the default values of update_elo)
+        score_table (pandas dataframe): parse_scores of scores (e.g. tables.scores), see prepare_elo_matches
+    
+    Returns:
+        M (pandas dataframe): the matches in the order in which they were processed (output of prepare_elo_matches)
+        N_ratings (numpy array): shape (number of matches, 4, number of parameter sets), winner_elo, loser_elo, winner_elo_surface and loser_elo_surface after each match of M
+        P (pandas dataframe): the players with their final match numbers (output of fill_player_table)
+        P_ratings (numpy array): shape (number of players, 4, number of parameter sets), final elo_overall, elo_hard, elo_clay and elo_grass of each player of P
+    """
+
+    M = prepare_elo_matches(match_ids, winner_ids, loser_ids, scores, tourney_dates, dates, surfaces, tourney_levels, rounds, score_table = score_table)
+    ids_total = set(M["winner_id"]).union(set(M["loser_id"]))
+    P = fill_player_table(ids_total, player_table, initial_elo)
+
+    A = elo_arrays(M, P)
+    K = elo_parameter_arrays(parameter_sets)
+    P_ratings = np.repeat(A["ratings"][:,:,np.newaxis], len(parameter_sets.index), axis=2)
+    match_numbers = A["match_numbers"]
+    N_ratings, N_ratings_before, previous_matches = elo_kernel_batch(A["winner_rows"], A["loser_rows"], A["surface_columns"], A["exhibition"], A["dates"], \
+        A["winner_setswon"], A["loser_setswon"], P_ratings, match_numbers, np.full(len(P.index), -1, dtype=np.int64), A["window_offsets"], A["window_dates"], \
+        K["c_surfaces"], K["o"], K["s1"], K["recentdays_range"], K["penaltyfactor"])
+
+    P = P.copy()
+    P.loc[:,["match_number","match_number_hard","match_number_clay","match_number_grass"]] = match_numbers
+    return M, N_ratings, P, P_ratings
+
+elo_tuning_data = {} # Filled by elo_tuning_init in every worker process of tune_elo_parameters
+
+def elo_tuning_init(data: dict):
+    elo_tuning_data.update(data)
+
+def elo_tuning_score(parameters: dict) -> dict:
+    """Calculates the Elo ratings with the given parameters (the others keep the default values of update_elo) on the data prepared by tune_elo_parameters
+    and scores the win probabilities before each evaluated match with prediction_metrics
+    """
+    defaults = inspect.signature(update_elo).parameters
+    p = {name: parameters.get(name, defaults[name].default) for name in elo_parameter_names}
+    D = elo_tuning_data
+    c_surfaces = np.array([p["c"], p["c_hard"], p["c_clay"], p["c_grass"]], dtype=np.float64)
+    N_ratings, N_ratings_before, previous_matches = elo_kernel(D["winner_rows"], D["loser_rows"], D["surface_columns"], D["exhibition"], D["dates"], \
+        D["winner_setswon"], D["loser_setswon"], D["ratings"].copy(), D["match_numbers"].copy(), np.full(len(D["ratings"]), -1, dtype=np.int64), \
+        D["window_offsets"], D["window_dates"], c_surfaces, float(p["c"]), float(p["o"]), float(p["s1"]), np.int64(p["recentdays_range"]*86400*10**9), float(p["penaltyfactor"]))
+    return elo_tuning_metrics(parameters, N_ratings_before[D["evaluated"]])
+
+def elo_tuning_score_batch(combinations: list) -> list:
+    """Same as elo_tuning_score for a list of parameter combinations, which are calculated together in one pass with elo_kernel_batch
+    """
+    D = elo_tuning_data
+    K = elo_parameter_arrays(pd.DataFrame(combinations))
+    ratings = np.repeat(D["ratings"][:,:,np.newaxis], len(combinations), axis=2)
+    N_ratings, N_ratings_before, previous_matches = elo_kernel_batch(D["winner_rows"], D["loser_rows"], D["surface_columns"], D["exhibition"], D["dates"], \
+        D["winner_setswon"], D["loser_setswon"], ratings, D["match_numbers"].copy(), np.full(len(D["ratings"]), -1, dtype=np.int64), \
+        D["window_offsets"], D["window_dates"], K["c_surfaces"], K["o"], K["s1"], K["recentdays_range"], K["penaltyfactor"])
+    N_ratings_before = N_ratings_before[D["evaluated"]]
+    return [elo_tuning_metrics(parameters, N_ratings_before[:,:,k]) for k, parameters in enumerate(combinations)]
+
+def elo_tuning_metrics(parameters: dict, ratings_before: np.ndarray) -> dict:
+    """Scores the win probabilities from the ratings before each evaluated match (columns: winner_elo, loser_elo, winner_elo_surface, loser_elo_surface) with prediction_metrics
+    """
+    D = elo_tuning_data
+    R = pd.DataFrame(ratings_before, columns = ["winner_elo_before","loser_elo_before","winner_elo_surface_before","loser_elo_surface_before"])
+    winner_winprob = winprobabilities_from_elo(D["surfaces"], D["best_ofs"], R["winner_elo_before"], R["loser_elo_before"], R["winner_elo_surface_before"], \
+        R["loser_elo_surface_before"], D["tourney_levels"])
+    brierscore, log_score, mae = prediction_metrics(winner_winprob, D["years"])
+    return {**parameters, "brierscore": brierscore, "log_score": log_score, "mae": mae}
+
+def elo_parameter_combinations(parameter_grid: dict, random_combinations: int = None, seed: int = None) -> list:
+    """Returns all the combinations of the values in parameter_grid (e.g. {"c": [200, 250], "o": [10, 20]} gives 4 combinations), or random_combinations of them drawn without replacement
+    """
+    names = list(parameter_grid)
+    sizes = [len(parameter_grid[name]) for name in names]
+    total = int(np.prod(sizes))
+    if random_combinations is None or random_combinations >= total:
+        return [dict(zip(names, values)) for values in itertools.product(*[parameter_grid[name] for name in names])]
+    combinations = []
+    for index in np.random.default_rng(seed).choice(total, size = random_combinations, replace = False):
+        combination = {}
+        for name, size in zip(reversed(names), reversed(sizes)): # decode the index of the combination, the last parameter changes fastest as in itertools.product
+            combination[name] = parameter_grid[name][index % size]
+            index //= size
+        combinations.append({name: combination[name] for name in names})
+    return combinations
+
+def tune_elo_parameters(match_ids: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series, scores: pd.Series, tourney_dates: pd.Series, dates: pd.Series, \
+    surfaces: pd.Series, tourney_levels: pd.Series, rounds: pd.Series, best_ofs: pd.Series, player_table: pd.DataFrame, parameter_grid: dict, \
+    random_combinations: int = None, evaluation_startdate: datetime = datetime(2011,1,1), processes: int = None, initial_elo: float = 1400, seed: int = None, batch_size: int = 16, \
+    score_table: pd.DataFrame = None) -> pd.DataFrame:
+    """Tests combinations of the parameters of update_elo on all cores and ranks them by how well the resulting Elos predict the matches.
+    Sorting, parsing the scores and encoding the ids is done only once, the resulting arrays are shared read-only with the worker processes.
+
+    Args:
+        match_ids, ..., rounds (pandas series): same as in update_elo
+        best_ofs (pandas series): 3 for best-of-3 matches and 5 for best-of-5 matches
+        player_table (pandas dataframe): same as in update_elo
+        parameter_grid (dict): for some of the parameters "c", "c_hard", "c_clay", "c_grass", "o", "s1", "recentdays_range" and "penaltyfactor" a list of values to test
+        random_combinations (int): if None, all combinations are tested, otherwise this number of random combinations
+        evaluation_startdate (datetime): only the matches after this date are used for the scores (the ratings need some time to settle)
+        processes (int): number of worker processes, None means one per core
+        batch_size (int): number of combinations each worker calculates together in one pass over the matches (see elo_kernel_batch), 1 means one pass per combination
+        score_table (pandas dataframe): parse_scores of scores (e.g. tables.scores), see prepare_elo_matches
+    
+    Returns:
+        R (pandas dataframe): one row per combination with the parameters and the columns "brierscore", "log_score" and "mae", best brierscore first
+    """
+
+    M = prepare_elo_matches(match_ids, winner_ids, loser_ids, scores, tourney_dates, dates, surfaces, tourney_levels, rounds, best_ofs, score_table)
+    ids_total = set(M["winner_id"]).union(set(M["loser_id"]))
+    P = fill_player_table(ids_total, player_table.copy(), initial_elo)
+
+    data = elo_arrays(M, P)
+    evaluated = (M["date2"] >= evaluation_startdate).to_numpy()
+    data["evaluated"] = evaluated
+    data["surfaces"] = M.loc[evaluated,"surface"].reset_index(drop=True)
+    data["best_ofs"] = M.loc[evaluated,"best_of"].astype("float").reset_index(drop=True) # missing values as NaN, so that the comparisons in winprobabilities_from_elo work
+    data["tourney_levels"] = M.loc[evaluated,"tourney_level"].reset_index(drop=True)
+    data["years"] = M.loc[evaluated,"date2"].dt.year.reset_index(drop=True)
+
+    combinations = elo_parameter_combinations(parameter_grid, random_combinations, seed)
+    with ProcessPoolExecutor(max_workers = processes, initializer = elo_tuning_init, initargs = (data,)) as executor:
+        if batch_size > 1:
+            batches = [combinations[i:i+batch_size] for i in range(0, len(combinations), batch_size)]
+            results = [result for batch in tqdm(executor.map(elo_tuning_score_batch, batches), total = len(batches)) for result in batch]
+        else:
+            results = list(tqdm(executor.map(elo_tuning_score, combinations, chunksize = 4), total = len(combinations)))
+
+    R = pd.DataFrame(results)
+    R = R.sort_values(by = ["brierscore"]).reset_index(drop = True)
+    return R
+
+
+surface_elo_columns = {"Hard": "elo_hard", "Clay": "elo_clay", "Grass": "elo_grass", "Carpet": "elo_grass"} # Carpet counts as grass in update_elo
+
+def player_lookup_table(players_table: pd.DataFrame) -> dict:
+    """Returns a dict that maps the id, the name and the alternative name of every player (all in lower case) to the id, so that a player can be found by any of them
+    """
+    lookup = {}
+    for column in ["alt_name", "name", "id"]: # later columns win if e.g. the name of one player is the alternative name of another
+        if column in players_table.columns:
+            valid = players_table[column].notna()
+            lookup.update(zip(players_table.loc[valid,column].str.lower(), players_table.loc[valid,"id"]))
+    return lookup
+
+def current_ratings_table(players_table: pd.DataFrame, checkpoint_table: pd.DataFrame = None) -> pd.DataFrame:
+    """Returns the current ratings of all players indexed by id, taken from players_table and, if given, replaced by the newer ones in checkpoint_table (see read_elo_checkpoint)
+    """
+    columns = ["elo_overall","match_number","elo_hard","match_number_hard","elo_clay","match_number_clay","elo_grass","match_number_grass"]
+    R = players_table.loc[:,["id","name"] + columns].drop_duplicates(subset = ["id"]).set_index("id")
+    if checkpoint_table is not None:
+        C = checkpoint_table.drop_duplicates(subset = ["id"]).set_index("id").loc[:,columns]
+        R = R.reindex(R.index.union(C.index))
+        R.loc[C.index,columns] = C
+    return R
+
+def player_elo(ratings_table: pd.DataFrame, player_id: str) -> dict:
+    """Returns the current Elos and match numbers of a player as dict (ratings_table is the output of current_ratings_table)
+    """
+    row = ratings_table.loc[player_id]
+    return {"id": player_id, **{column: (None if pd.isna(value) else value.item() if hasattr(value, "item") else value) for column, value in row.items()}}
+
+def matchup_winprobability(ratings_table: pd.DataFrame, player1_id: str, player2_id: str, surface: str, best_of: int = 3, tourney_level: str = "ATP 250") -> float:
+    """Returns the probability that player 1 beats player 2 according to their current Elos (same formula as for the historical matches, see winprobabilities_from_elo)
+    """
+    surface_column = surface_elo_columns[surface]
+    R = ratings_table.loc[[player1_id, player2_id]]
+    winprobability = winprobabilities_from_elo(pd.Series([surface]), pd.Series([best_of]), R["elo_overall"].iloc[[0]].reset_index(drop=True), \
+        R["elo_overall"].iloc[[1]].reset_index(drop=True), R[surface_column].iloc[[0]].reset_index(drop=True), R[surface_column].iloc[[1]].reset_index(drop=True), pd.Series([tourney_level]))
+    return float(winprobability.iloc[0])
+
+fixture_surfaces = ["Hard", "Clay", "Grass", "Carpet"] # surface codes 0, 1, 2, 3 in winprobabilities_from_keys
+
+def rating_store(ratings_table: pd.DataFrame) -> dict:
+    """Returns the current ratings (ratings_table is the output of current_ratings_table, with the ids as index) as dict with the arrays for winprobabilities_from_keys:
+    "ratings" has the columns elo_overall, elo_hard, elo_clay and elo_grass, row k belongs to the player "ids"[k] (the player key) and the additional last row
+    (picked by the key -1 of unknown players) is NaN.
+    """
+    ratings = np.full((len(ratings_table.index)+1, 4), np.nan)
+    ratings[:-1] = ratings_table.loc[:,["elo_overall","elo_hard","elo_clay","elo_grass"]].to_numpy(dtype=np.float64)
+    return {"ratings": ratings, "ids": pd.Index(ratings_table.index)}
+
+def winprobabilities_from_keys(store: np.ndarray, player1_keys: np.ndarray, player2_keys: np.ndarray, surface_codes: np.ndarray, best_ofs: np.ndarray, high_levels: np.ndarray, \
+    w_hard: float = 0.281, w_clay: float = 0.362, w_grass_low: float = 0.206, w_grass_high: float = 0.266) -> np.ndarray:
+    """Same as winprobabilities_from_elo for the current ratings, but only with numpy arrays, so that millions of (hypothetical) matches can be calculated at once,
+    e.g. for simulations of draws. Unknown players, surfaces (code -1) and best_ofs other than 3 and 5 give NaN.
+
+    Args:
+        store (numpy array): the array "ratings" of rating_store
+        player1_keys, player2_keys (numpy arrays): player keys (the positions in the array "ids" of rating_store) of the two players of every match
+        surface_codes (numpy array): position of the surface in fixture_surfaces
+        best_ofs (numpy array): 3 for best-of-3 matches and 5 for best-of-5 matches
+        high_levels (numpy array): true for the tourney_levels of the tour (only matters on carpet)
+        w_hard, w_clay, w_grass_low, w_grass_high: same as in winprobabilities_from_elo
+
+    Returns:
+        player1_winprob (numpy array): the probability that player 1 wins the match
+    """
+    surface_columns = np.array([1, 2, 3, 3, 0])[surface_codes] # the code -1 picks the last entry, the result is NaN anyway
+    setwinprob_overall = 1/(1+10**((store[player2_keys,0]-store[player1_keys,0])/400))
+    setwinprob_surface = 1/(1+10**((store[player2_keys,surface_columns]-store[player1_keys,surface_columns])/400))
+
+    best_of_5 = (best_ofs == 5)
+    winprob_overall = np.where(best_of_5, setwinprob_overall**3+3*setwinprob_overall**3*(1-setwinprob_overall)+6*setwinprob_overall**3*(1-setwinprob_overall)**2, \
+        setwinprob_overall**2+2*setwinprob_overall**2*(1-setwinprob_overall))
+    winprob_surface = np.where(best_of_5, setwinprob_surface**3+3*setwinprob_surface**3*(1-setwinprob_surface)+6*setwinprob_surface**3*(1-setwinprob_surface)**2, \
+        setwinprob_surface**2+2*setwinprob_surface**2*(1-setwinprob_surface))
+
+    # The same weights as in winprobabilities_from_elo (there, grass matches get w_grass_low on every level because of the operator precedence)
+    w_surface = np.array([w_hard, w_clay, w_grass_low, w_grass_low, 0.0])[surface_codes]
+    w_surface[(surface_codes == 3) & high_levels] = w_grass_high
+
+    winprob = w_surface * winprob_surface + (1-w_surface) * winprob_overall
+    winprob[(surface_codes < 0) | ((best_ofs != 3) & ~best_of_5)] = np.nan
+    return winprob
+
+def fixture_winprobabilities(store: np.ndarray, player1_ids, player2_ids, surfaces, best_ofs, tourney_levels) -> np.ndarray:
+    """Encodes a list of fixtures (ids, surfaces and tourney_levels as strings) for winprobabilities_from_keys and returns the probabilities that player 1 wins
+    """
+    high_tourney_levels = ["ATP 1000","ATP 250","ATP 500","Minals","Grand Slam","Olympics"]
+    return winprobabilities_from_keys(store["ratings"], store["ids"].get_indexer(pd.Series(player1_ids, dtype = "object")), store["ids"].get_indexer(pd.Series(player2_ids, dtype = "object")), \
+        pd.Index(fixture_surfaces).get_indexer(surfaces), np.asarray(best_ofs, dtype=np.float64), pd.Index(high_tourney_levels).get_indexer(tourney_levels) >= 0)
 
-def write_tournaments_table(T: pd.DataFrame):
-    writer = pd.ExcelWriter("tournaments.xlsx", engine="xlsxwriter",datetime_format="YYYY-MM-DD")
+def draw_round_names(draw_size: int) -> list:
+    """Returns the names of the rounds of a draw with draw_size places (a power of 2), e.g. ["R32","R16","QF","SF","F","W"] for 32, where "W" means winning the tournament
+    """
+    names = {8: "QF", 4: "SF", 2: "F", 1: "W"}
+    return [names.get(size, "R" + str(size)) for size in 2**np.arange(int(np.log2(draw_size)), -1, -1)]
+
+def draw_byes(draw: list) -> np.ndarray:
+    """Returns for every place of the draw whether it is a bye (NaN or "bye")
+    """
+    draw_ids = pd.Series(draw, dtype = "object")
+    return (draw_ids.isna() | (draw_ids.str.lower() == "bye")).to_numpy()
+
+def draw_winprobability_matrix(P: pd.DataFrame, draw: list, surface: str, best_of: int = 3, tourney_level: str = "ATP 250", initial_elo: float = 1400) -> np.ndarray:
+    """Returns the matrix of the probabilities that the player at place i of the draw beats the player at place j, with the current ratings in P (see winprobabilities_from_keys).
+    The last row and column belong to the byes (NaN).
+    """
+    draw_ids = pd.Series(draw, dtype = "object")
+    byes = draw_byes(draw)
+    ratings = P.drop_duplicates(subset = ["id"]).set_index("id").reindex(draw_ids[~byes].unique())
+    ratings = ratings.loc[:,["elo_overall","elo_hard","elo_clay","elo_grass"]].fillna(initial_elo) # new players start with initial_elo like in update_elo
+    store = rating_store(ratings)
+    n = len(draw_ids)
+    player_keys = np.full(n+1, -1, dtype = np.int32)
+    player_keys[:n][~byes] = store["ids"].get_indexer(draw_ids[~byes])
+    high_level = tourney_level in ["ATP 1000","ATP 250","ATP 500","Minals","Grand Slam","Olympics"]
+    return winprobabilities_from_keys(store["ratings"], np.repeat(player_keys, n+1), np.tile(player_keys, n+1), np.full((n+1)**2, fixture_surfaces.index(surface)), \
+        np.full((n+1)**2, float(best_of)), np.full((n+1)**2, high_level)).reshape(n+1, n+1)
+
+def simulate_draw_chunk(winprobability_matrix: np.ndarray, places: np.ndarray, wins: np.ndarray, lost: np.ndarray, simulations: int, seed) -> np.ndarray:
+    """Plays the draw simulations times, all simulations at once round by round. places contains for every place of the draw the row of winprobability_matrix (the last row for byes).
+    The player in row i has already won the first wins[i] rounds and, if lost[i], lost the next one. Returns for every round (see draw_round_names) and every row of winprobability_matrix
+    the number of simulations in which the player reached the round.
+    """
+    rng = np.random.default_rng(seed)
+    alive = np.broadcast_to(places.astype(np.int16), (simulations, len(places))) # the players still in the tournament
+    counts = np.zeros((int(np.log2(len(places)))+1, len(winprobability_matrix)), dtype = np.int64)
+    counts[0] = np.bincount(places, minlength = len(winprobability_matrix)) * simulations
+    for r in range(len(counts)-1):
+        # The results of the matches that have already been played are known, and a bye always loses
+        out = lost & (wins <= r)
+        round_matrix = np.where(out[:,np.newaxis], 0.0, np.where(out[np.newaxis,:], 1.0, winprobability_matrix))
+        round_matrix = np.where((wins > r)[:,np.newaxis], 1.0, np.where((wins > r)[np.newaxis,:], 0.0, round_matrix))
+
+        players1, players2 = alive[:,0::2], alive[:,1::2]
+        alive = np.where(rng.random(players1.shape) < round_matrix[players1,players2], players1, players2)
+        counts[r+1] = np.bincount(alive.ravel(), minlength = len(winprobability_matrix))
+    return counts
+
+def simulate_draw(P: pd.DataFrame, draw: list, surface: str, best_of: int = 3, tourney_level: str = "ATP 250", simulations: int = 100000, results: list = None, \
+    processes: int = None, seed: int = None, initial_elo: float = 1400, chunk_size: int = 100000) -> pd.DataFrame:
+    """Estimates for every player of a draw the probabilities to reach each round by simulating the tournament many times with the win probabilities from the current Elos.
+    The simulations are split in chunks that are played on all cores, every chunk is played at once with numpy arrays. After a match has been played, add it to results and run it again.
+
+    Args:
+        P (pandas dataframe): the current ratings, e.g. the table P returned by update_elo
+        draw (list): the player ids in the order of the draw sheet (the winners of places 0 and 1, 2 and 3 etc. meet in the next round), NaN or "bye" for byes. The length has to be a power of 2
+        surface, best_of, tourney_level: as in winprobabilities_from_elo
+        results (list): the matches of the draw that have already been played as (winner_id, loser_id) tuples
+        processes (int): number of worker processes, None means one per core, 1 means no worker processes
+        chunk_size (int): number of simulations that are played at once
+    
+    Returns:
+        R (pandas dataframe): one row per player with the column "id" and one column per round (see draw_round_names) with the probability of reaching that round, the most likely winner first
+    """
+    winprobability_matrix = draw_winprobability_matrix(P, draw, surface, best_of, tourney_level, initial_elo)
+    n = len(draw)
+    byes = draw_byes(draw)
+    places = np.where(byes, n, np.arange(n))
+    row_of_player = {player: i for i, player in enumerate(draw) if not byes[i]}
+    wins, lost = np.zeros(n+1, dtype = np.int64), np.zeros(n+1, dtype = bool)
+    lost[n] = True
+    for winner, loser in (results if results is not None else []):
+        wins[row_of_player[winner]] += 1
+        lost[row_of_player[loser]] = True
+
+    # The simulations are played in chunks of at most chunk_size, so that the arrays of a chunk fit in memory (about 100 bytes per simulation and place of the draw)
+    chunks = [chunk_size]*(simulations//chunk_size) + ([simulations % chunk_size] if simulations % chunk_size > 0 else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    arguments = [[winprobability_matrix]*len(chunks), [places]*len(chunks), [wins]*len(chunks), [lost]*len(chunks), chunks, seeds]
+    if processes == 1 or len(chunks) == 1: # starting the worker processes takes longer than a single chunk
+        counts = sum(map(simulate_draw_chunk, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers = processes) as executor:
+            counts = sum(executor.map(simulate_draw_chunk, *arguments))
+
+    R = pd.DataFrame(counts[:,:n].T / simulations, columns = draw_round_names(n))
+    R.insert(0, "id", draw)
+    R = R.loc[~byes]
+    R = R.sort_values(by = list(R.columns[:0:-1]), ascending = False).reset_index(drop = True)
+    return R
+
+def player_match_rows(winner_ids: pd.Series, loser_ids: pd.Series, dates: pd.Series) -> dict:
+    """Returns a dict that maps every player id to the positions of the player's matches (most recent first), so that the history of a player needs no search through all matches
+    """
+    order = np.argsort(pd.to_datetime(dates).to_numpy(), kind = "stable")[::-1]
+    rows = np.repeat(order, 2) # every match twice (for the winner and the loser), most recent first
+    ids = pd.Series(np.column_stack([winner_ids.to_numpy()[order], loser_ids.to_numpy()[order]]).ravel())
+    return {player_id: rows[positions] for player_id, positions in ids.groupby(ids).indices.items()}
+
+def player_history(master_table: pd.DataFrame, match_rows: dict, player_id: str, limit: int = 20) -> pd.DataFrame:
+    """Returns the last limit matches of a player from the master table (match_rows is the output of player_match_rows for this table), seen from the player's perspective
+    """
+    M = master_table.iloc[match_rows.get(player_id, np.zeros(0, dtype = np.int64))[:limit]]
+    won = (M["winner_id"] == player_id).to_numpy()
+    H = pd.DataFrame({"date": M["date"].to_numpy(), "tourney_id": M["tourney_id"].to_numpy(), "surface": M["surface"].to_numpy(), "round": M["round"].to_numpy(), \
+        "opponent_id": np.where(won, M["loser_id"], M["winner_id"]), "won": won, "score": M["score"].to_numpy(), \
+        "elo": np.where(won, M["winner_elo"], M["loser_elo"]), "elo_surface": np.where(won, M["winner_elo_surface"], M["loser_elo_surface"])})
+    return H
+
+class RatingIndex:
+    """Time series of the ratings of every player after each of their matches. The matches of all players are stored in contiguous arrays, sorted by player and date,
+    and offsets[i]:offsets[i+1] is the part of the player ids[i]. So the history of a player is a slice of the arrays and the rating of a player on a date is a
+    binary search, instead of a scan through the whole master table. save writes the arrays (including the ids) as .npy files, which load can memory-map.
+    E.g. rating_index.as_of(["rafael nadal-es-86"], [datetime(2015,1,1)]) returns the ratings of Nadal after his last match before 2015.
+    """
+
+    columns = ["elo_overall", "elo_hard", "elo_clay", "elo_grass"]
+    arrays = ["ids", "offsets", "dates", "ratings", "rows", "won"]
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, dates: np.ndarray, ratings: np.ndarray, rows: np.ndarray, won: np.ndarray):
+        self.ids = ids # str, the players with matches in alphabetical order
+        self.offsets = offsets # int64, one more than the number of players
+        self.dates = dates # int64 nanoseconds (date, or tourney_date if the date is missing)
+        self.ratings = ratings # float64 with the columns of RatingIndex.columns, the surface Elos are carried forward from the last match on the surface (NaN before the first)
+        self.rows = rows # int64 position of the match in the table the index was built from
+        self.won = won # bool
+        self.id_positions = pd.Index(np.asarray(ids))
+
+    @classmethod
+    def from_matches(cls, M: pd.DataFrame):
+        """Builds the index from a table with the columns of the master table: date, tourney_date, round, surface, winner_id, loser_id, winner_elo, loser_elo,
+        winner_elo_surface and loser_elo_surface (the ratings after the match). Matches before Dec 1, 2009 are left out like in sort_matches_table.
+        """
+        S = M.loc[:,["date","tourney_date","round","surface","winner_id","loser_id","winner_elo","loser_elo","winner_elo_surface","loser_elo_surface"]].copy()
+        S["row"] = np.arange(len(S))
+        S = sort_matches_table(S, drop_date2 = False)
+        n = len(S)
+        player_keys, ids = pd.factorize(pd.concat([S["winner_id"], S["loser_id"]], ignore_index = True), sort = True) # the key of a player is the position in ids
+        order = np.lexsort((np.tile(np.arange(n), 2), player_keys)) # by player, then in the order of sort_matches_table
+        order = order[player_keys[order] >= 0]
+        player_keys = player_keys[order]
+
+        elos = np.concatenate([S["winner_elo"].to_numpy(dtype = np.float64), S["loser_elo"].to_numpy(dtype = np.float64)])[order]
+        elos_surface = pd.Series(np.concatenate([S["winner_elo_surface"].to_numpy(dtype = np.float64), S["loser_elo_surface"].to_numpy(dtype = np.float64)])[order])
+        surface_columns = np.tile(S["surface"].map(surface_elo_columns).to_numpy(dtype = "object"), 2)[order]
+        ratings = pd.DataFrame({"elo_overall": elos})
+        for column in cls.columns[1:]:
+            ratings[column] = elos_surface.where(surface_columns == column)
+        ratings.loc[:,cls.columns[1:]] = ratings.loc[:,cls.columns[1:]].groupby(player_keys).ffill()
+
+        offsets = np.searchsorted(player_keys, np.arange(len(ids)+1)).astype(np.int64)
+        dates = np.tile(S["date2"].to_numpy(dtype = "datetime64[ns]").astype(np.int64), 2)[order]
+        rows = np.tile(S["row"].to_numpy(dtype = np.int64), 2)[order]
+        won = (np.arange(2*n) < n)[order]
+        return cls(np.asarray(ids, dtype = str), offsets, dates, ratings.to_numpy(dtype = np.float64), rows, won)
+
+    def save(self, folder: str = "rating_index"):
+        os.makedirs(folder, exist_ok = True)
+        for name in self.arrays:
+            np.save(os.path.join(folder, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, folder: str = "rating_index", mmap_bool: bool = True):
+        """Reads an index written by save. With mmap_bool the arrays are memory-mapped, so only the parts of the players that are looked up are read from disk
+        """
+        return cls(*[np.load(os.path.join(folder, name + ".npy"), mmap_mode = "r" if mmap_bool else None) for name in cls.arrays])
+
+    def player_slice(self, player_id: str) -> slice:
+        key = self.id_positions.get_indexer([player_id])[0]
+        if key < 0: # player without matches when the index was built
+            return slice(0, 0)
+        return slice(int(self.offsets[key]), int(self.offsets[key+1]))
+
+    def history(self, player_id: str) -> pd.DataFrame:
+        """Returns the ratings of the player after each of the player's matches in chronological order, together with the row of the match and whether the player won
+        """
+        part = self.player_slice(player_id)
+        H = pd.DataFrame(np.asarray(self.ratings[part]), columns = self.columns)
+        H.insert(0, "date", pd.to_datetime(np.asarray(self.dates[part])))
+        H["won"] = np.asarray(self.won[part])
+        H["row"] = np.asarray(self.rows[part])
+        return H
+
+    def as_of(self, player_ids, dates) -> pd.DataFrame:
+        """Returns the ratings of the players after their last match on or before the dates (NaN if there was none), one row per player and date
+        """
+        player_keys = self.id_positions.get_indexer(pd.Series(player_ids, dtype = "object"))
+        dates = pd.to_datetime(pd.Series(dates)).to_numpy(dtype = "datetime64[ns]").astype(np.int64)
+        positions = np.full(len(player_keys), -1, dtype = np.int64)
+        for i, (key, date) in enumerate(zip(player_keys, dates)):
+            if key >= 0:
+                start, end = self.offsets[key], self.offsets[key+1]
+                position = start + np.searchsorted(self.dates[start:end], date, side = "right") - 1
+                positions[i] = position if position >= start else -1
+        R = pd.DataFrame(np.where((positions >= 0)[:,np.newaxis], np.asarray(self.ratings)[positions], np.nan), columns = self.columns)
+        R.insert(0, "id", list(player_ids))
+        R.insert(1, "date", np.asarray(self.dates)[positions].astype("datetime64[ns]"))
+        R.loc[positions < 0, "date"] = pd.NaT
+        return R
+
+def read_rating_index(M: pd.DataFrame, folder: str = "rating_index") -> RatingIndex:
+    """Returns the rating index of the master table M. The index is stored in folder and only built again if the matches or ratings in M (or the arrays of RatingIndex) have changed
+    """
+    columns = ["date","tourney_date","round","surface","winner_id","loser_id","winner_elo","loser_elo","winner_elo_surface","loser_elo_surface"]
+    fingerprint = hashlib.sha256(pd.util.hash_pandas_object(M.loc[:,columns], index = False).to_numpy().tobytes()).hexdigest()
+    info_filename = os.path.join(folder, "info.json")
+    if os.path.isfile(info_filename):
+        with open(info_filename) as f:
+            info = json.load(f)
+            if info.get("sha256") == fingerprint and info.get("arrays") == RatingIndex.arrays: # an index written by an older version is built again
+                return RatingIndex.load(folder)
+    rating_index = RatingIndex.from_matches(M)
+    rating_index.save(folder)
+    with open(info_filename, "w") as f:
+        json.dump({"sha256": fingerprint, "arrays": RatingIndex.arrays}, f)
+    return rating_index
+
+def elo_snapshots(rating_index: RatingIndex, start: datetime = None, end: datetime = None, frequency: str = "W-MON", active_days: int = 365) -> pd.DataFrame:
+    """Returns the ratings of all active players at the dates of frequency (every Monday by default, like the ATP rankings), taken from the per-match ratings in rating_index.
+    A snapshot contains the matches before the snapshot date and every player with a match in the active_days days before it.
+    
+    Returns:
+        S (pandas dataframe): the columns date, id, the columns of RatingIndex.columns and last_match (the date of the last match), sorted by date and id
+    """
+    dates = np.asarray(rating_index.dates)
+    start = pd.Timestamp(start) if start is not None else pd.Timestamp(dates.min()).normalize()
+    end = pd.Timestamp(end) if end is not None else pd.Timestamp(dates.max()) + pd.Timedelta(days = 7)
+    snapshot_dates = pd.date_range(start, end, freq = frequency).to_numpy(dtype = "datetime64[ns]").astype(np.int64)
+    offsets = np.asarray(rating_index.offsets)
+    active_range = pd.Timedelta(days = active_days).value
+
+    snapshot_numbers, positions = [], []
+    for key in np.nonzero(np.diff(offsets))[0]: # the players with matches
+        start_position, end_position = offsets[key], offsets[key+1]
+        player_dates = dates[start_position:end_position]
+        last = np.searchsorted(player_dates, snapshot_dates, side = "left") - 1 # the last match before the snapshot date
+        active = (last >= 0) & (snapshot_dates - player_dates[np.maximum(last, 0)] <= active_range)
+        snapshot_numbers.append(np.nonzero(active)[0])
+        positions.append(start_position + last[active])
+    snapshot_numbers, positions = np.concatenate(snapshot_numbers + [np.zeros(0, dtype = np.int64)]), np.concatenate(positions + [np.zeros(0, dtype = np.int64)])
+    player_keys = np.searchsorted(offsets, positions, side = "right") - 1
+
+    S = pd.DataFrame(np.asarray(rating_index.ratings)[positions], columns = RatingIndex.columns)
+    S.insert(0, "date", snapshot_dates[snapshot_numbers].astype("datetime64[ns]"))
+    S.insert(1, "id", np.asarray(rating_index.ids)[player_keys].astype("object"))
+    S["last_match"] = dates[positions].astype("datetime64[ns]")
+    return S.sort_values(by = ["date","id"]).reset_index(drop = True)
+
+def write_elo_snapshots(S: pd.DataFrame, filename: str = "elo_snapshots.parquet"):
+    """Writes the output of elo_snapshots as parquet file. The rows are sorted by date, so reading one date only reads the row groups of that date
+    """
+    S.to_parquet(filename + ".tmp", index = False, row_group_size = 20000) # write to a temporary file first so that an interrupted write can't leave a broken file behind
+    os.replace(filename + ".tmp", filename)
+
+def leaderboard(date: datetime, elo_type: str = "overall", top: int = 100, filename: str = "elo_snapshots.parquet", frequency: str = "W-MON", rating_index: RatingIndex = None) -> pd.DataFrame:
+    """Returns the top players by Elo on date from the last snapshot on or before date (written by write_elo_snapshots with the same frequency).
+    If rating_index is given, the players with matches between the snapshot and date get their ratings after these matches from it.
+    
+    Args:
+        elo_type (string): "overall", "hard", "clay" or "grass"
+    
+    Returns:
+        L (pandas dataframe): the columns rank, id, the columns of RatingIndex.columns and last_match, the best player first
+    """
+    column = "elo_" + elo_type
+    if column not in RatingIndex.columns:
+        raise ValueError("elo_type has to be one of overall, hard, clay or grass, not \"{}\".".format(elo_type))
+    date = pd.Timestamp(date)
+    snapshot_date = pd.tseries.frequencies.to_offset(frequency).rollback(date.normalize())
+    S = pd.read_parquet(filename, filters = [("date", "==", snapshot_date)]).drop(columns = ["date"])
+    if rating_index is not None and date > snapshot_date:
+        # The ratings after the snapshot come from the per-match ratings
+        dates = np.asarray(rating_index.dates)
+        positions = np.nonzero((dates >= snapshot_date.value) & (dates <= date.value))[0]
+        player_ids = np.asarray(rating_index.ids)[np.unique(np.searchsorted(np.asarray(rating_index.offsets), positions, side = "right") - 1)].astype("object")
+        U = rating_index.as_of(player_ids, [date]*len(player_ids)).rename(columns = {"date": "last_match"})
+        S = pd.concat([S.loc[~S["id"].isin(player_ids)], U.loc[:,S.columns]], ignore_index = True)
+    L = S.loc[S[column].notna()].sort_values(by = [column, "id"], ascending = [False, True]).head(top).reset_index(drop = True)
+    L.insert(0, "rank", np.arange(1, len(L)+1))
+    return L
+
+def write_tournaments_table(T: pd.DataFrame, name: str = "tournaments"):
+    """Writes the tournaments table to the primary store (tournaments.parquet), see export_excel for the Excel file
+    """
+    write_primary_table(name, T.drop(columns = key_column_names, errors = "ignore"))
+
+def write_tournaments_excel(T: pd.DataFrame, filename: str = "tournaments.xlsx"):
+    writer = pd.ExcelWriter(filename, engine="xlsxwriter",datetime_format="YYYY-MM-DD")
 
     T.to_excel(writer, sheet_name="tournaments", startrow=1, header=False, index=False)
 
@@ -691,20 +2350,23 @@ def write_tournaments_table(T: pd.DataFrame):
     #worksheet.set_column(6,7,30,cell_format)
     #worksheet.set_column(8,8,50,cell_format)
     for i, column in enumerate(T.columns):
-        max_width = max([len(str(x)) for x in T[column]])
+        max_width = T[column].astype(str).str.len().max() if len(T) > 0 else 0
         worksheet.set_column(i, i, max_width + 2,cell_format)
     writer.close()
 
+players_table_columns = ["id","name","given_name","surname","alt_name","id_sackmann","country","birthday","hand","height",\
+    "url","url2","surname_tennis_explorer","surname_tennis_explorer2","elo_overall","match_number","elo_hard","match_number_hard",\
+    "elo_clay","match_number_clay","elo_grass","match_number_grass","previous_match"]
 
-def write_player_table(P: pd.DataFrame, initial_elo: float = 1400):
+def write_player_table(P: pd.DataFrame, initial_elo: float = 1400, name: str = "players"):
     
-    """A function that writes the dataframe in P to the Excel file "players.xlsx".
+    """A function that writes the dataframe in P to the primary store "players.parquet", see export_excel for the Excel file "players.xlsx".
     
     Args:
         P (pandas dataframe): Table of player information
     """
     
-    P_pretty = P # pretty version of P for Excel
+    P_pretty = P.copy() # pretty version of P for Excel
     P_pretty["elo_overall"] = P_pretty["elo_overall"].fillna(initial_elo).round(2)
     P_pretty["elo_hard"] = P_pretty["elo_hard"].fillna(initial_elo).round(2)
     P_pretty["elo_clay"] = P_pretty["elo_clay"].fillna(initial_elo).round(2)
@@ -714,11 +2376,15 @@ def write_player_table(P: pd.DataFrame, initial_elo: float = 1400):
     P_pretty["match_number_clay"] = P_pretty["match_number_clay"].fillna(0)
     P_pretty["match_number_grass"] = P_pretty["match_number_grass"].fillna(0)
 
-    P_pretty = P_pretty.loc[:,["id","name","given_name","surname","alt_name","id_sackmann","country","birthday","hand","height",\
-        "url","url2","surname_tennis_explorer","surname_tennis_explorer2","elo_overall","match_number","elo_hard","match_number_hard",\
-        "elo_clay","match_number_clay","elo_grass","match_number_grass","previous_match"]]
+    P_pretty = P_pretty.loc[:,players_table_columns]
+    write_primary_table(name, P_pretty)
+
+def write_player_excel(P: pd.DataFrame, filename: str = "players.xlsx"):
+    """Writes the players table P (as written by write_player_table) to the Excel file filename
+    """
+    P_pretty = P.loc[:,players_table_columns]
 
-    writer = pd.ExcelWriter('players.xlsx', engine='xlsxwriter',datetime_format="YYYY-MM-DD")
+    writer = pd.ExcelWriter(filename, engine='xlsxwriter',datetime_format="YYYY-MM-DD")
 
     P_pretty.to_excel(writer, sheet_name='players', startrow=1, header=False, index=False)
 
@@ -746,32 +2412,44 @@ def write_player_table(P: pd.DataFrame, initial_elo: float = 1400):
     worksheet.set_column(22, 22, 100,cell_format)
     writer.close()
 
-
-def elo_plot(ids_dict: dict, dates: pd.Series, tourney_dates: pd.Series, winner_ids: pd.Series, loser_ids: pd.Series, winner_elos: pd.Series, loser_elos: pd.Series, rounds: pd.Series, elo_type: str, plot_action: str):
-    
-    M = pd.DataFrame({"date": dates, "tourney_date": tourney_dates, "winner_id": winner_ids, "loser_id": loser_ids, "winner_elo": winner_elos, "loser_elo": loser_elos, "round": rounds})
-    
-    M = sort_matches_table(M,drop_date2=False)
+def export_excel(names: list = ["players", "tournaments"], background_bool: bool = True, folder: str = "."):
+    """Writes the tables in names from the primary store in folder to their Excel files (players.xlsx and tournaments.xlsx).
+    With background_bool the files are written in a thread, so the program can go on in the meantime. The thread is returned, join it before the program exits.
+    """
+    writers = {"players": write_player_excel, "tournaments": write_tournaments_excel}
+    folder = os.path.abspath(folder) # the working directory might change while the thread is running
+    def export():
+        for name in names:
+            parquet_filename, excel_filename, info_filename = [os.path.join(folder, filename) for filename in excel_store_filenames(name)]
+            writers[name](pd.read_parquet(parquet_filename), excel_filename)
+            excel_export_done(os.path.join(folder, name))
+    if not background_bool:
+        export()
+        return None
+    thread = threading.Thread(target = export)
+    thread.start()
+    return thread
+
+
+def elo_plot(ids_dict: dict, rating_index: RatingIndex, elo_type: str, plot_action: str):
+    from matplotlib import pyplot as plt # imported here because it takes a while and is only needed for plots
 
     j = 0
     
     for name, player_id in ids_dict.items():
 
-        M_player = M.loc[(M["winner_id"] == player_id) | (M["loser_id"] == player_id), : ].copy()
-        M_player["player_elo"] = np.nan
-        M_player.loc[ M_player["winner_id"] == player_id, "player_elo" ] = M_player.loc[ M_player["winner_id"] == player_id, "winner_elo"]
-        M_player.loc[ M_player["winner_id"] != player_id, "player_elo" ] = M_player.loc[ M_player["winner_id"] != player_id, "loser_elo"]
+        H = rating_index.history(player_id)
         
         if elo_type == "overall":
-            plt.plot(M_player["date2"], M_player["player_elo"], label = "Overall Elo for " + name)
+            plt.plot(H["date"], H["elo_overall"], label = "Overall Elo for " + name)
             plt.xlabel("Year")
             plt.ylabel("Elo rating")
         elif elo_type == "hard":
-            plt.plot(M_player["date2"], M_player["player_elo"], label = "Hard Court Elo for " + name)
+            plt.plot(H["date"], H["elo_hard"], label = "Hard Court Elo for " + name)
         elif elo_type == "clay":
-            plt.plot(M_player["date2"], M_player["player_elo"], label = "Clay Court Elo for " + name)
+            plt.plot(H["date"], H["elo_clay"], label = "Clay Court Elo for " + name)
         elif elo_type == "grass":
-            plt.plot(M_player["date2"], M_player["player_elo"], label = "Grass Court Elo for " + name)
+            plt.plot(H["date"], H["elo_grass"], label = "Grass Court Elo for " + name)
 
         j+=1
     
@@ -785,135 +2463,200 @@ def elo_plot(ids_dict: dict, dates: pd.Series, tourney_dates: pd.Series, winner_
         plt.savefig("elo_chart_" + player_names + ".jpg",dpi=600)
     plt.clf()
 
-def player_stats_table(player_table: pd.DataFrame, player_names: str, winner_ids: pd.Series, loser_ids: pd.Series, surfaces: pd.Series, winner_elos: pd.Series, loser_elos: pd.Series, winner_elos_surf: pd.Series, loser_elos_surf: pd.Series, dates: pd.Series, tourney_dates: pd.Series, rounds: pd.Series, temps: pd.Series):
+stats_splits = ["overall","hard","clay","grass","hot","cold","morning","afternoon","evening"]
+stats_elo_types = ["overall","hard","clay","grass"]
+
+def normalise_name(name: str) -> str:
+    """Returns the name in lower case, without accents and with blanks instead of hyphens, dots etc., e.g. "Jo-Wilfried  Tsonga" -> "jo wilfried tsonga"
+    """
+    name = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join("".join(character if character.isalnum() else " " for character in name).split())
+
+def name_trigrams(name: str) -> set:
+    padded = "  " + name + " "
+    return {padded[i:i+3] for i in range(len(padded)-2)}
+
+class PlayerNameIndex:
+    """Finds players by name. The names, alternative names and Tennis Explorer surnames (surname_tennis_explorer, surname_tennis_explorer2) of all players
+    are normalised with normalise_name and kept in dicts, so an exact lookup is a single dict access. For unknown spellings, suggestions returns the most similar names,
+    found with an inverted index of the trigrams of the names and ranked by edit similarity, e.g. suggestions("Rafel Nadall") returns Rafael Nadal first.
+    """
+
+    name_columns = ["name", "alt_name"]
+    surname_columns = ["surname_tennis_explorer", "surname_tennis_explorer2"]
+
+    def __init__(self, P: pd.DataFrame):
+        self.names, self.surnames = {}, {}
+        keys_list, ids_list, entries = [], [], {}
+        for column in self.name_columns + self.surname_columns:
+            if column not in P.columns:
+                continue
+            valid = P[column].notna()
+            lookup = self.names if column in self.name_columns else self.surnames
+            for key, player_id, name in zip(P.loc[valid,column].map(normalise_name), P.loc[valid,"id"], P.loc[valid,"name"]):
+                if player_id not in lookup.setdefault(key, []):
+                    lookup[key].append(player_id)
+                if (key, player_id) not in entries:
+                    entries[(key, player_id)] = len(keys_list)
+                    keys_list.append(key)
+                    ids_list.append(player_id)
+        self.entry_keys = np.array(keys_list, dtype = "object")
+        self.entry_ids = np.array(ids_list, dtype = "object")
+        self.player_names = dict(zip(P["id"], P["name"]))
+        self.unique_names = {key: ids[0] for key, ids in self.names.items() if len(ids) == 1}
+
+        # Inverted index: the entries that contain a trigram are entries[starts[t]:starts[t+1]] for the number t of the trigram
+        pairs = [(trigram, entry) for entry, key in enumerate(keys_list) for trigram in name_trigrams(key)]
+        trigram_codes, trigrams = pd.factorize(pd.Series([trigram for trigram, entry in pairs], dtype = "object"))
+        order = np.argsort(trigram_codes, kind = "stable")
+        self.trigram_numbers = {trigram: number for number, trigram in enumerate(trigrams)}
+        self.trigram_entries = np.array([entry for trigram, entry in pairs], dtype = np.int64)[order]
+        self.trigram_starts = np.searchsorted(trigram_codes[order], np.arange(len(trigrams)+1))
+        self.entry_trigram_numbers = np.bincount(np.array([entry for trigram, entry in pairs], dtype = np.int64), minlength = len(keys_list))
+
+    def ids(self, name: str) -> list:
+        """Returns the ids of all players with this name or alternative name (after normalise_name), or with this Tennis Explorer surname if there is none
+        """
+        key = normalise_name(name)
+        return list(self.names.get(key, self.surnames.get(key, [])))
+
+    def resolve(self, name: str) -> str:
+        """Returns the id of the player with the name, None if there is no player or more than one with it
+        """
+        ids = self.ids(name)
+        return ids[0] if len(ids) == 1 else None
+
+    def resolve_names(self, names: pd.Series) -> pd.Series:
+        """Returns the ids of the players with the names (or alternative names), NaN where there is no player or more than one with the name. Surnames are not used
+        """
+        return names.map(normalise_name, na_action = "ignore").map(self.unique_names)
+
+    def known(self, names: pd.Series) -> pd.Series:
+        """Returns for every name whether there is at least one player with this name or alternative name
+        """
+        return names.map(normalise_name, na_action = "ignore").isin(self.names.keys())
+
+    def suggestions(self, name: str, limit: int = 5) -> pd.DataFrame:
+        """Returns the limit players with the most similar names (name, alternative name or surname) to name, the most similar first
+        
+        Returns:
+            S (pandas dataframe): the columns id, name (as in the players table), matched (the normalised name that matched) and score (between 0 and 1, 1 for an exact match)
+        """
+        key = normalise_name(name)
+        numbers = [self.trigram_numbers[trigram] for trigram in name_trigrams(key) if trigram in self.trigram_numbers]
+        if len(numbers) == 0:
+            return pd.DataFrame({"id": [], "name": [], "matched": [], "score": []})
+        entries = np.concatenate([self.trigram_entries[self.trigram_starts[number]:self.trigram_starts[number+1]] for number in numbers])
+        common = np.bincount(entries, minlength = len(self.entry_keys))
+        dice = 2*common / (len(name_trigrams(key)) + self.entry_trigram_numbers) # share of common trigrams
+        candidates = np.argsort(-dice, kind = "stable")[:max(4*limit, 20)]
+        candidates = candidates[dice[candidates] > 0]
+        S = pd.DataFrame({"id": self.entry_ids[candidates], "matched": self.entry_keys[candidates]})
+        S["score"] = [difflib.SequenceMatcher(None, key, matched).ratio() for matched in S["matched"]] # the candidates are ranked by edit similarity
+        S = S.sort_values(by = "score", ascending = False, kind = "stable").drop_duplicates(subset = ["id"]).head(limit).reset_index(drop = True)
+        S.insert(1, "name", S["id"].map(self.player_names))
+        return S
+
+def player_names_to_ids(player_table: pd.DataFrame, player_names: str, name_index: PlayerNameIndex = None) -> dict:
+    """Returns a dict that maps the names in player_names (separated by ", ", e.g. "Rafael Nadal, Novak Djokovic") to the ids of the players.
+    name_index is built from player_table if it is None.
+    """
+    if name_index is None:
+        name_index = PlayerNameIndex(player_table)
+    ids_dict = {}
+    for name in player_names.split(", "):
+        player_id = name_index.resolve(name)
+        if player_id is None:
+            raise LookupError("There is no player named {}. Did you mean {}?".format(name, ", ".join(name_index.suggestions(name)["name"])))
+        ids_dict[name] = player_id
+    return ids_dict
+
+def player_stats(winner_ids: pd.Series, loser_ids: pd.Series, surfaces: pd.Series, winner_elos: pd.Series, loser_elos: pd.Series, winner_elos_surf: pd.Series, \
+    loser_elos_surf: pd.Series, dates: pd.Series, tourney_dates: pd.Series, rounds: pd.Series, temps: pd.Series, player_ids: list = None) -> pd.DataFrame:
+    """Computes the records and Elo peaks of the players with one groupby over all matches (after Dec 1, 2009 like sort_matches_table)
     
+    Args:
+        winner_ids, ..., temps: the columns of the master table
+        player_ids (list): the players for which the stats are computed, None means all players
+    
+    Returns:
+        T (pandas dataframe): one row per player (index id) with the columns wins_<split> and losses_<split> for every split in stats_splits
+            (hot means more than 27 degrees, cold less than 17, morning before 13:00, afternoon 13:00 to 17:59 and evening from 18:00)
+            and elo_max_<type>, elo_max_date_<type>, current_elo_<type> and current_elo_date_<type> for every type in stats_elo_types
+    """
     M = pd.DataFrame({"date": dates, "tourney_date": tourney_dates, "winner_id": winner_ids, "loser_id": loser_ids, "winner_elo": winner_elos, "loser_elo": loser_elos, "winner_elo_surface": winner_elos_surf, "loser_elo_surface": loser_elos_surf, "round": rounds, "surface": surfaces, "temp": temps})
     M = sort_matches_table(M,drop_date2=False)
-    M["hour"] = M["date2"].dt.hour
-    M.loc[M["hour"]==0,"hour"] = np.nan
-
-    ids_dict = player_names_to_ids(player_table,player_names)
-    row_names = ["record_overall", "record_hard","record_clay","record_grass","elo_max","elo_max_hard","elo_max_clay","elo_max_grass",\
-                "current_elo","current_elo_hard","current_elo_clay","current_elo_grass","record_hot","record_cold","record_evening",\
-                "record_morning","record_afternoon"]
-    n = len(row_names)
-    m = len(ids_dict)
-
-    dict = {"stat": row_names}
-    for name in ids_dict:
-        dict[name] = [""]*n
-
-    S = pd.DataFrame(dict)
-
-    for name,id in ids_dict.items():
-        M_player = M.loc[(M["winner_id"]==id) | (M["loser_id"]==id),:].reset_index(drop=True)
-        matches_no = len(M_player.index)
-        wins_no = sum(M_player["winner_id"] == id)
-        losses_no = matches_no - wins_no
-        wins_percent = str(round((wins_no/matches_no)*100,1))+" %"
-        S.loc[0,name] = str(wins_no)+" — "+str(losses_no)+" ("+wins_percent+")" # record overall
-
-        M_player_hard = M_player.loc[M_player["surface"] == "Hard",:].reset_index(drop=True)
-        matches_hard_no = len(M_player_hard.index)
-        wins_hard_no = sum(M_player_hard["winner_id"] == id)
-        losses_hard_no = matches_hard_no - wins_hard_no
-        wins_percent_hard = str(round((wins_hard_no/matches_hard_no)*100,1))+" %"
-        S.loc[1,name] = str(wins_hard_no)+" — "+str(losses_hard_no)+" ("+wins_percent_hard+")" # record hard
-
-        M_player_clay = M_player.loc[M_player["surface"] == "Clay",:].reset_index(drop=True)
-        matches_clay_no = len(M_player_clay.index)
-        wins_clay_no = sum(M_player_clay["winner_id"] == id)
-        losses_clay_no = matches_clay_no - wins_clay_no
-        wins_percent_clay = str(round((wins_clay_no/matches_clay_no)*100,1))+" %"
-        S.loc[2,name] = str(wins_clay_no)+" — "+str(losses_clay_no)+" ("+wins_percent_clay+")" # record clay
-
-
-        M_player_grass = M_player.loc[M_player["surface"] == "Grass",:].reset_index(drop=True)
-        matches_grass_no = len(M_player_grass.index)
-        wins_grass_no = sum(M_player_grass["winner_id"] == id)
-        losses_grass_no = matches_grass_no - wins_grass_no
-        if matches_grass_no > 0:
-            wins_percent_grass = str(round((wins_grass_no/matches_grass_no)*100,1))+" %"
-        else:
-            wins_percent_grass = ""
-        S.loc[3,name] = str(wins_grass_no)+" — "+str(losses_grass_no)+" ("+wins_percent_grass+")" # record grass
-
-
-        M_player["player_elo"] = M_player["winner_elo"]
-        M_player.loc[M["winner_id"] != id, "player_elo"] = M_player.loc[M["winner_id"] != id, "loser_elo"]
-        elo_absolutemax = M_player["player_elo"].max()
-        elo_max_index = np.where(M_player["player_elo"] == elo_absolutemax)[0][0]
-        elo_max_date = M_player.loc[elo_max_index,"date2"].strftime("%d %b, %Y")
-        S.loc[4,name] = str(round(elo_absolutemax,1))+" ("+elo_max_date+")"
-
-        M_player_hard["player_elo_surf"] = M_player_hard["winner_elo_surface"]
-        M_player_hard.loc[M["winner_id"] != id, "player_elo_surf"] = M_player_hard.loc[M["winner_id"] != id, "loser_elo_surface"]
-        elo_absolutemax_hard = M_player_hard["player_elo_surf"].max()
-        elo_max_hard_index = np.where(M_player_hard["player_elo_surf"] == elo_absolutemax_hard)[0][0]
-        elo_max_hard_date = M_player_hard.loc[elo_max_hard_index,"date2"].strftime("%d %b, %Y")
-        S.loc[5,name] = str(round(elo_absolutemax_hard,1))+" ("+elo_max_hard_date+")"
-
-        M_player_clay["player_elo_surf"] = M_player_hard["winner_elo_surface"]
-        M_player_clay.loc[M["winner_id"] != id, "player_elo_surf"] = M_player_clay.loc[M["winner_id"] != id, "loser_elo_surface"]
-        elo_absolutemax_clay = M_player_clay["player_elo_surf"].max()
-        elo_max_clay_index = np.where(M_player_clay["player_elo_surf"] == elo_absolutemax_clay)[0][0]
-        elo_max_clay_date = M_player_clay.loc[elo_max_clay_index,"date2"].strftime("%d %b, %Y")
-        S.loc[6,name] = str(round(elo_absolutemax_clay,1))+" ("+elo_max_clay_date+")"
-
-        M_player_grass["player_elo_surf"] = M_player_grass["winner_elo_surface"]
-        M_player_grass.loc[M["winner_id"] != id, "player_elo_surf"] = M_player_grass.loc[M["winner_id"] != id, "loser_elo_surface"]
-        elo_absolutemax_grass = M_player_grass["player_elo_surf"].max()
-        elo_max_grass_index = np.where(M_player_grass["player_elo_surf"] == elo_absolutemax_grass)[0][0]
-        elo_max_grass_date = M_player_grass.loc[elo_max_grass_index,"date2"].strftime("%d %b, %Y")
-        S.loc[7,name] = str(round(elo_absolutemax_grass,1))+" ("+elo_max_grass_date+")"
-
-        current_elo = M_player.loc[(len(M_player.index)-1),"player_elo"]
-        current_elo_hard = M_player_hard.loc[(len(M_player_hard.index)-1),"player_elo_surf"]
-        current_elo_clay = M_player_clay.loc[(len(M_player_clay.index)-1),"player_elo_surf"]
-        current_elo_grass = M_player_grass.loc[(len(M_player_grass.index)-1),"player_elo_surf"]
-        current_elo_date = M_player.loc[(len(M_player.index)-1),"date2"].strftime("%d %b, %Y")
-        current_elo_hard_date = M_player_hard.loc[(len(M_player_hard.index)-1),"date2"].strftime("%d %b, %Y")
-        current_elo_clay_date = M_player_clay.loc[(len(M_player_clay.index)-1),"date2"].strftime("%d %b, %Y")
-        current_elo_grass_date = M_player_grass.loc[(len(M_player_grass.index)-1),"date2"].strftime("%d %b, %Y")
-
-        S.loc[8,name] = str(round(current_elo,1))+" ("+current_elo_date+")"
-        S.loc[9,name] = str(round(current_elo_hard,1))+" ("+current_elo_hard_date+")"
-        S.loc[10,name] = str(round(current_elo_clay,1))+" ("+current_elo_clay_date+")"
-        S.loc[11,name] = str(round(current_elo_grass,1))+" ("+current_elo_grass_date+")"
-
-        wins_hot_no = sum( (M_player["temp"] > 27) & (M_player["winner_id"] == id))
-        losses_hot_no = sum( (M_player["temp"] > 27) & (M_player["winner_id"] != id))
-        matches_hot_no = wins_hot_no + losses_hot_no
-        wins_percent_hot = str(round((wins_hot_no/matches_hot_no)*100,1))+" %"
-        S.loc[12,name] = str(wins_hot_no)+" — "+str(losses_hot_no)+" ("+wins_percent_hot+")"
-
-        wins_cold_no = sum( (M_player["temp"] < 17) & (M_player["winner_id"] == id))
-        losses_cold_no = sum( (M_player["temp"] < 17) & (M_player["winner_id"] != id))
-        matches_cold_no = wins_cold_no + losses_cold_no
-        wins_percent_cold = str(round((wins_cold_no/matches_cold_no)*100,1))+" %"
-        S.loc[13,name] = str(wins_cold_no)+" — "+str(losses_cold_no)+" ("+wins_percent_cold+")"
-
-        wins_evening_no = sum( (M_player["hour"] >= 18) & (M_player["winner_id"] == id))
-        losses_evening_no = sum( (M_player["hour"] >= 18) & (M_player["winner_id"] != id))
-        matches_evening_no = wins_evening_no + losses_evening_no
-        wins_percent_evening = str(round((wins_evening_no/matches_evening_no)*100,1))+" %"
-        S.loc[14,name] = str(wins_evening_no)+" — "+str(losses_evening_no)+" ("+wins_percent_evening+")"
-
-        wins_morning_no = sum( (M_player["hour"] < 13) & (M_player["winner_id"] == id))
-        losses_morning_no = sum( (M_player["hour"] < 13) & (M_player["winner_id"] != id))
-        matches_morning_no = wins_morning_no + losses_morning_no
-        wins_percent_morning = str(round((wins_morning_no/matches_morning_no)*100,1))+" %"
-        S.loc[15,name] = str(wins_morning_no)+" — "+str(losses_morning_no)+" ("+wins_percent_morning+")"
-
-        wins_afternoon_no = sum( (M_player["hour"].between(13,18)) & (M_player["winner_id"] == id))
-        losses_afternoon_no = sum( (M_player["hour"].between(13,18)) & (M_player["winner_id"] != id))
-        matches_afternoon_no = wins_afternoon_no + losses_afternoon_no
-        wins_percent_afternoon = str(round((wins_afternoon_no/matches_afternoon_no)*100,1))+" %"
-        S.loc[16,name] = str(wins_afternoon_no)+" — "+str(losses_afternoon_no)+" ("+wins_percent_afternoon+")"
-
+    hour = M["date2"].dt.hour.where(M["date2"].dt.hour != 0) # the hour is unknown if only the date is known
+
+    # One row per player and match
+    n = len(M)
+    L = pd.DataFrame({"id": np.concatenate([M["winner_id"].to_numpy(dtype = "object"), M["loser_id"].to_numpy(dtype = "object")]), "won": np.arange(2*n) < n, \
+        "elo": np.concatenate([M["winner_elo"].to_numpy(dtype = np.float64), M["loser_elo"].to_numpy(dtype = np.float64)]), \
+        "elo_surface": np.concatenate([M["winner_elo_surface"].to_numpy(dtype = np.float64), M["loser_elo_surface"].to_numpy(dtype = np.float64)]), \
+        "date": np.tile(M["date2"].to_numpy(), 2), "order": np.tile(np.arange(n), 2)})
+    surface, temp, hour = np.tile(M["surface"].to_numpy(dtype = "object"), 2), np.tile(M["temp"].to_numpy(dtype = np.float64), 2), np.tile(hour.to_numpy(dtype = np.float64), 2)
+    split_masks = {"overall": np.ones(2*n, dtype = bool), "hard": surface == "Hard", "clay": surface == "Clay", "grass": surface == "Grass", "hot": temp > 27, "cold": temp < 17, \
+        "morning": hour < 13, "afternoon": (hour >= 13) & (hour < 18), "evening": hour >= 18}
+    keep = L["id"].notna().to_numpy() if player_ids is None else L["id"].isin(player_ids).to_numpy()
+    L = L.loc[keep].reset_index(drop = True)
+    split_masks = {split: mask[keep] for split, mask in split_masks.items()}
+
+    # Records
+    won = L["won"].to_numpy()
+    counts = pd.DataFrame({column: values for split, mask in split_masks.items() for column, values in [("wins_" + split, mask & won), ("losses_" + split, mask & ~won)]})
+    T = counts.astype(np.int64).groupby(L["id"].to_numpy()).sum()
+    T.index.name = "id"
+
+    # Peaks (the first match with the highest Elo) and current Elos (the last match) of every type
+    for elo_type in stats_elo_types:
+        column = "elo" if elo_type == "overall" else "elo_surface"
+        E = L.loc[split_masks[elo_type] & L[column].notna().to_numpy(), ["id", column, "date", "order"]]
+        peaks = E.sort_values(by = [column, "order"], ascending = [False, True]).drop_duplicates(subset = ["id"]).set_index("id")
+        currents = E.sort_values(by = "order").drop_duplicates(subset = ["id"], keep = "last").set_index("id")
+        T["elo_max_" + elo_type] = peaks[column].reindex(T.index)
+        T["elo_max_date_" + elo_type] = peaks["date"].reindex(T.index)
+        T["current_elo_" + elo_type] = currents[column].reindex(T.index)
+        T["current_elo_date_" + elo_type] = currents["date"].reindex(T.index)
+    if player_ids is not None:
+        T = T.reindex(pd.Index(player_ids, name = "id"))
+        T[counts.columns] = T[counts.columns].fillna(0).astype(np.int64) # players without matches
+    return T
 
+def format_player_stats(T: pd.DataFrame, ids_dict: dict) -> pd.DataFrame:
+    """Formats the stats of the players in ids_dict (name -> id) from the output T of player_stats for display, with one row per stat and one column per player,
+    e.g. "250 — 50 (83.3 %)" for records and "2150.3 (12 Jun, 2013)" for Elos
+    """
+    def record(wins, losses):
+        return str(wins)+" — "+str(losses)+" ("+(str(round(wins/(wins+losses)*100,1))+" %" if wins+losses > 0 else "")+")"
+    def elo(value, date):
+        return str(round(value,1))+" ("+date.strftime("%d %b, %Y")+")" if pd.notna(value) else ""
+
+    elo_names = {"overall": "", "hard": "_hard", "clay": "_clay", "grass": "_grass"}
+    record_splits = ["overall","hard","clay","grass"]
+    row_names = ["record_" + split for split in record_splits] + ["elo_max" + elo_names[elo_type] for elo_type in stats_elo_types] + \
+        ["current_elo" + elo_names[elo_type] for elo_type in stats_elo_types] + ["record_" + split for split in ["hot","cold","evening","morning","afternoon"]]
+    S = pd.DataFrame({"stat": row_names})
+    for name, player_id in ids_dict.items():
+        row = T.loc[player_id]
+        S[name] = [record(row["wins_" + split], row["losses_" + split]) for split in record_splits] + \
+            [elo(row["elo_max_" + elo_type], row["elo_max_date_" + elo_type]) for elo_type in stats_elo_types] + \
+            [elo(row["current_elo_" + elo_type], row["current_elo_date_" + elo_type]) for elo_type in stats_elo_types] + \
+            [record(row["wins_" + split], row["losses_" + split]) for split in ["hot","cold","evening","morning","afternoon"]]
     return S
 
+def player_stats_table(player_table: pd.DataFrame, player_names: str, winner_ids: pd.Series, loser_ids: pd.Series, surfaces: pd.Series, winner_elos: pd.Series, loser_elos: pd.Series, winner_elos_surf: pd.Series, loser_elos_surf: pd.Series, dates: pd.Series, tourney_dates: pd.Series, rounds: pd.Series, temps: pd.Series, name_index: PlayerNameIndex = None, \
+    cities: pd.Series = None, weather_store: "WeatherStore" = None):
+    """Returns the table with the stats of the players in player_names (e.g. "Rafael Nadal, Novak Djokovic") formatted for display, see player_stats and format_player_stats.
+    If weather_store is given, the missing temperatures are looked up there with the cities and dates of the matches. Like in weather_for_matches, only matches
+    with a known start time (hour != 0) get a temperature.
+    """
+    ids_dict = player_names_to_ids(player_table,player_names,name_index)
+    if weather_store is not None:
+        temps_store = weather_store.weather(cities, dates)["temp_c"].set_axis(temps.index)
+        temps = temps.astype("float").fillna(temps_store.where(pd.Series(dates).set_axis(temps.index).dt.hour != 0))
+    T = player_stats(winner_ids,loser_ids,surfaces,winner_elos,loser_elos,winner_elos_surf,loser_elos_surf,dates,tourney_dates,rounds,temps,list(ids_dict.values()))
+    return format_player_stats(T,ids_dict)
+
 def write_stats_table(S: pd.DataFrame):
 
     writer = pd.ExcelWriter("stats_"+ ", ".join(S.columns) + ".xlsx", engine='xlsxwriter')
@@ -974,59 +2717,387 @@ def E_overall(name: str, E: pd.DataFrame):
     E_over.loc[E_over.winner_name == name, "elo_overall"] = E_over.winner_elo[E_over.winner_name == name]
     return E_over
 
-def weather_data(googledrive_url,M):
-    W = pd.read_csv("https://drive.google.com/uc?id=" + googledrive_url.split("/")[-2])
-    W.date = pd.to_datetime(W.date.astype("string")+W.hour.astype("string")+"00", format = '%Y%m%d%H%M%S')
-    W = W.sort_values(by = ["date"], ascending = True)
-    W = W.reset_index(drop=True)
-    r = requests.get(googledrive_url)
-    tree = fromstring(r.content)
-    title = tree.findtext('.//title')
-    title = title[:(title.find("Google Drive")-7)]
-    weather_url = "https://rp5.ru/Weather_archive_in_" + title
+weather_columns = ["temp_c", "hum_perc", "pressure_mmHg", "windspeed_ms"]
+
+def interpolate_readings(reading_times: np.ndarray, readings: np.ndarray, times: np.ndarray) -> np.ndarray:
+    """Linear interpolation of the readings (one row per reading, sorted by reading_times) at times, all times at once with a binary search.
+    The times are int64 nanoseconds, -2**63 (NaT) and times outside of the readings give NaN.
+    """
+    after = np.searchsorted(reading_times, times, side = "right") # the first reading after the time
+    before = after - 1
+    valid = (before >= 0) & (after < len(reading_times)) & (times != np.iinfo(np.int64).min)
+    after, before = np.where(valid, after, 0), np.where(valid, before, 0)
+    if len(reading_times) == 0:
+        return np.full((len(times), readings.shape[1]), np.nan)
+    # We assume a linear graph, i.e. the weight of the reading before is (time after)/(time before + time after) and the weight of the reading after is (time before)/(time before + time after)
+    weight_after = np.where(valid, (times - reading_times[before]) / np.maximum(reading_times[after] - reading_times[before], 1), np.nan)
+    readings_before, readings_after = np.asarray(readings[before], dtype = np.float64), np.asarray(readings[after], dtype = np.float64)
+    return (1-weight_after)[:,np.newaxis]*readings_before + weight_after[:,np.newaxis]*readings_after
+
+def round_weather(R: pd.DataFrame) -> pd.DataFrame:
+    """Rounds the columns in weather_columns like the readings of the stations: temperature, humidity and pressure to one decimal and the wind speed to 0.5
+    """
+    R.loc[:,["temp_c","hum_perc","pressure_mmHg"]] = R.loc[:,["temp_c","hum_perc","pressure_mmHg"]].round(1)
+    R["windspeed_ms"] = (R["windspeed_ms"]*2).round()/2
+    return R
+
+def interpolate_weather(dates: pd.Series, W: pd.DataFrame) -> pd.DataFrame:
+    """Estimates the weather at the dates from the readings of a station by linear interpolation between the last reading before and the first reading after each date,
+    for all dates at once with a binary search in the readings.
+    
+    Args:
+        dates (pandas series): the dates and times of the matches
+        W (pandas dataframe): the readings of the station with the column date and the columns in weather_columns
+    
+    Returns:
+        the table with the columns in weather_columns and one row per date (same index as dates), NaN for dates outside of the readings
+    """
+    W = W.sort_values(by = ["date"])
+    reading_times = W["date"].to_numpy(dtype = "datetime64[ns]").astype(np.int64)
+    times = pd.to_datetime(dates).to_numpy(dtype = "datetime64[ns]").astype(np.int64)
+    values = interpolate_readings(reading_times, W.loc[:,weather_columns].to_numpy(dtype = np.float64), times)
+    return round_weather(pd.DataFrame(values, columns = weather_columns, index = dates.index))
+
+def read_weather_station(filename: str) -> pd.DataFrame:
+    """Reads the readings of a weather station (a file or URL of the csv export of rp5.ru with the columns date as YYYYMMDD, hour and the columns in weather_columns)
+    
+    Returns:
+        the table with the column date (date and hour as datetime) and the columns in weather_columns, sorted by date
+    """
+    W = pd.read_csv(filename)
+    W["date"] = pd.to_datetime(W["date"].astype("string"), format = "%Y%m%d") + pd.to_timedelta(W["hour"], unit = "h")
+    W = W.loc[:,["date"] + weather_columns].sort_values(by = ["date"])
+    return W.reset_index(drop=True)
+
+def weather_data(googledrive_url, M, weather_url: str = None, weather_store: "WeatherStore" = None):
+    """Returns the weather of the matches in M (with the columns URL and date) that belong to the station of the csv file on Google Drive.
+    If weather_url (the rp5.ru URL of the station) is None, it is taken from the title of the Google Drive page.
+    If the station is in weather_store, its readings are taken from there instead of downloading the csv file.
+    """
+    if weather_url is None:
+        r = requests.get(googledrive_url)
+        tree = fromstring(r.content)
+        title = tree.findtext('.//title')
+        title = title[:(title.find("Google Drive")-7)]
+        weather_url = "https://rp5.ru/Weather_archive_in_" + title
+    if weather_store is not None and weather_url in weather_store.station_numbers:
+        W = weather_store.station_readings(weather_url)
+    else:
+        W = read_weather_station("https://drive.google.com/uc?id=" + googledrive_url.split("/")[-2])
     M2 = M.loc[M.URL==weather_url,:]
     M2.loc[:,"hour"] = M2.loc[:,"date"].dt.hour
     M2 = M2.loc[M2.hour!=0,:]
     M2 = M2.drop(["hour"],axis=1)
     M2 = M2.reset_index(drop=True)
-    M2["timestamp_before"] = datetime.strptime("20091201000000", '%Y%m%d%H%M%S')
-    M2["timestamp_after"] = datetime.strptime("20240101000000", '%Y%m%d%H%M%S')
-    for i in range(len(M2.index)-1):
-        row_after = W["date"].gt(M2.date[i]).idxmax() # first instance of the variable W.date being >= M2.date[i]
-        M2.loc[i,"timestamp_before"] = W.date[(row_after-1)]
-        M2.loc[i,"timestamp_after"] = W.date[row_after]
-
-    W = W.drop(["hour"],axis=1)
-    W_before = W.rename({"date": "timestamp_before", "temp_c": "temp_c_before", "hum_perc": "hum_perc_before", \
-        "pressure_mmHg": "pressure_mmHg_before", "windspeed_ms": "windspeed_ms_before"}, axis=1)
-    M2 = pd.merge(M2,W_before,how="left",on="timestamp_before")
-    W_after = W.rename({"date": "timestamp_after", "temp_c": "temp_c_after", "hum_perc": "hum_perc_after", \
-        "pressure_mmHg": "pressure_mmHg_after", "windspeed_ms": "windspeed_ms_after"}, axis=1)
-    M2 = pd.merge(M2,W_after,how="left",on="timestamp_after")
-    M2["minutes_before"] = (M2.date-M2.timestamp_before).dt.total_seconds()
-    M2["minutes_after"] = (M2.timestamp_after-M2.date).dt.total_seconds()
-    # The temperature at the actual time will be estimated by calculating the weighted average between temp_before and temp_after
-    # We assume a linear graph, i.e. the weight for temp_before is (minutes_after)/(minutes_before+minutes_after) and the weight
-    # for temp_after is (minutes_before)/(minutes_before+minutes_after)
-    M2["temp_c"] = round(M2.minutes_after/(M2.minutes_before+M2.minutes_after)*M2.temp_c_before + \
-        M2.minutes_before/(M2.minutes_before+M2.minutes_after)*M2.temp_c_after,1)
-    M2["hum_perc"] = round(M2.minutes_after/(M2.minutes_before+M2.minutes_after)*M2.hum_perc_before + \
-        M2.minutes_before/(M2.minutes_before+M2.minutes_after)*M2.hum_perc_after,1)
-    M2["pressure_mmHg"] = round(M2.minutes_after/(M2.minutes_before+M2.minutes_after)*M2.pressure_mmHg_before + \
-        M2.minutes_before/(M2.minutes_before+M2.minutes_after)*M2.pressure_mmHg_after,1)
-    M2["windpssed_ms"] = round((M2.minutes_after/(M2.minutes_before+M2.minutes_after)*M2.windspeed_ms_before + \
-        M2.minutes_before/(M2.minutes_before+M2.minutes_after)*M2.windspeed_ms_after)*2)/2
-    M2 = M2.drop(["URL","date","timestamp_before","timestamp_after","minutes_before","minutes_after","temp_c_before","temp_c_after",\
-        "hum_perc_before","hum_perc_after","pressure_mmHg_before","pressure_mmHg_after","windspeed_ms_before","windspeed_ms_after"],axis=1)
+    M2 = pd.concat([M2, interpolate_weather(M2["date"], W)], axis=1)
+    M2 = M2.drop(["URL","date"],axis=1)
     return M2
 
-def strip_strings(x):
-    if isinstance(x, str):
-        return x.strip()
-    else:
-        return x
+match_weather_columns = {"temp_c": "temp", "hum_perc": "hum", "windspeed_ms": "wind"} # columns of the stations -> columns of the matches table
+
+def weather_station_filename(weather_url: str, folder: str = "weather_stations") -> str:
+    """Returns the file in folder where the readings of the station with the rp5.ru URL weather_url are cached, e.g. weather_stations/Abuja_(airport).csv
+    """
+    station = weather_url.split("Weather_archive_in_")[-1]
+    station = "".join(character if character.isalnum() or character in "()_-.," else "_" for character in station)
+    return os.path.join(folder, station + ".csv")
+
+def cache_weather_stations(sources: dict, folder: str = "weather_stations", max_workers: int = 8, overwrite_bool: bool = False) -> list:
+    """Downloads the csv files of the stations that are not in folder yet, at the same time in several threads
+    
+    Args:
+        sources (dict): rp5.ru URL of the station -> Google Drive URL of its csv file
+        overwrite_bool (boolean): if true, the files that are already in folder are downloaded again
+    
+    Returns:
+        the list of the rp5.ru URLs of the stations that were downloaded
+    """
+    os.makedirs(folder, exist_ok = True)
+    missing = {weather_url: googledrive_url for weather_url, googledrive_url in sources.items() if overwrite_bool or not os.path.isfile(weather_station_filename(weather_url, folder))}
+
+    def download(item):
+        weather_url, googledrive_url = item
+        filename = weather_station_filename(weather_url, folder)
+        r = requests.get("https://drive.google.com/uc?id=" + googledrive_url.split("/")[-2], timeout = 60)
+        r.raise_for_status()
+        with open(filename + ".tmp", "wb") as file:
+            file.write(r.content)
+        os.replace(filename + ".tmp", filename) # a download that fails halfway doesn't leave a broken file in the cache
+        return weather_url
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        return list(executor.map(download, missing.items()))
+
+def station_weather(filename: str, dates: pd.Series) -> pd.DataFrame:
+    return interpolate_weather(dates, read_weather_station(filename))
+
+def weather_for_matches(master_table: pd.DataFrame, cities_table: pd.DataFrame, folder: str = "weather_stations", processes: int = None, weather_store: "WeatherStore" = None) -> pd.DataFrame:
+    """Estimates the weather of all matches from the cached station files in folder (see cache_weather_stations), the stations are read and interpolated in parallel.
+    The station of a city is the one in the column URL of cities_table; for the matches it has no readings for, URL2 and then URL3 are used.
+    Only cities with relevant_for_weather and matches with a known time (hour not 0) are considered.
+    
+    Args:
+        master_table (pandas dataframe): the matches with the columns match_id, date and city
+        cities_table (pandas dataframe): corresponds to cities.csv
+        processes (int): number of worker processes, None means one per core, 1 means no worker processes
+        weather_store (WeatherStore): if not None, the weather is looked up in the store (see read_weather_store) and folder and processes are not used
+    
+    Returns:
+        the table with the column match_id and the columns in weather_columns, one row per match with weather
+    """
+    C = cities_table.loc[cities_table["relevant_for_weather"].fillna(False).astype(bool), ["city","URL","URL2","URL3"]].drop_duplicates(subset = ["city"])
+    M = master_table.loc[master_table["date"].notna() & (master_table["date"].dt.hour != 0), ["match_id","date","city"]]
+    if weather_store is not None:
+        R = weather_store.weather(M["city"].where(M["city"].isin(C["city"])), M["date"])
+        R.insert(0, "match_id", M["match_id"])
+        return R.loc[R["temp_c"].notna(),:].reset_index(drop=True)
+    M = pd.merge(M, C, how = "left", on = "city")
+    R = pd.DataFrame(np.nan, index = M.index, columns = weather_columns)
+    for url_column in ["URL","URL2","URL3"]:
+        # The matches without weather so far, grouped by the station of this column that has a cached file
+        todo = R["temp_c"].isna() & M[url_column].notna()
+        filenames = M.loc[todo, url_column].map(lambda weather_url: weather_station_filename(weather_url, folder))
+        filenames = filenames[filenames.map(os.path.isfile)]
+        if len(filenames) == 0:
+            continue
+        groups = list(M.loc[filenames.index, "date"].groupby(filenames))
+        arguments = [[filename for filename, _ in groups], [dates for _, dates in groups]]
+        if processes == 1 or len(groups) == 1:
+            results = list(map(station_weather, *arguments))
+        else:
+            with ProcessPoolExecutor(max_workers = processes) as executor:
+                results = list(executor.map(station_weather, *arguments))
+        station_results = pd.concat(results)
+        found = station_results.index[station_results["temp_c"].notna()]
+        R.loc[found, weather_columns] = station_results.loc[found, weather_columns]
+    R.insert(0, "match_id", M["match_id"])
+    return R.loc[R["temp_c"].notna(),:].reset_index(drop=True)
+
+def update_match_weather(matches_table: pd.DataFrame, W: pd.DataFrame) -> pd.DataFrame:
+    """Returns a copy of matches_table where the columns temp, hum and wind are replaced by the weather in W (output of weather_for_matches) for the matches in W,
+    all at once with the row of every match looked up by its integer key (see KeyMap)
+    """
+    matches_table = add_keys("matches", matches_table).copy()
+    rows = key_positions(matches_table["match_key"].to_numpy(), keys.encode("matches", W["match_id"]))
+    found = rows >= 0
+    columns = list(match_weather_columns.values())
+    for column in columns:
+        matches_table[column] = matches_table[column].astype("float")
+    matches_table.iloc[rows[found], [matches_table.columns.get_loc(column) for column in columns]] = W.loc[found, list(match_weather_columns)].to_numpy(dtype = np.float64)
+    return matches_table
+
+class WeatherStore:
+    """The readings of all weather stations in one binary store. The readings of all stations are stored in contiguous arrays, sorted by station and time,
+    and offsets[i]:offsets[i+1] is the part of the station stations[i]. times are int64 nanoseconds since the epoch and readings float32 with the columns in weather_columns.
+    Every city has up to three stations (URL, URL2 and URL3 of cities.csv) in city_stations. save writes the arrays as .npy files, which load can memory-map,
+    so the weather of a city at a time is a binary search in a slice of the arrays and no csv file has to be parsed.
+    E.g. weather_store.weather(["Rome, Italy"], [datetime(2015,5,10,14)]) returns the weather in Rome during the final of the Italian Open 2015.
+    """
+
+    arrays = ["offsets", "times", "readings", "city_stations"]
+
+    def __init__(self, stations: list, cities: list, offsets: np.ndarray, times: np.ndarray, readings: np.ndarray, city_stations: np.ndarray):
+        self.stations = stations # rp5.ru URLs of the stations
+        self.cities = cities
+        self.offsets = offsets # int64, one more than the number of stations
+        self.times = times # int64 nanoseconds
+        self.readings = readings # float32 with the columns in weather_columns
+        self.city_stations = city_stations # int64, one row per city with the positions of its stations in stations (-1 if there is none)
+        self.station_numbers = {station: number for number, station in enumerate(stations)}
+        self.city_numbers = {city: number for number, city in enumerate(cities)}
+
+    @classmethod
+    def from_stations(cls, cities_table: pd.DataFrame, folder: str = "weather_stations", processes: int = None):
+        """Builds the store from the station csv files in folder (see weather_station_filename) of the cities with relevant_for_weather, the files are read in parallel
+        """
+        C = cities_table.loc[cities_table["relevant_for_weather"].fillna(False).astype(bool), ["city","URL","URL2","URL3"]].drop_duplicates(subset = ["city"])
+        urls = C.loc[:,["URL","URL2","URL3"]]
+        stations = sorted({weather_url for weather_url in urls.stack().dropna() if os.path.isfile(weather_station_filename(weather_url, folder))})
+        filenames = [weather_station_filename(weather_url, folder) for weather_url in stations]
+        if processes == 1 or len(filenames) <= 1:
+            tables = list(map(read_weather_station, filenames))
+        else:
+            with ProcessPoolExecutor(max_workers = processes) as executor:
+                tables = list(executor.map(read_weather_station, filenames))
+        offsets = np.concatenate([[0], np.cumsum([len(W.index) for W in tables])]).astype(np.int64)
+        times = np.concatenate([W["date"].to_numpy(dtype = "datetime64[ns]").astype(np.int64) for W in tables] + [np.zeros(0, dtype = np.int64)])
+        readings = np.concatenate([W.loc[:,weather_columns].to_numpy(dtype = np.float32) for W in tables] + [np.zeros((0, len(weather_columns)), dtype = np.float32)])
+        station_numbers = {station: number for number, station in enumerate(stations)}
+        city_stations = urls.apply(lambda column: column.map(station_numbers)).fillna(-1).to_numpy(dtype = np.int64)
+        return cls(stations, list(C["city"]), offsets, times, readings, city_stations)
+
+    def save(self, folder: str = "weather_store"):
+        os.makedirs(folder, exist_ok = True)
+        for name in self.arrays:
+            np.save(os.path.join(folder, name + ".npy"), getattr(self, name))
+        with open(os.path.join(folder, "names.json"), "w") as f:
+            json.dump({"stations": self.stations, "cities": self.cities}, f)
+
+    @classmethod
+    def load(cls, folder: str = "weather_store", mmap_bool: bool = True):
+        """Reads a store written by save. With mmap_bool the arrays are memory-mapped, so only the parts of the stations that are looked up are read from disk
+        """
+        with open(os.path.join(folder, "names.json")) as f:
+            names = json.load(f)
+        return cls(names["stations"], names["cities"], *[np.load(os.path.join(folder, name + ".npy"), mmap_mode = "r" if mmap_bool else None) for name in cls.arrays])
+
+    def station_slice(self, weather_url: str) -> slice:
+        number = self.station_numbers.get(weather_url)
+        if number is None:
+            return slice(0, 0)
+        return slice(int(self.offsets[number]), int(self.offsets[number+1]))
+
+    def station_readings(self, weather_url: str) -> pd.DataFrame:
+        """Returns the readings of the station like read_weather_station
+        """
+        part = self.station_slice(weather_url)
+        W = pd.DataFrame(np.asarray(self.readings[part], dtype = np.float64), columns = weather_columns)
+        W.insert(0, "date", pd.to_datetime(np.asarray(self.times[part])))
+        return W
+
+    def station_weather(self, station_numbers: np.ndarray, times: np.ndarray) -> np.ndarray:
+        """Returns the interpolated readings at the times (int64 nanoseconds) of the stations with the numbers (-1 for none), NaN where a station has no readings around the time
+        """
+        values = np.full((len(times), len(weather_columns)), np.nan)
+        for number in np.unique(station_numbers[station_numbers >= 0]):
+            positions = np.flatnonzero(station_numbers == number)
+            start, end = int(self.offsets[number]), int(self.offsets[number+1])
+            values[positions] = interpolate_readings(np.asarray(self.times[start:end]), self.readings[start:end], times[positions])
+        return values
+
+    def weather(self, cities, dates) -> pd.DataFrame:
+        """Returns the weather in the cities at the dates, one row per city and date with the columns in weather_columns (NaN if there are no readings).
+        The first station of the city (URL) is used, for the dates it has no readings around URL2 and then URL3.
+        """
+        cities = pd.Series(cities)
+        city_numbers = cities.map(self.city_numbers).fillna(-1).to_numpy(dtype = np.int64)
+        times = pd.to_datetime(pd.Series(dates)).to_numpy(dtype = "datetime64[ns]").astype(np.int64)
+        city_stations = np.vstack([np.asarray(self.city_stations), np.full((1, 3), -1, dtype = np.int64)]) # the row -1 for unknown cities
+        values = np.full((len(times), len(weather_columns)), np.nan)
+        for column in range(3):
+            todo = np.isnan(values[:,0])
+            values[todo] = self.station_weather(city_stations[city_numbers[todo], column], times[todo])
+        return round_weather(pd.DataFrame(values, columns = weather_columns, index = cities.index))
+
+def read_weather_store(cities_table: pd.DataFrame, station_folder: str = "weather_stations", folder: str = "weather_store", processes: int = None) -> WeatherStore:
+    """Returns the weather store of the stations in station_folder. The store is kept in folder and only built again if the cities or the station files have changed
+    """
+    files = sorted((filename, os.path.getsize(os.path.join(station_folder, filename)), os.path.getmtime(os.path.join(station_folder, filename))) \
+        for filename in (os.listdir(station_folder) if os.path.isdir(station_folder) else []) if filename.endswith(".csv"))
+    cities = pd.util.hash_pandas_object(cities_table.loc[:,["city","URL","URL2","URL3","relevant_for_weather"]], index = False).to_numpy().tobytes()
+    fingerprint = hashlib.sha256(cities + json.dumps(files).encode("utf-8")).hexdigest()
+    info_filename = os.path.join(folder, "info.json")
+    if os.path.isfile(info_filename):
+        with open(info_filename) as f:
+            if json.load(f).get("sha256") == fingerprint:
+                return WeatherStore.load(folder)
+    weather_store = WeatherStore.from_stations(cities_table, station_folder, processes)
+    weather_store.save(folder)
+    with open(info_filename, "w") as f:
+        json.dump({"sha256": fingerprint}, f)
+    return weather_store
+
+def strip_string_columns(D: pd.DataFrame, double_blanks_bool: bool = False) -> pd.DataFrame:
+    """Returns D with the blanks at the start and the end of all strings removed (and double blanks replaced by single ones if double_blanks_bool),
+    column by column with the vectorised string methods. Values that are not strings stay as they are.
+    """
+    D = D.copy()
+    for column in D.columns:
+        if pd.api.types.is_string_dtype(D[column]):
+            stripped = D[column].str.strip()
+            if double_blanks_bool:
+                stripped = stripped.str.replace("  ", " ", regex = False)
+            D[column] = stripped.where(stripped.notna(), D[column]) # .str returns NaN for values that are not strings
+    return D
+
+def drop_unresolved_matches(M: pd.DataFrame, source: str) -> pd.DataFrame:
+    """Returns the matches in M whose winner_id and loser_id were found (see PlayerNameIndex.resolve_names) and warns about the names of the players that weren't,
+    because they are unknown or belong to more than one player. With more than 10 names, they are written to the file "unresolved_player_names.csv".
+    """
+    unresolved = M["winner_id"].isna() | M["loser_id"].isna()
+    names = pd.concat([M.loc[M["winner_id"].isna(),"winner_name"], M.loc[M["loser_id"].isna(),"loser_name"]]).drop_duplicates()
+    if len(names)>10:
+        names.to_csv("unresolved_player_names.csv",index=False)
+        warningmessage = "{} matches from {} were dropped because the names of their players are unknown or not unique. The names have been written to the file \"unresolved_player_names.csv\". You should add them to the players table (e.g. as alt_name).".format(unresolved.sum(), source)
+        warnings.warn(warningmessage, UserWarning, stacklevel=2)
+    elif len(names)>=1:
+        warningmessage = "{} matches from {} were dropped because the names of their players are unknown or not unique. The names are:".format(unresolved.sum(), source)
+        for name in names:
+            warningmessage += ("\n"+str(name))
+        warnings.warn(warningmessage, UserWarning, stacklevel=2)
+    return M.loc[~unresolved,:].reset_index(drop=True)
+
+class GithubFetcher:
+    """Downloads files of Jeff Sackmann's tennis_atp repository (or any other base_url) concurrently over a pool of HTTP connections and keeps them in cache_folder.
+    A cached file is only downloaded again if it has changed (conditional requests with ETag and Last-Modified), so checking for updates costs one request per file
+    and no download if nothing has changed. E.g. GithubFetcher().fetch(["atp_players.csv"]) returns {"atp_players.csv": ("github_cache/atp_players.csv", True)}.
+    """
 
-def download_from_github(year: int = datetime.now().year, matches_table: pd.DataFrame = read_matches(), players_table: pd.DataFrame = read_players(), tournaments_table: pd.DataFrame = read_tournaments()):
+    def __init__(self, base_url: str = "https://raw.githubusercontent.com/JeffSackmann/tennis_atp/master/", cache_folder: str = "github_cache", max_workers: int = 8, timeout: float = 60):
+        self.base_url = base_url
+        self.cache_folder = cache_folder
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections = max_workers, pool_maxsize = max_workers, max_retries = 2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch_file(self, filename: str) -> Tuple[str, bool]:
+        """Returns the path of the cached file (None if it doesn't exist upstream, e.g. the futures of a year that hasn't started) and whether it was downloaded
+        """
+        path = os.path.join(self.cache_folder, filename)
+        info_path = path + ".json"
+        headers = {}
+        if os.path.isfile(path) and os.path.isfile(info_path):
+            with open(info_path) as f:
+                info = json.load(f)
+            if info.get("etag") is not None:
+                headers["If-None-Match"] = info["etag"]
+            if info.get("last_modified") is not None:
+                headers["If-Modified-Since"] = info["last_modified"]
+        response = self.session.get(self.base_url + filename, headers = headers, timeout = self.timeout)
+        if response.status_code == 304:
+            return path, False
+        if response.status_code == 404:
+            return None, False
+        response.raise_for_status()
+        os.makedirs(self.cache_folder, exist_ok = True)
+        with open(path + ".tmp", "wb") as f: # write to a temporary file first so that an interrupted download can't leave a broken file behind
+            f.write(response.content)
+        os.replace(path + ".tmp", path)
+        with open(info_path, "w") as f:
+            json.dump({"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}, f)
+        return path, True
+
+    def fetch(self, filenames: list) -> dict:
+        """Fetches all the files at once, returns a dict that maps every filename to the output of fetch_file
+        """
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            return dict(zip(filenames, executor.map(self.fetch_file, filenames)))
+
+def github_match_filenames(years: list) -> list:
+    return [prefix + str(year) + ".csv" for year in years for prefix in ["atp_matches_", "atp_matches_qual_chall_", "atp_matches_futures_"]]
+
+def download_from_github(year: int = None, matches_table: pd.DataFrame = None, players_table: pd.DataFrame = None, tournaments_table: pd.DataFrame = None, \
+    years: list = None, fetcher: GithubFetcher = None):
+    """Returns the matches, tournaments and players from Jeff Sackmann's repository that are not in the tables yet, for the year or for all years in years (backfill).
+    The files are fetched with fetcher (a GithubFetcher with the default cache folder if None), so only files that have changed upstream are downloaded.
+    """
+
+    # Default values are determined here and not in the signature, so that importing this module does not read any files
+    if year is None:
+        year = datetime.now().year
+    if years is None:
+        years = [year]
+    if fetcher is None:
+        fetcher = GithubFetcher()
+    if matches_table is None:
+        matches_table = tables.matches
+    if players_table is None:
+        players_table = tables.players
+    if tournaments_table is None:
+        tournaments_table = tables.tournaments
     
     matches_github_columns = ["tourney_id","tourney_name","surface","tourney_date","score","best_of","round","minutes","w_ace","w_df","w_svpt","w_1stIn","w_1stWon",\
                               "w_2ndWon","w_SvGms","w_bpSaved","w_bpFaced","l_ace","l_df","l_svpt","l_1stIn","l_1stWon","l_2ndWon","l_SvGms","l_bpSaved","l_bpFaced",\
@@ -1040,38 +3111,35 @@ def download_from_github(year: int = datetime.now().year, matches_table: pd.Data
     players_github_dtypes = {"player_id": "Int64", "name_first": "str", "name_last": "str", "hand": "str", "dob": "Int64", "ioc": "str", "height": "Int64", "wikidata_id": "str"}
     
     
-    matches_atp = pd.read_csv("https://raw.githubusercontent.com/JeffSackmann/tennis_atp/master/atp_matches_" + str(year) + ".csv", dtype = matches_github_dtypes, usecols = matches_github_columns, parse_dates=["tourney_date"])
-    matches_chal = pd.read_csv("https://raw.githubusercontent.com/JeffSackmann/tennis_atp/master/atp_matches_qual_chall_" + str(year) + ".csv", dtype = matches_github_dtypes, usecols = matches_github_columns, parse_dates=["tourney_date"])
-    matches_itf = pd.read_csv("https://raw.githubusercontent.com/JeffSackmann/tennis_atp/master/atp_matches_futures_" + str(year) + ".csv", dtype = matches_github_dtypes, usecols = matches_github_columns, parse_dates=["tourney_date"])
-    players_github = pd.read_csv("https://raw.githubusercontent.com/JeffSackmann/tennis_atp/master/atp_players.csv", dtype = players_github_dtypes)
+    # All the files are requested at once, the ones that haven't changed since the last time are taken from the cache
+    files = fetcher.fetch(github_match_filenames(years) + ["atp_players.csv"])
+    if files["atp_players.csv"][0] is None:
+        raise FileNotFoundError("There is no file \"atp_players.csv\" at {}.".format(fetcher.base_url))
+    matches_list = [pd.read_csv(files[filename][0], dtype = matches_github_dtypes, usecols = matches_github_columns, parse_dates=["tourney_date"]).assign(year = year_file) \
+        for year_file in years for filename in github_match_filenames([year_file]) if files[filename][0] is not None]
+    players_github = pd.read_csv(files["atp_players.csv"][0], dtype = players_github_dtypes)
     ioc_codes = pd.read_csv("ioc_codes.csv")
 
-    matches_github = pd.concat([matches_atp,matches_chal,matches_itf]).reset_index(drop=True)
+    matches_github = pd.concat(matches_list).reset_index(drop=True)
 
     matches_github.to_csv("matches_new_0.csv",index=False)
 
     # Strip blanks
-    matches_github = matches_github.applymap(strip_strings)
-    matches_github = matches_github.applymap(lambda x: x.replace("  ", " ") if isinstance(x, str) else x)
-    players_github = players_github.applymap(strip_strings)
+    matches_github = strip_string_columns(matches_github, double_blanks_bool = True)
+    players_github = strip_string_columns(players_github)
 
-    matches_github["year"] = year
     matches_github["tourney_id"] = tourney_id(matches_github["year"], matches_github["tourney_name"], matches_github["tourney_date"])
 
-    alt_names = players_table.loc[~players_table.alt_name.isna(),["name","alt_name"]].reset_index(drop=True)
-    for row in alt_names.itertuples():
-        matches_github.loc[ matches_github["winner_name"] == row.alt_name, "winner_name" ] = row.name
-        matches_github.loc[ matches_github["loser_name"] == row.alt_name, "loser_name" ] = row.name
-    
-
+    # The names are only resolved by PlayerNameIndex (after normalise_name, also by the alternative names), as in european_league_scores
     players_github["name"] = players_github["name_first"] + " " + players_github["name_last"]
-    player_not_available = (~players_github["name"].isin(players_table["name"])) & (~players_github["name"].isin(players_table["alt_name"]))
-    player_relevant = players_github["name"].isin(matches_github["winner_name"]) | players_github["name"].isin(matches_github["loser_name"])
+    player_not_available = ~PlayerNameIndex(players_table).known(players_github["name"])
+    match_names = pd.concat([matches_github["winner_name"], matches_github["loser_name"]]).map(normalise_name, na_action = "ignore")
+    player_relevant = players_github["name"].map(normalise_name, na_action = "ignore").isin(match_names)
     players_new = players_github.loc[player_not_available & player_relevant, : ]
     players_new = players_new.rename({"player_id": "id_sackmann"}, axis = 1)
     players_new = pd.merge(players_new, ioc_codes, how = "left", left_on = "ioc", right_on = "code")
     players_new["birthday"] = pd.to_datetime(players_new["dob"], format = "%Y%m%d",errors="coerce")
-    players_new["hand"] = np.where(players_new["hand"] == "L", "left", np.where(players_new["hand"] == "R", "right", np.nan))
+    players_new["hand"] = players_new["hand"].map({"L": "left", "R": "right"})
     players_new["id"] = player_id(players_new["name"], players_new["country"], players_new["birthday"])
     players_new["elo_overall"] = 1400
     players_new["elo_hard"] = 1400
@@ -1085,14 +3153,12 @@ def download_from_github(year: int = datetime.now().year, matches_table: pd.Data
 
     players_total = pd.concat([players_table,players_new]).reset_index(drop=True)
 
-    players_lookup_winner = players_total.loc[:,["name","id"]]
-    players_lookup_winner = players_lookup_winner.rename({"name": "winner_name", "id": "winner_id"},axis=1)
-    matches_github = pd.merge(matches_github, players_lookup_winner, how = "left", on = "winner_name")
-    players_lookup_loser = players_total.loc[:,["name","id"]]
-    players_lookup_loser = players_lookup_loser.rename({"name": "loser_name", "id": "loser_id"},axis=1)
-    matches_github = pd.merge(matches_github, players_lookup_loser, how = "left", on = "loser_name")
+    name_index = PlayerNameIndex(players_total)
+    matches_github["winner_id"] = name_index.resolve_names(matches_github["winner_name"])
+    matches_github["loser_id"] = name_index.resolve_names(matches_github["loser_name"])
+    matches_github = drop_unresolved_matches(matches_github, "GitHub")
     matches_github["match_id"] = match_id(matches_github["tourney_id"], matches_github["winner_id"], matches_github["loser_id"], matches_github["score"])
-    matches_not_available = ~(matches_github["match_id"].isin(matches_table["match_id"]))
+    matches_not_available = key_positions(add_keys("matches", matches_table)["match_key"].to_numpy(), keys.encode("matches", matches_github["match_id"])) == -1
     matches_new = matches_github.loc[matches_not_available, : ]
 
     #players_total_winner = players_total.loc[:,["name","id"]].rename({"name": "winner_name", "id": "winner_id"},axis=1)
@@ -1102,11 +3168,10 @@ def download_from_github(year: int = datetime.now().year, matches_table: pd.Data
     players_new = players_new.drop(["name_first","name_last","wikidata_id","dob","ioc","code"], axis = 1)
 
 
-    tournaments_github = matches_github.loc[:,["tourney_id","tourney_name","surface","tourney_date"]]
-    tournaments_github["year"] = year
+    tournaments_github = matches_github.loc[:,["tourney_id","tourney_name","surface","tourney_date","year"]]
     tournaments_github = tournaments_github.drop_duplicates().reset_index(drop=True)
     tournaments_github = tournaments_github.rename({"tourney_date": "date", "tourney_name": "name", "tourney_id": "id"},axis=1)
-    tournament_not_available = (~tournaments_github["id"].isin(tournaments_table["id"]))
+    tournament_not_available = key_positions(add_keys("tournaments", tournaments_table)["tourney_key"].to_numpy(), keys.encode("tournaments", tournaments_github["id"])) == -1
     tournaments_new = tournaments_github.loc[tournament_not_available, : ]
 
     #M = M.drop(["tourney_name", "surface","tourney_date"], axis = 1)
@@ -1141,14 +3206,15 @@ def aces_per_point(M: pd.DataFrame, year: int, tourney_name: str) -> int:
     return total_aces/total_points
 
 def european_league_scores(country: str, surface: str, outdoor_bool: bool, P: pd.DataFrame, filename: str):
-    players_lookup = P.loc[:,["name","id"]]
     M = pd.read_excel(filename,parse_dates=["date"],sheet_name="matches")
     C = pd.read_excel(filename,sheet_name="clubs")
     M = M.loc[(M["w_check"]=="OK") & (M["l_check"]=="OK") & (M["h_check"]=="OK") & (M["a_check"]=="OK"),:].reset_index(drop=True)
     M["tourney_id"] = tourney_id(M["date"].dt.year,M["tourney_name"],M["date"])
     M["best_of"] = 3
-    M = pd.merge(left=M,right=players_lookup.rename({"id": "winner_id", "name": "winner_name"},axis=1),on="winner_name",how="left")
-    M = pd.merge(left=M,right=players_lookup.rename({"id": "loser_id", "name": "loser_name"},axis=1),on="loser_name",how="left")
+    name_index = PlayerNameIndex(P) # the names are resolved after normalise_name, also by their alternative names
+    M["winner_id"] = name_index.resolve_names(M["winner_name"])
+    M["loser_id"] = name_index.resolve_names(M["loser_name"])
+    M = drop_unresolved_matches(M, filename)
     T = M.loc[:,["home_team","away_team","tourney_name","date","tourney_id"]].drop_duplicates().reset_index(drop=True)
     T["date"] = pd.to_datetime(T["date"].dt.date)
     T = pd.merge(T,C,how="left",left_on="home_team",right_on="club")
@@ -17,12 +17,16 @@ bool_exit_main_menu = False
 
 bool_players_start_table_loaded = False
 
+excel_export_thread = None
+
 print("Reading all the datasets, this will take just a couple of seconds.")
-matches_table = read_matches()
-tournaments_table = read_tournaments()
-cities_table = read_cities()
-players_table = read_players()
+matches_table = tables.matches
+tournaments_table = tables.tournaments
+cities_table = tables.cities
+players_table = tables.players
 master_table = create_master_table(True,True,matches_table,tournaments_table,cities_table)
+name_index = PlayerNameIndex(players_table)
+weather_store = read_weather_store(cities_table) if os.path.isdir("weather_stations") else None # fills in the missing temperatures of the stats
 
 
 def generate_player_name_id_dict():
@@ -32,12 +36,12 @@ def generate_player_name_id_dict():
     ids_list = ["tmp"]*len(names_list)
     dict = {}
     for name in names_list:
-        tmp = players_table.loc[players_table["name"] == name, "id"]
-        while len(tmp) == 0:
-            print("There is no player named {}. Please correct your input for this player.".format(name))
+        player_id = name_index.resolve(name)
+        while player_id is None:
+            print("There is no player named {}. Did you mean {}? Please correct your input for this player.".format(name, ", ".join(name_index.suggestions(name)["name"])))
             name = input()
-            tmp = players_table.loc[players_table["name"] == name, "id"]
-        dict[name] = tmp.item()
+            player_id = name_index.resolve(name)
+        dict[name] = player_id
 
     return dict
 
@@ -63,22 +67,37 @@ while not bool_exit_main_menu:
     print("[2] Calculate player stats.")
     print("[3] Check for update for matches on https://github.com/JeffSackmann/tennis_atp.")
     print("[4] Check for updates in the folder \"scores\".")
-    print("[5] Exit.")
+    print("[5] Export \"players.parquet\" and \"tournaments.parquet\" to Excel (in the background).")
+    print("[6] Exit.")
     main_menu = int(input())
     if main_menu == 1:
+        checkpoint_bool = os.path.isfile("elo_checkpoint.csv") and "winner_elo_before" in matches_table.columns # the matches before the checkpoint need the Elos before the match as well
         if not bool_players_start_table_loaded: # Import elo_ratings_yearend_2009, but only if we haven't done so already
             P_start_dtypes = {"id": "str", "elo_overall": "float", "match_number": "int"}
             P_start = pd.read_csv("elo_ratings_yearend_2009.csv", dtype = P_start_dtypes )
+        if checkpoint_bool: # Continue from the ratings of the last run, so only the new matches need to be processed (unless there are new matches before the checkpoint)
+            print("Continuing from the ratings in \"elo_checkpoint.csv\" (delete this file to calculate all the ratings from scratch).")
+            P_checkpoint = read_elo_checkpoint()
+            processed_match_ids = read_checkpoint_match_ids()
+        else:
+            P_checkpoint = P_start
+            processed_match_ids = None
             
         elos_match_by_match, players_ratings_final = update_elo(master_table["match_id"],master_table["winner_id"],master_table["loser_id"],master_table["score"],master_table["tourney_date"],\
-                        master_table["date"],master_table["surface"],master_table["tourney_level"],master_table["round"],P_start)
+                        master_table["date"],master_table["surface"],master_table["tourney_level"],master_table["round"],P_checkpoint,checkpoint_bool=True,\
+                        score_table=tables.scores,processed_match_ids=processed_match_ids,start_table=P_start)
+        if checkpoint_bool: # The matches before the checkpoint keep their ratings
+            elos_columns = ["match_id","winner_elo","loser_elo","winner_elo_surface","loser_elo_surface","winner_previous_match","loser_previous_match",\
+                            "winner_elo_before","loser_elo_before","winner_elo_surface_before","loser_elo_surface_before"]
+            elos_match_by_match = pd.concat([matches_table.loc[key_positions(keys.encode("matches",elos_match_by_match["match_id"]),matches_table["match_key"].to_numpy())==-1,elos_columns],elos_match_by_match],ignore_index=True)
         bool_exit_elo_menu = False
         while not bool_exit_elo_menu:
             print("What do you want to do?")
             print("[1] Write the two resulting tables to csv files.")
-            print("[2] Write to the files \"matches_10_15.csv\", \"matches_16_end.csv\" and \"players.xlsx\" with the new information in a subfolder.")
-            print("[3] Write to the files \"matches_10_15.csv\", \"matches_16_end.csv\" and \"players.xlsx\" with the new information in the main folder.")
-            print("[4] Exit.")
+            print("[2] Write to the files \"matches_10_15.csv\", \"matches_16_end.csv\" and \"players.parquet\" with the new information in a subfolder.")
+            print("[3] Write to the files \"matches_10_15.csv\", \"matches_16_end.csv\" and \"players.parquet\" with the new information in the main folder.")
+            print("[4] Write weekly leaderboard snapshots to \"elo_snapshots.parquet\".")
+            print("[5] Exit.")
             try:
                 elo_menu = int(input())
             except:
@@ -101,7 +120,7 @@ while not bool_exit_main_menu:
                 #                                   "winner_previous_match", "loser_previous_match"]
                 matches_table_updated = pd.merge(left = matches_table.loc[:,matches_table_columns_not_update], right = elos_match_by_match, on = "match_id", how = "left")
                 matches_table_updated = matches_table_updated.drop(["match_id"], axis=1)
-                old_columns = set(matches_table.columns).difference({"match_id"})
+                old_columns = set(matches_table.columns).difference({"match_id"}).difference(key_column_names)
                 new_columns = set(matches_table_updated.columns)
                 if len(matches_table_updated.index) != len(matches_table.index):
                     warnings.warn("The new matches table does not have the same number of rows as the old one, something probably went wrong.", UserWarning, stacklevel=2)
@@ -118,6 +137,7 @@ while not bool_exit_main_menu:
                     matches_table_updated1.to_csv("matches_10_15.csv",index=False)
                     matches_table_updated2.to_csv("matches_16_end.csv",index=False)
                     write_player_table(players_table_updated)
+                    write_elo_checkpoint(players_ratings_final,match_ids=elos_match_by_match["match_id"])
                     os.chdir(maindirectory)
                 elif elo_menu == 3:
                     print("\033[31mWarning: This will permanently change the already existing files. Only continue if you have backup of the files. Continue? [Y/N]\033[0m")
@@ -126,31 +146,42 @@ while not bool_exit_main_menu:
                         matches_table_updated1.to_csv("matches_10_15.csv",index=False)
                         matches_table_updated2.to_csv("matches_16_end.csv",index=False)
                         write_player_table(players_table_updated)
+                        write_elo_checkpoint(players_ratings_final,match_ids=elos_match_by_match["match_id"])
             elif elo_menu == 4:
+                elos_columns_new = ["winner_elo","loser_elo","winner_elo_surface","loser_elo_surface"]
+                M_elos = pd.merge(master_table.drop(columns = elos_columns_new, errors = "ignore"), elos_match_by_match.loc[:,["match_id"] + elos_columns_new], on = "match_id", how = "inner")
+                write_elo_snapshots(elo_snapshots(RatingIndex.from_matches(M_elos)))
+            elif elo_menu == 5:
                 bool_exit_elo_menu = True
                 continue
     
     elif main_menu == 2:
             
+        rating_index = read_rating_index(master_table) # the matches and ratings of every player, stored in the folder "rating_index"
         bool_exit_playerstats_menu = False
         while not bool_exit_playerstats_menu:
             print("What do you want to do?")
             print("[1] Create table of all matches a player played.")
             print("[2] Create plot of a player's Elo rating over time.")
             print("[3] Compare stats of two players in a table.")
+            print("[4] Show the Elo leaderboard on a date (from \"elo_snapshots.parquet\").")
 
             option = int(input())
             if option == 1:
                 print("Type a player name.")
                 name = input()
-                id = players_table.loc[players_table["name"] == name, "id"].item()
-                M_player = master_table.loc[(master_table["winner_id"] == id) | (master_table["loser_id"] == id), : ].copy()
+                id = name_index.resolve(name)
+                while id is None:
+                    print("There is no player named {}. Did you mean {}? Please correct your input.".format(name, ", ".join(name_index.suggestions(name)["name"])))
+                    name = input()
+                    id = name_index.resolve(name)
+                M_player = master_table.iloc[rating_index.history(id)["row"]].copy()
                 M_player["won/lost"] = "lost"
                 M_player.loc[M_player["winner_id"] == id, "won/lost"] = "won"
                 M_player["opponent"] = M_player["winner_id"]
                 M_player.loc[M_player["winner_id"] == id, "opponent"] = M_player.loc[M_player["winner_id"]==id,"loser_id"]
                 M_player = sort_matches_table(M_player)
-                M_player = M_player.drop(["winner_id","loser_id"], axis=1)
+                M_player = M_player.drop(["winner_id","loser_id"] + key_column_names, axis=1, errors="ignore")
                 M_player.to_csv("matches_" + name + ".csv", index = False)
 
             if option == 2:
@@ -183,14 +214,15 @@ while not bool_exit_main_menu:
                 elif elo_type_int == 3:
                     plot_action = "both"
 
-                elo_plot(players_dict, master_table["date"],master_table["tourney_date"],master_table["winner_id"],master_table["loser_id"],master_table["winner_elo"],master_table["loser_elo"],master_table["round"],elo_type,plot_action)
+                elo_plot(players_dict, rating_index, elo_type, plot_action)
             if option==3:
                 # https://stackoverflow.com/questions/65761938/matplotlib-table-size-and-position
                 print('Type the name of one or more players (e.g. type \"Rafael Nadal, Novak Djokovic, Roger Federer\" or simply type \"Rafael Nadal\").')
                 player_names = input()
                 S = player_stats_table(players_table,player_names,master_table["winner_id"],master_table["loser_id"],master_table["surface"],\
                                        master_table["winner_elo"],master_table["loser_elo"],master_table["winner_elo_surface"],master_table["loser_elo_surface"],\
-                                        master_table["date"],master_table["tourney_date"],master_table["round"],master_table["temp"])
+                                        master_table["date"],master_table["tourney_date"],master_table["round"],master_table["temp"],name_index,\
+                                        master_table["city"],weather_store)
                 print("What do you want to do with the table?")
                 print("[1] Print to screen.")
                 print("[2] Export to Excel.")
@@ -200,6 +232,10 @@ while not bool_exit_main_menu:
                 elif stats_option == 2:
                     #S.to_csv("stats_" + player_names + ".csv",encoding="cp1252",index=False)
                     write_stats_table(S)
+            if option == 4:
+                print("Type a date (e.g. 2015-06-01) and the Elo type (overall, hard, clay or grass), separated by \", \".")
+                date, elo_type = input().split(", ")
+                print(leaderboard(datetime.strptime(date, "%Y-%m-%d"), elo_type, rating_index = rating_index).to_string(index = False))
 
     elif main_menu == 3:
         matches_new, tournaments_new, players_new = download_from_github()
@@ -208,8 +244,8 @@ while not bool_exit_main_menu:
         else:
             print("New data found. What do you want to do with the new data?")
             print("[1] Write to the tables \"matches_new.csv\", \"tournaments_new.csv\", \"players_new.csv\".")
-            print("[2] Write to the tables \"matches_16_end.csv\", \"tournaments.xlsx\" and \"players.xlsx\" in a subfolder.")
-            print("[3] Write to the tables \"matches_16_end.csv\", \"tournaments.xlsx\" and \"players.xlsx\" in the main folder.")
+            print("[2] Write to the tables \"matches_16_end.csv\", \"tournaments.parquet\" and \"players.parquet\" in a subfolder.")
+            print("[3] Write to the tables \"matches_16_end.csv\", \"tournaments.parquet\" and \"players.parquet\" in the main folder.")
             print("[4] Exit.")
             github_update_menu = int(input())
 
@@ -224,7 +260,7 @@ while not bool_exit_main_menu:
             elif github_update_menu == 2 or github_update_menu == 3:
                 matches_16_end_before = matches_table.loc[tourney_id_to_year(matches_table["tourney_id"])>=2016,:]
                 matches_16_end_total = pd.concat([matches_16_end_before,matches_new],join="outer",ignore_index=True)
-                matches_16_end_total = matches_16_end_total.drop(["match_id"],axis=1)
+                matches_16_end_total = matches_16_end_total.drop(["match_id"] + key_column_names,axis=1,errors="ignore")
                 
                 players_total = pd.concat([players_table,players_new],join="outer",ignore_index=True)
                 tournaments_total = pd.concat([tournaments_table,tournaments_new],join="outer",ignore_index=True)
@@ -265,17 +301,24 @@ while not bool_exit_main_menu:
         #del master_table
         #master_table = create_master_table(True,True,matches_table,tournaments_table,cities_table) # Update master table in case we want to do something with it later
         
-        print("\033[31mWarning: This will permanently change the files \"tournaments.xlsx\", \"matches_10_15.csv\" and \"matches_16_end.csv\". Only continue if you have backup of the files. Continue? [Y/N]\033[0m")
+        print("\033[31mWarning: This will permanently change the files \"tournaments.parquet\", \"matches_10_15.csv\" and \"matches_16_end.csv\". Only continue if you have backup of the files. Continue? [Y/N]\033[0m")
         continue_bool = input()
         if continue_bool == "Y":
             os.chdir(maindirectory)
-            M1 = matches_table.loc[tourney_id_to_year(matches_table["tourney_id"])<2016,:]
-            M2 = matches_table.loc[tourney_id_to_year(matches_table["tourney_id"])>=2016,:]
+            M1 = matches_table.loc[tourney_id_to_year(matches_table["tourney_id"])<2016,:].drop(columns=key_column_names,errors="ignore")
+            M2 = matches_table.loc[tourney_id_to_year(matches_table["tourney_id"])>=2016,:].drop(columns=key_column_names,errors="ignore")
             M1.to_csv("matches_10_15.csv",index=False)
             M2.to_csv("matches_16_end.csv",index=False)
             write_tournaments_table(tournaments_table)
         
     
     elif main_menu == 5:
+        excel_export_thread = export_excel()
+        print("Writing \"players.xlsx\" and \"tournaments.xlsx\" in the background.")
+
+    elif main_menu == 6:
+        if excel_export_thread is not None and excel_export_thread.is_alive():
+            print("Waiting for the Excel export to finish.")
+            excel_export_thread.join()
         bool_exit_main_menu = True
         continue
\ No newline at end of file
@@ -0,0 +1,49 @@
+print("Importing modules, this will take just a couple of seconds.")
+
+import argparse
+import os
+import sys
+import pandas as pd
+from tennis_functions import *
+
+# Updates the ratings match by match while the results come in, one JSON object per line, e.g.
+#   {"match_id": "...", "winner_id": "rafael nadal-es-86", "loser_id": "novak djokovic-se-87", "score": "6-4 6-4", "surface": "Clay", "tourney_level": "ATP 1000", "date": "2024-05-12 15:00:00"}
+# The results are read from stdin (e.g. python tennis_online.py < results.jsonl) or from a file that is followed like with tail -f (--follow results.jsonl).
+# Every match is appended to elo_log.csv and the ratings are written to elo_snapshot.csv regularly, so the program can be stopped or crash at any time
+# and continues where it stopped when it is started again.
+
+if __name__ == "__main__":
+
+    # Change working directory directory where the file is located
+    abspath = os.path.abspath(__file__)
+    maindirectory = os.path.dirname(abspath)
+    os.chdir(maindirectory)
+
+    parser = argparse.ArgumentParser(description = "Applies match results to the Elo ratings as they come in.")
+    parser.add_argument("--follow", default = None, help = "JSONL file to follow instead of reading stdin")
+    parser.add_argument("--log", default = "elo_log.csv")
+    parser.add_argument("--snapshot", default = "elo_snapshot.csv")
+    parser.add_argument("--snapshot-every", type = int, default = 100, help = "number of matches between two snapshots")
+    arguments = parser.parse_args()
+
+    # Start from the ratings of the last full run (only used if there is no snapshot yet)
+    if os.path.isfile("elo_checkpoint.csv"):
+        P_start = read_elo_checkpoint()
+    else:
+        P_start_dtypes = {"id": "str", "elo_overall": "float", "match_number": "int"}
+        P_start = pd.read_csv("elo_ratings_yearend_2009.csv", dtype = P_start_dtypes)
+
+    online_elo = OnlineElo(P_start, arguments.log, arguments.snapshot, arguments.snapshot_every)
+    print("Ready, {} matches in the log so far.".format(online_elo.log_rows))
+    matches = follow_match_file(arguments.follow) if arguments.follow is not None else read_match_stream(sys.stdin)
+    try:
+        for match in matches:
+            row = online_elo.update(match)
+            if row is None:
+                print("Skipped match {} (already processed or invalid surface/date).".format(match.get("match_id", "")))
+            else:
+                print("{}: {} {:.1f}, {} {:.1f}".format(row["match_id"], match["winner_id"], row["winner_elo"], match["loser_id"], row["loser_elo"]))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        online_elo.close()
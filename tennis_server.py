@@ -0,0 +1,123 @@
+print("Importing modules, this will take just a couple of seconds.")
+
+import asyncio
+import argparse
+import json
+import os
+from urllib.parse import urlsplit, parse_qs
+from tennis_functions import *
+
+# A resident server that reads the tables once and then answers queries over HTTP with JSON, e.g.
+#   GET /elo?player=Rafael Nadal
+#   GET /winprob?player1=Rafael Nadal&player2=Novak Djokovic&surface=Clay&best_of=5&tourney_level=Grand Slam
+#   GET /history?player=Rafael Nadal&limit=10
+# Players can be given by id, name or alternative name (not case sensitive).
+
+def load_server_state(history_bool: bool = True) -> dict:
+    """Reads everything the server needs: the current ratings (from the players table, updated by elo_checkpoint.csv if it exists) and the master table for the history of the players
+    """
+    checkpoint_table = read_elo_checkpoint() if os.path.isfile("elo_checkpoint.csv") else None
+    state = {"ratings": current_ratings_table(tables.players, checkpoint_table), "lookup": player_lookup_table(tables.players)}
+    if history_bool:
+        master_table = create_master_table()
+        state["master_table"] = master_table
+        state["match_rows"] = player_match_rows(master_table["winner_id"], master_table["loser_id"], master_table["date"])
+    return state
+
+def find_player(state: dict, player: str) -> str:
+    player_id = state["lookup"].get(player.lower()) if player is not None else None
+    if player_id is None or player_id not in state["ratings"].index:
+        raise LookupError("There is no player \"{}\".".format(player))
+    return player_id
+
+def handle_request(state: dict, method: str, target: str):
+    """Answers one request, returns the HTTP status code and the JSON body as dict
+    """
+    if method != "GET":
+        return 405, {"error": "Only GET requests are supported."}
+    url = urlsplit(target)
+    query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+    try:
+        if url.path == "/elo":
+            return 200, player_elo(state["ratings"], find_player(state, query.get("player")))
+        elif url.path == "/winprob":
+            player1_id = find_player(state, query.get("player1"))
+            player2_id = find_player(state, query.get("player2"))
+            surface = query.get("surface", "Hard")
+            best_of = int(query.get("best_of", 3))
+            if surface not in surface_elo_columns or best_of not in [3, 5]:
+                return 400, {"error": "surface has to be one of {} and best_of 3 or 5.".format(list(surface_elo_columns))}
+            winprobability = matchup_winprobability(state["ratings"], player1_id, player2_id, surface, best_of, query.get("tourney_level", "ATP 250"))
+            return 200, {"player1": player1_id, "player2": player2_id, "surface": surface, "best_of": best_of, "player1_winprob": winprobability}
+        elif url.path == "/history":
+            if "master_table" not in state:
+                return 404, {"error": "The server was started without the history of the matches."}
+            player_id = find_player(state, query.get("player"))
+            H = player_history(state["master_table"], state["match_rows"], player_id, int(query.get("limit", 20)))
+            return 200, {"player": player_id, "matches": json.loads(H.to_json(orient = "records", date_format = "iso"))}
+        else:
+            return 404, {"error": "Unknown path \"{}\", use /elo, /winprob or /history.".format(url.path)}
+    except LookupError as error:
+        return 404, {"error": str(error)}
+    except ValueError as error:
+        return 400, {"error": str(error)}
+
+status_texts = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, state: dict):
+    """Reads requests from one client until it closes the connection (keep-alive), every query is answered from memory so there is nothing to wait for except the network
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if line == "":
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            status, payload = handle_request(state, method, target)
+            body = json.dumps(payload).encode("utf-8")
+            keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+            writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(\
+                status, status_texts[status], len(body), "keep-alive" if keep_alive else "close").encode("latin-1") + body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(state: dict, host: str = "127.0.0.1", port: int = 8080, socket_path: str = None):
+    handler = lambda reader, writer: handle_connection(reader, writer, state)
+    if socket_path is not None:
+        server = await asyncio.start_unix_server(handler, path = socket_path)
+    else:
+        server = await asyncio.start_server(handler, host, port)
+    print("Serving on {}.".format(socket_path if socket_path is not None else "http://{}:{}".format(host, port)))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+
+    # Change working directory directory where the file is located
+    abspath = os.path.abspath(__file__)
+    maindirectory = os.path.dirname(abspath)
+    os.chdir(maindirectory)
+
+    parser = argparse.ArgumentParser(description = "Answers queries for Elos, win probabilities and match histories over HTTP.")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--socket", default = None, help = "path of a Unix socket to listen on instead of host and port")
+    parser.add_argument("--no-history", action = "store_true", help = "don't read the matches (faster start, but no /history)")
+    arguments = parser.parse_args()
+
+    print("Reading all the datasets, this will take just a couple of seconds.")
+    state = load_server_state(not arguments.no_history)
+    asyncio.run(serve(state, arguments.host, arguments.port, arguments.socket))
@@ -0,0 +1,39 @@
+print("Importing modules, this will take just a couple of seconds.")
+
+from datetime import datetime
+import pandas as pd
+import os
+from tennis_functions import *
+
+# The values that are tested for the parameters of update_elo (around the default values).
+# Every combination means one pass over all matches, so either keep the lists short or only test a random selection of combinations.
+parameter_grid = {"c": [200, 225, 250, 275, 300], "c_hard": [250, 280, 310], "c_clay": [270, 300, 330], "c_grass": [300, 350, 400], \
+                  "o": [10, 20, 30], "s1": [0.5, 0.55, 0.6, 0.65, 0.7], "recentdays_range": [60, 75, 90], "penaltyfactor": [0.97, 0.98, 0.99]}
+
+if __name__ == "__main__": # The worker processes import this file too (at least on Windows), they must not run the following
+
+    # Change working directory directory where the file is located
+    abspath = os.path.abspath(__file__)
+    maindirectory = os.path.dirname(abspath)
+    os.chdir(maindirectory)
+
+    print("Reading all the datasets, this will take just a couple of seconds.")
+    master_table = create_master_table()
+    P_start_dtypes = {"id": "str", "elo_overall": "float", "match_number": "int"}
+    P_start = pd.read_csv("elo_ratings_yearend_2009.csv", dtype = P_start_dtypes)
+
+    combinations_number = len(elo_parameter_combinations(parameter_grid))
+    print("There are {} combinations of parameters. How many random combinations do you want to test? (Press Enter to test all of them.)".format(combinations_number))
+    answer = input()
+    random_combinations = None
+    if answer != "":
+        random_combinations = int(answer)
+
+    R = tune_elo_parameters(master_table["match_id"],master_table["winner_id"],master_table["loser_id"],master_table["score"],master_table["tourney_date"],\
+                            master_table["date"],master_table["surface"],master_table["tourney_level"],master_table["round"],master_table["best_of"],\
+                            P_start,parameter_grid,random_combinations,score_table=tables.scores)
+    print("The best combinations are:")
+    print(R.head(20))
+    filename = "elo_tuning_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".csv"
+    R.to_csv(filename, index = False)
+    print("All the results have been written to \"{}\".".format(filename))
@@ -0,0 +1,54 @@
+print("Importing modules, this will take just a couple of seconds.")
+
+import argparse
+import os
+import pandas as pd
+from tennis_functions import *
+
+# Estimates the temperature, humidity and wind speed of all matches from the weather stations in cities.csv (columns URL, URL2, URL3, relevant_for_weather).
+# The readings of the stations are taken from the csv files in the folder weather_stations (one file per station, e.g. weather_stations/Abuja_(airport).csv),
+# so everything runs offline. The stations are read once into the binary store in the folder weather_store, which is only built again if the station files change.
+# Missing stations can be downloaded first with --sources, a csv file with the columns URL (rp5.ru) and googledrive_url.
+
+if __name__ == "__main__":
+
+    # Change working directory directory where the file is located
+    abspath = os.path.abspath(__file__)
+    maindirectory = os.path.dirname(abspath)
+    os.chdir(maindirectory)
+
+    parser = argparse.ArgumentParser(description = "Writes the weather of the stations to the matches.")
+    parser.add_argument("--folder", default = "weather_stations", help = "folder with the csv files of the stations")
+    parser.add_argument("--sources", default = None, help = "csv file with the columns URL and googledrive_url of the stations to download into the folder")
+    parser.add_argument("--processes", type = int, default = None, help = "number of worker processes, 1 means no worker processes")
+    parser.add_argument("--write", action = "store_true", help = "write the weather to matches_10_15.csv and matches_16_end.csv in a subfolder named after the current time")
+    parser.add_argument("--main_folder", action = "store_true", help = "with --write, overwrite matches_10_15.csv and matches_16_end.csv in the main folder (asks for confirmation)")
+    arguments = parser.parse_args()
+
+    if arguments.sources is not None:
+        sources = pd.read_csv(arguments.sources, dtype = "str")
+        downloaded = cache_weather_stations(dict(zip(sources["URL"], sources["googledrive_url"])), arguments.folder)
+        print("Downloaded {} stations.".format(len(downloaded)))
+
+    print("Reading all the datasets, this will take just a couple of seconds.")
+    master_table = create_master_table()
+    weather_store = read_weather_store(tables.cities, arguments.folder, processes = arguments.processes)
+    W = weather_for_matches(master_table, tables.cities, weather_store = weather_store)
+    print("Found the weather of {} of {} matches.".format(len(W.index), len(master_table.index)))
+
+    if arguments.write:
+        matches_table = update_match_weather(tables.matches, W)
+        years = tourney_id_to_year(matches_table["tourney_id"])
+        matches_table = matches_table.drop(["match_id"] + key_column_names, axis=1, errors="ignore")
+        if arguments.main_folder:
+            print("\033[31mWarning: This will permanently change the files \"matches_10_15.csv\" and \"matches_16_end.csv\". Only continue if you have backup of the files. Continue? [Y/N]\033[0m")
+            continue_bool = input()
+            if continue_bool != "Y":
+                raise SystemExit
+        else:
+            subfoldername = datetime.now().strftime("%Y%m%d_%H%M%S")
+            os.makedirs(subfoldername, exist_ok = True)
+            os.chdir(subfoldername)
+        matches_table.loc[years<2016].to_csv("matches_10_15.csv",index=False)
+        matches_table.loc[years>=2016].to_csv("matches_16_end.csv",index=False)
+        print("Written to the folder \"{}\".".format(os.getcwd()))
@@ -1,11 +1,26 @@
 import unittest
+import unittest.mock
 from tennis_functions import *
+import tennis_functions
 import numpy as np
 import pandas as pd
 import warnings
+import os
+import tempfile
+import hashlib
+import json
 
 warnings.filterwarnings("ignore", message="The default value of regex will change from True to False in a future version.")
 
+def setUpModule():
+    # The tests must never add keys to the folder "keys" of the real data
+    global keys_folder
+    keys_folder = tempfile.TemporaryDirectory()
+    tennis_functions.keys = KeyMap(keys_folder.name)
+
+def tearDownModule():
+    keys_folder.cleanup()
+
 big3_ids = ["rafael nadal-90","roger federer-sw-85","novak djokovic"]
 big3_birthdays = [datetime(1990,5,25),datetime(1985,1,1), np.nan]
 big3_elos = [2000,2100,1950]
@@ -136,6 +151,311 @@ class TestUpdateElo(unittest.TestCase):
         self.assertAlmostEqual(fed_elo_new_return,fed_elo_new_exp)
 
 
+class TestUpdateEloFast(unittest.TestCase):
+
+    def test_update_elo_fast_identical(self):
+        # 3 players, 150 matches with a break of 4 months, so that the activity factor and the penalty are used
+        n = 150
+        winner_ids = [big3_ids[i % 3] for i in range(n)]
+        loser_ids = [big3_ids[(i+1) % 3] for i in range(n)]
+        dates = [datetime(2010,1,1,12,0) + timedelta(days=3*i + 120*(i>=100)) for i in range(n)]
+        surfaces = ["Hard","Clay","Grass","Carpet","Hard"]*(n//5)
+        levels = ["ATP 250","Exhibition","Grand Slam"]*(n//3)
+        scores = ["6-4 3-6 6-4","7-6(5) 6-7(3) 6-4","6-4 6-4","6-4 3-6 1-6 7-6(5) 7-5","6-1 1-6 2-0 RET"]*(n//5)
+        M = pd.DataFrame({"winner_id": winner_ids, "loser_id": loser_ids, "score": scores, "surface": surfaces, "tourney_level": levels, \
+                          "tourney_id": ["id"+str(i) for i in range(n)], "date": dates, "round": "F"})
+        M["match_id"] = match_id(M.tourney_id,M.winner_id,M.loser_id,M.score)
+        args = (M.match_id,M.winner_id,M.loser_id,M.score,M.date,M.date,M.surface,M.tourney_level,M["round"])
+        N_loop, P_loop = update_elo(*args,big3_df.loc[:,["id","elo_overall","match_number"]].copy())
+        N_fast, P_fast = update_elo(*args,big3_df.loc[:,["id","elo_overall","match_number"]].copy(),fast_bool=True)
+        pd.testing.assert_frame_equal(N_fast,N_loop)
+        pd.testing.assert_frame_equal(P_fast,P_loop)
+        # The players table of a run is passed on to the next one in memory
+        N_first, P_first = update_elo(*[column.iloc[:100] for column in args],big3_df.loc[:,["id","elo_overall","match_number"]].copy(),fast_bool=True)
+        N_second, P_second = update_elo(*[column.iloc[100:] for column in args],P_first,fast_bool=True)
+        np.testing.assert_array_equal(N_second.winner_elo.astype(float),N_fast.winner_elo[100:].astype(float))
+        np.testing.assert_array_equal(P_second.elo_overall.astype(float),P_fast.elo_overall.astype(float))
+
+    def test_elo_before_from_previous_match(self):
+        winner_ids = ["novak djokovic","rafael nadal-90","novak djokovic","rafael nadal-90"]
+        loser_ids = ["roger federer-sw-85","roger federer-sw-85","rafael nadal-90","novak djokovic"]
+        dates = [datetime(2010,1,1,20,0),datetime(2010,1,10,18,0),datetime(2010,2,1,12,0),datetime(2010,2,2,12,0)]
+        M = pd.DataFrame({"winner_id": winner_ids, "loser_id": loser_ids, "score": "6-4 6-4", "surface": "Hard", "tourney_level": "ATP 250", \
+                          "tourney_id": ["id1","id2","id3","id4"], "date": dates, "round": "F"})
+        M["match_id"] = match_id(M.tourney_id,M.winner_id,M.loser_id,M.score)
+        N, P = update_elo(M.match_id,M.winner_id,M.loser_id,M.score,M.date,M.date,M.surface,M.tourney_level,M["round"],big3_df.loc[:,["id","elo_overall","match_number"]].copy(),fast_bool=True)
+        self.assertTrue(N.loc[:1,"winner_elo_before"].isna().all()) # first matches of djokovic and nadal
+        self.assertEqual(N.at[2,"winner_elo_before"],N.at[0,"winner_elo"])
+        self.assertEqual(N.at[2,"loser_elo_surface_before"],N.at[1,"winner_elo_surface"])
+        self.assertEqual(N.at[3,"loser_elo_before"],N.at[2,"winner_elo"])
+
+
+class TestUpdateEloBatch(unittest.TestCase):
+
+    def test_update_elo_batch_same_as_single_runs(self):
+        n = 150
+        winner_ids = [big3_ids[i % 3] for i in range(n)]
+        loser_ids = [big3_ids[(i+1) % 3] for i in range(n)]
+        dates = [datetime(2010,1,1,12,0) + timedelta(days=3*i + 120*(i>=100)) for i in range(n)]
+        surfaces = ["Hard","Clay","Grass","Carpet","Hard"]*(n//5)
+        scores = ["6-4 3-6 6-4","7-6(5) 6-7(3) 6-4","6-4 6-4","6-4 3-6 1-6 7-6(5) 7-5","6-1 1-6 2-0 RET"]*(n//5)
+        M = pd.DataFrame({"winner_id": winner_ids, "loser_id": loser_ids, "score": scores, "surface": surfaces, "tourney_level": "Exhibition", \
+                          "tourney_id": ["id"+str(i) for i in range(n)], "date": dates, "round": "F"})
+        M["match_id"] = match_id(M.tourney_id,M.winner_id,M.loser_id,M.score)
+        args = (M.match_id,M.winner_id,M.loser_id,M.score,M.date,M.date,M.surface,M.tourney_level,M["round"])
+        parameter_sets = pd.DataFrame({"c": [250,200,300], "o": [20,10,30], "recentdays_range": [75,30,150], "penaltyfactor": [0.98,0.9,0.99]})
+        M_batch, N_ratings, P_batch, P_ratings = update_elo_batch(*args,big3_df.loc[:,["id","elo_overall","match_number"]].copy(),parameter_sets)
+        for k, parameters in parameter_sets.iterrows():
+            N, P = update_elo(*args,big3_df.loc[:,["id","elo_overall","match_number"]].copy(),fast_bool=True,**parameters.to_dict())
+            np.testing.assert_allclose(N_ratings[:,:,k],N[["winner_elo","loser_elo","winner_elo_surface","loser_elo_surface"]].astype(float))
+            np.testing.assert_allclose(sorted(P_ratings[:,0,k]),sorted(P.elo_overall.astype(float)))
+
+
+class TestEloCheckpoint(unittest.TestCase):
+
+    def test_checkpoint_same_as_full_run(self):
+        n = 150
+        winner_ids = [big3_ids[i % 3] for i in range(n)]
+        loser_ids = [big3_ids[(i+2) % 3] for i in range(n)]
+        dates = [datetime(2010,1,1,12,0) + timedelta(days=2*i + 100*(i>=90)) for i in range(n)]
+        surfaces = ["Hard","Clay","Grass"]*(n//3)
+        scores = ["6-4 3-6 6-4","6-4 6-4","6-4 3-6 1-6 7-6(5) 7-5","7-6(5) 6-7(3) 6-4","W/O"]*(n//5)
+        M = pd.DataFrame({"winner_id": winner_ids, "loser_id": loser_ids, "score": scores, "surface": surfaces, "tourney_level": "ATP 250", \
+                          "tourney_id": ["id"+str(i) for i in range(n)], "date": dates, "round": "F"})
+        M["match_id"] = match_id(M.tourney_id,M.winner_id,M.loser_id,M.score)
+        def args(M):
+            return (M.match_id,M.winner_id,M.loser_id,M.score,M.date,M.date,M.surface,M.tourney_level,M["round"])
+        P_start = big3_df.loc[:,["id","elo_overall","match_number"]]
+        N_full, P_full = update_elo(*args(M),P_start.copy(),checkpoint_bool=True)
+        N_first, P_first = update_elo(*args(M.iloc[:100]),P_start.copy(),checkpoint_bool=True)
+        write_elo_checkpoint(P_first,"elo_checkpoint_test.csv")
+        N_second, P_second = update_elo(*args(M),read_elo_checkpoint("elo_checkpoint_test.csv"),checkpoint_bool=True)
+        os.remove("elo_checkpoint_test.csv")
+        self.assertEqual(len(N_second.index),50)
+        np.testing.assert_array_equal(N_second.winner_elo.astype(float),N_full.winner_elo[100:].astype(float))
+        np.testing.assert_array_equal(P_second.elo_overall.astype(float),P_full.elo_overall.astype(float))
+        self.assertEqual(list(P_second.recent_dates),list(P_full.recent_dates))
+
+    def test_checkpoint_within_tournament(self):
+        # Matches without a date all have the date of their tournament, the checkpoint is written in the middle of a tournament
+        n = 150
+        winner_ids = [big3_ids[i % 3] for i in range(n)]
+        loser_ids = [big3_ids[(i+2) % 3] for i in range(n)]
+        tourney_dates = [datetime(2010,1,4) + timedelta(days=7*(i//5)) for i in range(n)]
+        scores = ["6-4 3-6 6-4","6-4 6-4","7-6(5) 6-7(3) 6-4","6-3 6-3","6-1 6-2"]*(n//5) # unique match ids within a tournament
+        M = pd.DataFrame({"winner_id": winner_ids, "loser_id": loser_ids, "score": scores, "surface": "Hard", "tourney_level": "ATP 250", \
+                          "tourney_id": ["id"+str(i//5) for i in range(n)], "tourney_date": tourney_dates, "date": pd.NaT, "round": ["R32","R16","QF","SF","F"]*(n//5)})
+        M["match_id"] = match_id(M.tourney_id,M.winner_id,M.loser_id,M.score)
+        def args(M):
+            return (M.match_id,M.winner_id,M.loser_id,M.score,M.tourney_date,M.date,M.surface,M.tourney_level,M["round"])
+        P_start = big3_df.loc[:,["id","elo_overall","match_number"]]
+        N_full, P_full = update_elo(*args(M),P_start.copy(),checkpoint_bool=True)
+        N_first, P_first = update_elo(*args(M.iloc[:102]),P_start.copy(),checkpoint_bool=True)
+        N_second, P_second = update_elo(*args(M.iloc[:104]),P_first,checkpoint_bool=True) # the checkpoint in memory
+        self.assertEqual(list(N_second.match_id),list(M.match_id[102:104]))
+        with tempfile.TemporaryDirectory() as folder:
+            write_elo_checkpoint(P_second,os.path.join(folder,"checkpoint.csv"))
+            N_third, P_third = update_elo(*args(M),read_elo_checkpoint(os.path.join(folder,"checkpoint.csv")),checkpoint_bool=True)
+        self.assertEqual(len(N_third.index),46)
+        np.testing.assert_array_equal(N_third.winner_elo.astype(float),N_full.winner_elo[104:].astype(float))
+        np.testing.assert_array_equal(P_third.elo_overall.astype(float),P_full.elo_overall.astype(float))
+
+    def test_match_before_checkpoint(self):
+        # Matches added after the checkpoint was written, but dated before its last match (e.g. matches from GitHub with only the date of the tournament)
+        n = 150
+        winner_ids = [big3_ids[i % 3] for i in range(n)]
+        loser_ids = [big3_ids[(i+2) % 3] for i in range(n)]
+        dates = [datetime(2010,1,1,12,0) + timedelta(days=2*i) for i in range(n)]
+        scores = ["6-4 3-6 6-4","6-4 6-4","6-4 3-6 1-6 7-6(5) 7-5","7-6(5) 6-7(3) 6-4","W/O"]*(n//5)
+        M = pd.DataFrame({"winner_id": winner_ids, "loser_id": loser_ids, "score": scores, "surface": "Hard", "tourney_level": "ATP 250", \
+                          "tourney_id": ["id"+str(i) for i in range(n)], "date": dates, "round": "F"})
+        M["match_id"] = match_id(M.tourney_id,M.winner_id,M.loser_id,M.score)
+        def args(M):
+            return (M.match_id,M.winner_id,M.loser_id,M.score,M.date,M.date,M.surface,M.tourney_level,M["round"])
+        P_start = big3_df.loc[:,["id","elo_overall","match_number"]]
+        N_full, P_full = update_elo(*args(M),P_start.copy(),checkpoint_bool=True)
+        M_old = M.drop([60,61,62])
+        N_first, P_first = update_elo(*args(M_old),P_start.copy(),checkpoint_bool=True)
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder,"checkpoint.csv")
+            write_elo_checkpoint(P_first,filename,match_ids = N_first["match_id"])
+            P_checkpoint, processed_match_ids = read_elo_checkpoint(filename), read_checkpoint_match_ids(filename)
+        self.assertEqual(len(processed_match_ids),n-3)
+        with self.assertRaises(ValueError):
+            update_elo(*args(M),P_checkpoint,checkpoint_bool=True,processed_match_ids=processed_match_ids)
+        with self.assertWarns(UserWarning):
+            N_second, P_second = update_elo(*args(M),P_checkpoint,checkpoint_bool=True,processed_match_ids=processed_match_ids,start_table=P_start.copy())
+        self.assertEqual(len(N_second.index),n)
+        np.testing.assert_array_equal(P_second.elo_overall.astype(float),P_full.elo_overall.astype(float))
+        N_third, P_third = update_elo(*args(M),P_second,checkpoint_bool=True,processed_match_ids=N_second["match_id"],start_table=P_start.copy())
+        self.assertEqual(len(N_third.index),0) # nothing new after the calculation from scratch
+
+
+class TestOnlineElo(unittest.TestCase):
+
+    def test_online_same_as_checkpoint_run(self):
+        n = 150
+        winner_ids = [big3_ids[i % 3] for i in range(n)]
+        loser_ids = [big3_ids[(i+2) % 3] for i in range(n)]
+        dates = [datetime(2010,1,1,12,0) + timedelta(days=2*i + 100*(i>=90)) for i in range(n)]
+        surfaces = ["Hard","Clay","Grass"]*(n//3)
+        scores = ["6-4 3-6 6-4","6-4 6-4","6-4 3-6 1-6 7-6(5) 7-5","7-6(5) 6-7(3) 6-4","W/O"]*(n//5)
+        M = pd.DataFrame({"winner_id": winner_ids, "loser_id": loser_ids, "score": scores, "surface": surfaces, "tourney_level": "ATP 250", \
+                          "tourney_id": ["id"+str(i) for i in range(n)], "date": dates, "round": "F"})
+        M["match_id"] = match_id(M.tourney_id,M.winner_id,M.loser_id,M.score)
+        P_start = big3_df.loc[:,["id","elo_overall","match_number"]]
+        N_full, P_full = update_elo(M.match_id,M.winner_id,M.loser_id,M.score,M.date,M.date,M.surface,M.tourney_level,M["round"],P_start.copy(),checkpoint_bool=True)
+        matches = M.loc[:,["match_id","winner_id","loser_id","score","surface","tourney_level","date"]].to_dict("records")
+        with tempfile.TemporaryDirectory() as folder:
+            log_filename, snapshot_filename = os.path.join(folder,"log.csv"), os.path.join(folder,"snapshot.csv")
+            online_elo = OnlineElo(P_start,log_filename,snapshot_filename,snapshot_every=40)
+            for match in matches[:100]:
+                online_elo.update(match)
+            online_elo.log.close() # stop without a final snapshot, like after a crash
+            online_elo = OnlineElo(P_start,log_filename,snapshot_filename,snapshot_every=40)
+            self.assertEqual(online_elo.run(matches[90:]),50) # the first 10 matches are already in the log
+            online_elo.close()
+            L = pd.read_csv(log_filename,float_precision="round_trip")
+            P_online = read_elo_checkpoint(snapshot_filename)
+        np.testing.assert_array_equal(L.winner_elo,N_full.winner_elo.astype(float))
+        np.testing.assert_array_equal(L.loser_elo_surface,N_full.loser_elo_surface.astype(float))
+        np.testing.assert_array_equal(P_online.elo_overall,P_full.elo_overall.astype(float))
+        self.assertEqual(list(P_online.recent_dates),list(P_full.recent_dates))
+
+
+class TestReadCachedTable(unittest.TestCase):
+
+    def test_cache_rebuilt_when_file_changes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "table.csv")
+            pd.DataFrame({"id": ["a","b"], "value": [1.5,2.5]}).to_csv(filename,index=False)
+            calls = []
+            def reader():
+                calls.append(1)
+                return pd.read_csv(filename)
+            T1 = read_cached_table("table",[filename],reader,os.path.join(folder,"cache"))
+            T2 = read_cached_table("table",[filename],reader,os.path.join(folder,"cache"))
+            os.utime(filename) # only the modification time changes
+            T3 = read_cached_table("table",[filename],reader,os.path.join(folder,"cache"))
+            pd.DataFrame({"id": ["a","b","c"], "value": [1.5,2.5,3.5]}).to_csv(filename,index=False)
+            T4 = read_cached_table("table",[filename],reader,os.path.join(folder,"cache"))
+        pd.testing.assert_frame_equal(T1,T2)
+        pd.testing.assert_frame_equal(T1,T3)
+        self.assertEqual(len(T4.index),3)
+        self.assertEqual(len(calls),2)
+
+    def test_cache_rebuilt_when_reader_changes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "table.csv")
+            pd.DataFrame({"id": ["a","b"], "value": [1.5,2.5]}).to_csv(filename,index=False)
+            T1 = read_cached_table("table",[filename],lambda: pd.read_csv(filename),os.path.join(folder,"cache"),version = "1")
+            T2 = read_cached_table("table",[filename],lambda: pd.read_csv(filename,dtype = {"value": "str"}),os.path.join(folder,"cache"),version = "1")
+            T3 = read_cached_table("table",[filename],lambda: pd.read_csv(filename,dtype = {"value": "str"}),os.path.join(folder,"cache"),version = "2")
+        self.assertEqual(T2["value"].dtype,np.float64) # same version, the cache is used
+        self.assertEqual(list(T3["value"]),["1.5","2.5"])
+        self.assertNotEqual(reader_version(read_matches, matches_dtypes),reader_version(read_matches, dict(matches_dtypes, score = "category")))
+
+
+class TestKeyMap(unittest.TestCase):
+
+    def test_keys_stable_after_reload(self):
+        with tempfile.TemporaryDirectory() as folder:
+            key_map = KeyMap(folder)
+            keys_first = key_map.add("players",big3_ids)
+            keys_second = key_map.encode("players",["new player",big3_ids[1],np.nan,""],add_bool=True)
+            keys_reloaded = KeyMap(folder).encode("players",["new player"] + big3_ids)
+            ids_decoded = KeyMap(folder).decode("players",keys_second)
+        np.testing.assert_array_equal(keys_first,[0,1,2])
+        np.testing.assert_array_equal(keys_second,[3,1,-1,-1])
+        np.testing.assert_array_equal(keys_reloaded,[3,0,1,2])
+        self.assertEqual(list(ids_decoded[:2]),["new player",big3_ids[1]])
+        self.assertTrue(pd.isna(ids_decoded[2]))
+
+    def test_encode_is_lookup(self):
+        with tempfile.TemporaryDirectory() as folder:
+            keys_unknown = KeyMap(folder).encode("players",big3_ids)
+            folder_content = os.listdir(folder)
+        np.testing.assert_array_equal(keys_unknown,[-1,-1,-1])
+        self.assertEqual(folder_content,[])
+
+    def test_two_key_maps_same_folder(self):
+        with tempfile.TemporaryDirectory() as folder:
+            key_map1 = KeyMap(folder)
+            key_map2 = KeyMap(folder)
+            key_map1.add("players",big3_ids[:2])
+            key_map2.encode("players",big3_ids) # key_map2 has loaded the keys before key_map1 adds more
+            key_map2.add("players",big3_ids)
+            key_map1.add("players",["new player",big3_ids[2]])
+            ids_saved = pd.read_csv(os.path.join(folder,"players.csv"),dtype="str")["id"]
+            keys_reloaded = KeyMap(folder).encode("players",big3_ids + ["new player"])
+        self.assertFalse(ids_saved.duplicated().any())
+        np.testing.assert_array_equal(keys_reloaded,[0,1,2,3])
+
+    def test_add_keys(self):
+        with tempfile.TemporaryDirectory() as folder:
+            key_map = KeyMap(folder)
+            M = pd.DataFrame({"match_id": ["m1","m2"], "tourney_id": "t1", "winner_id": [big3_ids[0],big3_ids[1]], "loser_id": [big3_ids[2],big3_ids[0]], \
+                "winner_previous_match": [np.nan,"m1"], "loser_previous_match": np.nan})
+            M_keys = add_keys("matches",M,key_map=key_map)
+            P_keys = add_keys("players",big3_df,key_map=key_map)
+            self.assertIs(add_keys("players",P_keys,key_map=key_map),P_keys) # already has its keys
+            self.assertEqual(list(M_keys["match_key"]),[0,1])
+            self.assertEqual(list(M_keys["winner_previous_key"]),[-1,0])
+            self.assertEqual(list(M_keys["loser_key"]),[2,0])
+            self.assertEqual(M_keys["winner_key"].dtype,np.int32)
+            self.assertEqual(list(P_keys["player_key"]),[0,1,2]) # the players of the matches already had their keys
+            self.assertEqual(len(KeyMap(folder).ids("tournaments")),1)
+            new_codes = key_map.codes("players",[big3_ids[0],"nobody"],["nobody",np.nan])
+        np.testing.assert_array_equal(new_codes[0],[0,3])
+        np.testing.assert_array_equal(new_codes[1],[3,-1])
+
+
+class TestEloParameterCombinations(unittest.TestCase):
+
+    def test_all_combinations(self):
+        combinations = elo_parameter_combinations({"c": [200,250], "o": [10,20,30]})
+        self.assertEqual(len(combinations),6)
+        self.assertEqual(combinations[0],{"c": 200, "o": 10})
+        self.assertEqual(combinations[-1],{"c": 250, "o": 30})
+
+    def test_random_combinations(self):
+        combinations = elo_parameter_combinations({"c": [200,250], "o": [10,20,30]},4,seed=0)
+        self.assertEqual(len(combinations),4)
+        self.assertEqual(len({tuple(combination.values()) for combination in combinations}),4) # no combination twice
+
+
+class TestTuneEloParameters(unittest.TestCase):
+
+    def test_pooled_and_batched_same_as_update_elo(self):
+        n = 150
+        winner_ids = [big3_ids[i % 3] for i in range(n)]
+        loser_ids = [big3_ids[(i+1) % 3] for i in range(n)]
+        dates = [datetime(2010,1,1,12,0) + timedelta(days=3*i + 120*(i>=100)) for i in range(n)]
+        scores = ["6-4 3-6 6-4","7-6(5) 6-7(3) 6-4","6-4 6-4","6-4 3-6 1-6 7-6(5) 7-5","6-1 1-6 2-0 RET"]*(n//5)
+        M = pd.DataFrame({"winner_id": winner_ids, "loser_id": loser_ids, "score": scores, "surface": ["Hard","Clay","Grass"]*(n//3), "tourney_level": ["ATP 250","Grand Slam"]*(n//2), \
+                          "tourney_id": ["id"+str(i) for i in range(n)], "date": dates, "round": "F", "best_of": [3,5]*(n//2)})
+        M["match_id"] = match_id(M.tourney_id,M.winner_id,M.loser_id,M.score)
+        args = (M.match_id,M.winner_id,M.loser_id,M.score,M.date,M.date,M.surface,M.tourney_level,M["round"])
+        P_start = big3_df.loc[:,["id","elo_overall","match_number"]]
+        grid = {"c": [200,250], "o": [10,20]}
+        evaluation_startdate = datetime(2010,3,1)
+        R_pooled = tune_elo_parameters(*args,M.best_of,P_start,grid,evaluation_startdate=evaluation_startdate,processes=2,batch_size=1)
+        R_batched = tune_elo_parameters(*args,M.best_of,P_start,grid,evaluation_startdate=evaluation_startdate,processes=2,batch_size=4)
+
+        # The same scores from the ratings before each match of update_elo
+        N, P = update_elo(*args,P_start.copy(),fast_bool=True,c=200,o=10)
+        E = pd.merge(N, M.loc[:,["match_id","surface","best_of","tourney_level","date"]], on = "match_id")
+        E = E.loc[E["date"] >= evaluation_startdate,:].reset_index(drop=True)
+        winner_winprob = winprobabilities_from_elo(E["surface"],E["best_of"].astype(float),E["winner_elo_before"].astype(float),E["loser_elo_before"].astype(float),\
+            E["winner_elo_surface_before"].astype(float),E["loser_elo_surface_before"].astype(float),E["tourney_level"])
+        brierscore, log_score, mae = prediction_metrics(winner_winprob,E["date"].dt.year)
+        for R in [R_pooled, R_batched]:
+            self.assertEqual(len(R.index),4)
+            row = R.loc[(R["c"] == 200) & (R["o"] == 10),:].iloc[0]
+            np.testing.assert_allclose([row["brierscore"],row["log_score"],row["mae"]],[brierscore,log_score,mae])
+        np.testing.assert_allclose(R_pooled.sort_values(by=["c","o"])["brierscore"],R_batched.sort_values(by=["c","o"])["brierscore"])
+
+
 class TestSetwinner(unittest.TestCase):
 
     def test_setwinner_basic(self):
@@ -149,6 +469,34 @@ class TestSetwinner(unittest.TestCase):
     #    self.assertEqual(setwinner(sets),expected_result)
 
 
+class TestParseScores(unittest.TestCase):
+
+    def test_parse_scores_basic(self):
+        scores = pd.Series(["7-6(5) 6-7(3) 6-4", "6-1 1-6 2-0 RET", "W/O", np.nan])
+        S = parse_scores(scores)
+        np.testing.assert_array_equal(S["winner_games_1"],np.array([7,6,0,0]))
+        np.testing.assert_array_equal(S["loser_games_3"],np.array([4,0,0,0]))
+        np.testing.assert_array_equal(S["tiebreak_points_2"],np.array([3,-1,-1,-1]))
+        np.testing.assert_array_equal(S["retired"],np.array([False,True,False,False]))
+        np.testing.assert_array_equal(S["walkover"],np.array([False,False,True,False]))
+        np.testing.assert_array_equal(S["winner_setswon"],np.array([2,1,0,0]))
+        np.testing.assert_array_equal(S["loser_setswon"],np.array([1,1,0,0]))
+
+    def test_update_elo_with_score_table(self):
+        winner_ids = [big3_ids[i % 3] for i in range(30)]
+        loser_ids = [big3_ids[(i+1) % 3] for i in range(30)]
+        M = pd.DataFrame({"winner_id": winner_ids, "loser_id": loser_ids, "score": ["7-6(5) 6-7(3) 6-4","6-1 1-6 2-0 RET","6-4 6-4"]*10, "surface": ["Hard","Clay","Grass","Carpet","Hard","Mud"]*5, \
+                          "tourney_level": "ATP 250", "tourney_id": ["id"+str(i) for i in range(30)], "date": [datetime(2010,1,1) + timedelta(days=30-i) for i in range(30)], "round": "F"})
+        M["match_id"] = match_id(M.tourney_id,M.winner_id,M.loser_id,M.score)
+        args = (M.match_id,M.winner_id,M.loser_id,M.score,M.date,M.date,M.surface,M.tourney_level,M["round"],big3_df.loc[:,["id","elo_overall","match_number"]].copy())
+        N, P = update_elo(*args,fast_bool=True)
+        N_parsed, P_parsed = update_elo(*args,fast_bool=True,score_table=parse_scores(M.score))
+        pd.testing.assert_frame_equal(N_parsed,N)
+        pd.testing.assert_frame_equal(P_parsed,P)
+        with self.assertRaises(ValueError):
+            update_elo(*args,fast_bool=True,score_table=parse_scores(M.score[:10]))
+
+
 class TestSetswonbyplayer(unittest.TestCase):
 
     def test_setswonbyplayer_basic(self):
@@ -159,5 +507,461 @@ class TestSetswonbyplayer(unittest.TestCase):
         np.testing.assert_array_equal(winner_setswon_return,winner_setswon_expected)
         np.testing.assert_array_equal(loser_setswon_return,loser_setswon_expected)
 
+
+class TestFixtureWinprobabilities(unittest.TestCase):
+
+    def test_same_as_winprobabilities_from_elo(self):
+        P = big3_df.assign(name = big3_ids, elo_hard = [1950,2150,2000], elo_clay = [2100,2000,1950], elo_grass = [1900,2200,2050], \
+            match_number_hard = 0, match_number_clay = 0, match_number_grass = 0)
+        store = rating_store(current_ratings_table(P))
+        player1_ids = [big3_ids[0],big3_ids[1],big3_ids[2],big3_ids[0],big3_ids[1],"nobody"]
+        player2_ids = [big3_ids[1],big3_ids[2],big3_ids[0],big3_ids[2],big3_ids[0],big3_ids[0]]
+        surfaces = ["Hard","Clay","Grass","Carpet","Carpet","Hard"]
+        best_ofs = [3,5,5,3,3,3]
+        tourney_levels = ["ATP 250","Grand Slam","Grand Slam","ATP 500","Challenger","ATP 250"]
+        winprob_returned = fixture_winprobabilities(store,player1_ids,player2_ids,surfaces,best_ofs,tourney_levels)
+        elos = P.set_index("id")
+        surface_columns = ["elo_hard","elo_clay","elo_grass","elo_grass","elo_grass"]
+        winprob_expected = winprobabilities_from_elo(pd.Series(surfaces[:5]),pd.Series(best_ofs[:5]),elos.elo_overall[player1_ids[:5]].reset_index(drop=True),\
+            elos.elo_overall[player2_ids[:5]].reset_index(drop=True),pd.Series([elos.at[player,column] for player, column in zip(player1_ids,surface_columns)]),\
+            pd.Series([elos.at[player,column] for player, column in zip(player2_ids,surface_columns)]),pd.Series(tourney_levels[:5]))
+        np.testing.assert_array_equal(winprob_returned[:5],winprob_expected.astype(float))
+        self.assertTrue(np.isnan(winprob_returned[5])) # unknown player
+
+
+class TestSimulateDraw(unittest.TestCase):
+
+    def setUp(self):
+        self.P = big3_df.assign(elo_hard = [1950,2150,2000], elo_clay = [2100,2000,1950], elo_grass = big3_elos)
+
+    def test_probabilities(self):
+        draw = [big3_ids[0],"bye",big3_ids[1],big3_ids[2]]
+        R = simulate_draw(self.P,draw,"Hard",simulations=20000,processes=1,seed=1).set_index("id")
+        self.assertEqual(list(R.columns),["SF","F","W"])
+        self.assertAlmostEqual(R["W"].sum(),1)
+        self.assertEqual(R.at[big3_ids[0],"F"],1) # the bye always loses
+        self.assertAlmostEqual(R.at[big3_ids[1],"F"]+R.at[big3_ids[2],"F"],1)
+
+    def test_two_players(self):
+        R = simulate_draw(self.P,big3_ids[:2],"Clay",best_of=5,simulations=200000,processes=1,seed=1).set_index("id")
+        winprob = fixture_winprobabilities(rating_store(current_ratings_table(self.P.assign(name = big3_ids, match_number_hard = 0, \
+            match_number_clay = 0, match_number_grass = 0))),[big3_ids[0]],[big3_ids[1]],["Clay"],[5],["ATP 250"])[0]
+        self.assertAlmostEqual(R.at[big3_ids[0],"W"],winprob,places=2)
+
+    def test_results(self):
+        draw = [big3_ids[0],big3_ids[1],big3_ids[2],"bye"]
+        R = simulate_draw(self.P,draw,"Hard",simulations=1000,results=[(big3_ids[1],big3_ids[0])],processes=1,seed=1).set_index("id")
+        self.assertEqual(R.at[big3_ids[0],"F"],0)
+        self.assertEqual(R.at[big3_ids[1],"F"],1)
+        R = simulate_draw(self.P,draw,"Hard",simulations=1000,results=[(big3_ids[1],big3_ids[0]),(big3_ids[2],big3_ids[1])],processes=1,seed=1)
+        self.assertEqual(R.loc[0,"id"],big3_ids[2])
+        self.assertEqual(R.loc[0,"W"],1)
+
+
+class TestRatingIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.M = pd.DataFrame({"winner_id": [big3_ids[0],big3_ids[2],big3_ids[0],big3_ids[1]], "loser_id": [big3_ids[1],big3_ids[0],big3_ids[2],big3_ids[2]], \
+            "date": [datetime(2010,1,1),datetime(2010,1,3),datetime(2010,1,2),np.nan], "tourney_date": [datetime(2010,1,1),datetime(2010,1,1),datetime(2010,1,1),datetime(2010,1,5)], \
+            "round": "F", "surface": ["Hard","Clay","Clay","Hard"], "winner_elo": [2010.,1960,2020,2110], "loser_elo": [2090.,2000,1940,1930], \
+            "winner_elo_surface": [1960.,2010,1970,2160], "loser_elo_surface": [2140.,1960,1990,1980]})
+
+    def test_history(self):
+        H = RatingIndex.from_matches(self.M).history(big3_ids[0])
+        self.assertEqual(list(H["row"]),[0,2,1])
+        self.assertEqual(list(H["elo_overall"]),[2010,2020,2000])
+        self.assertEqual(list(H["won"]),[True,True,False])
+        np.testing.assert_array_equal(H["elo_hard"],[1960,1960,1960]) # carried forward from the last match on hard
+        np.testing.assert_array_equal(H["elo_clay"],[np.nan,1970,1960])
+
+    def test_as_of(self):
+        with tempfile.TemporaryDirectory() as folder:
+            RatingIndex.from_matches(self.M).save(folder)
+            R = RatingIndex.load(folder).as_of([big3_ids[2],big3_ids[2],big3_ids[2],"nobody"],[datetime(2009,12,31),datetime(2010,1,2),datetime(2010,2,1),datetime(2010,2,1)])
+        self.assertTrue(np.isnan(R.loc[0,"elo_overall"]))
+        self.assertEqual(list(R.loc[1:2,"elo_overall"]),[1940,1930])
+        self.assertEqual(R.loc[2,"elo_hard"],1980)
+        self.assertEqual(R.loc[1,"date"],datetime(2010,1,2))
+        self.assertTrue(np.isnan(R.loc[3,"elo_overall"]))
+
+    def test_read_rating_index(self):
+        with tempfile.TemporaryDirectory() as folder:
+            read_rating_index(self.M, folder)
+            with open(os.path.join(folder, "info.json"), "w") as f:
+                json.dump({"sha256": "from an older version"}, f)
+            read_rating_index(self.M, folder) # built again
+            rating_index = read_rating_index(self.M, folder) # memory-mapped
+            self.assertIsInstance(rating_index.ids, np.memmap)
+            self.assertEqual(list(rating_index.ids),sorted(big3_ids)) # the ids are stored with the index, it doesn't depend on the keys of KeyMap
+            self.assertEqual(list(rating_index.history(big3_ids[1])["row"]),[0,3])
+            del rating_index
+
+
+class TestPlayerStats(unittest.TestCase):
+
+    def setUp(self):
+        self.M = pd.DataFrame({"winner_id": [big3_ids[0],big3_ids[2],big3_ids[0],big3_ids[1]], "loser_id": [big3_ids[1],big3_ids[0],big3_ids[2],big3_ids[2]], \
+            "date": [datetime(2010,1,1,11),datetime(2010,1,3,19),datetime(2010,1,2,14),np.nan], "tourney_date": datetime(2010,1,1), \
+            "round": "F", "surface": ["Hard","Clay","Clay","Hard"], "winner_elo": [2010.,1960,2020,2110], "loser_elo": [2090.,2000,1940,1930], \
+            "winner_elo_surface": [1960.,2010,1970,2160], "loser_elo_surface": [2140.,1960,1990,1980], "temp": [30,15,20,np.nan]})
+
+    def player_stats(self, player_ids = None):
+        M = self.M
+        return player_stats(M["winner_id"],M["loser_id"],M["surface"],M["winner_elo"],M["loser_elo"],M["winner_elo_surface"],M["loser_elo_surface"],\
+            M["date"],M["tourney_date"],M["round"],M["temp"],player_ids)
+
+    def test_all_players(self):
+        T = self.player_stats()
+        self.assertEqual(len(T),3)
+        self.assertEqual(list(T.loc[big3_ids[0],["wins_overall","losses_overall","wins_clay","losses_clay","wins_hot","losses_cold"]]),[2,1,1,1,1,1])
+        self.assertEqual(list(T.loc[big3_ids[0],["wins_morning","wins_afternoon","losses_evening"]]),[1,1,1])
+        self.assertEqual(T.loc[big3_ids[0],"elo_max_overall"],2020)
+        self.assertEqual(T.loc[big3_ids[0],"elo_max_date_overall"],datetime(2010,1,2,14))
+        self.assertEqual(T.loc[big3_ids[0],"current_elo_clay"],1960)
+        self.assertEqual(T.loc[big3_ids[2],"current_elo_hard"],1980)
+        self.assertTrue(np.isnan(T.loc[big3_ids[1],"elo_max_clay"]))
+
+    def test_formatted(self):
+        T = self.player_stats([big3_ids[0],"nobody"])
+        S = format_player_stats(T,{"Rafael Nadal": big3_ids[0], "Nobody": "nobody"})
+        self.assertEqual(S.loc[0,"Rafael Nadal"],"2 — 1 (66.7 %)")
+        self.assertEqual(S.loc[4,"Rafael Nadal"],"2020.0 (02 Jan, 2010)")
+        self.assertEqual(S.loc[0,"Nobody"],"0 — 0 ()")
+        self.assertEqual(S.loc[4,"Nobody"],"")
+
+
+class TestEloSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.M = pd.DataFrame({"winner_id": [big3_ids[0],big3_ids[2],big3_ids[0],big3_ids[1]], "loser_id": [big3_ids[1],big3_ids[0],big3_ids[2],big3_ids[2]], \
+            "date": [datetime(2010,1,1),datetime(2010,1,13),datetime(2010,1,5),np.nan], "tourney_date": [datetime(2010,1,1),datetime(2010,1,11),datetime(2010,1,4),datetime(2011,3,7)], \
+            "round": "F", "surface": ["Hard","Clay","Clay","Hard"], "winner_elo": [2010.,1960,2020,2110], "loser_elo": [2090.,2000,1940,1930], \
+            "winner_elo_surface": [1960.,2010,1970,2160], "loser_elo_surface": [2140.,1960,1990,1980]})
+        self.rating_index = RatingIndex.from_matches(self.M)
+
+    def test_snapshots(self):
+        S = elo_snapshots(self.rating_index, end = datetime(2011,3,14))
+        self.assertEqual(S["date"].min(),datetime(2010,1,4))
+        W = S.loc[S["date"] == datetime(2010,1,11)].set_index("id")
+        self.assertEqual(list(W.loc[big3_ids,"elo_overall"]),[2020,2090,1940])
+        self.assertEqual(set(S.loc[S["date"] == datetime(2011,3,7),"id"]),set()) # nobody was active in the year before
+        self.assertEqual(set(S.loc[S["date"] == datetime(2011,3,14),"id"]),{big3_ids[1],big3_ids[2]})
+
+    def test_leaderboard(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder,"elo_snapshots.parquet")
+            write_elo_snapshots(elo_snapshots(self.rating_index),filename)
+            L = leaderboard(datetime(2010,1,12),"overall",2,filename)
+            L_updated = leaderboard(datetime(2010,1,14),"clay",3,filename,rating_index = self.rating_index)
+        self.assertEqual(list(L["id"]),[big3_ids[1],big3_ids[0]])
+        self.assertEqual(list(L["rank"]),[1,2])
+        self.assertEqual(list(L_updated["id"]),[big3_ids[2],big3_ids[0]]) # the match of Jan 13 comes from the rating index, Federer has no clay Elo
+        self.assertEqual(list(L_updated["elo_clay"]),[2010,1960])
+
+
+class TestPrimaryStore(unittest.TestCase):
+
+    def test_write_read_export(self):
+        P = big3_df.assign(name = ["Rafael Nadal","Roger Federer","Novak Djokovic"], elo_hard = [1950,np.nan,2000], elo_clay = 2000., elo_grass = 2000., \
+            match_number_hard = 0, match_number_clay = 0, match_number_grass = 0)
+        for column in players_table_columns:
+            if column not in P.columns:
+                P[column] = np.nan
+        with tempfile.TemporaryDirectory() as folder:
+            name = os.path.join(folder,"players")
+            self.assertIsNone(read_primary_table(name))
+            write_player_table(P,name = name)
+            P_read = read_primary_table(name)
+            self.assertEqual(list(P_read["elo_hard"]),[1950,1400,2000])
+            export_excel(["players"],background_bool = False,folder = folder)
+            self.assertTrue(os.path.isfile(name + ".xlsx"))
+            self.assertIsNotNone(read_primary_table(name)) # the export doesn't count as a change of the Excel file
+            os.utime(name + ".xlsx",ns = (0,0))
+            self.assertIsNotNone(read_primary_table(name)) # neither does a new modification time
+            write_player_excel(P_read.assign(height = 185),name + ".xlsx")
+            with self.assertWarns(UserWarning):
+                self.assertIsNone(read_primary_table(name)) # but changing its content by hand does
+
+    def test_conflict(self):
+        P = big3_df.assign(name = ["Rafael Nadal","Roger Federer","Novak Djokovic"], elo_hard = 2000., elo_clay = 2000., elo_grass = 2000., \
+            match_number_hard = 0, match_number_clay = 0, match_number_grass = 0)
+        for column in players_table_columns:
+            if column not in P.columns:
+                P[column] = np.nan
+        with tempfile.TemporaryDirectory() as folder:
+            name = os.path.join(folder,"players")
+            write_player_table(P,name = name)
+            export_excel(["players"],background_bool = False,folder = folder)
+            write_player_table(P.assign(elo_overall = 2100.),name = name) # e.g. an Elo update that is not exported yet
+            write_player_excel(read_primary_table(name).assign(height = 185),name + ".xlsx")
+            with self.assertRaises(ValueError):
+                read_primary_table(name)
+            os.remove(name + ".parquet.json")
+            self.assertIsNone(read_primary_table(name)) # without the info file, the table is read from the Excel file again
+
+
+class TestTennisDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        M = pd.DataFrame({"match_id": ["m1","m2","m3","m4"], "winner_id": [big3_ids[0],big3_ids[2],big3_ids[0],big3_ids[1]], "loser_id": [big3_ids[1],big3_ids[0],big3_ids[2],big3_ids[2]], \
+            "date": [datetime(2010,1,1,11),datetime(2010,1,3,19),np.nan,np.nan], "tourney_id": ["t1","t1","t2","t3"], "score": "6-4 6-4"})
+        T = pd.DataFrame({"id": ["t1","t2","t3"], "name": ["Doha","Rome","Halle"], "level": "ATP 250", "surface": ["Hard","Clay","Grass"], \
+            "date": [datetime(2010,1,1),datetime(2010,5,1),datetime(2010,6,10)], "city": ["Doha","Rome","Halle"]})
+        P = big3_df.assign(name = ["Rafael Nadal","Roger Federer","Novak Djokovic"])
+        C = pd.DataFrame({"city": ["Doha","Rome","Halle"], "lat": [25.3,41.9,52.1]})
+        self.database = TennisDatabase(os.path.join(self.folder.name,"tennis.sqlite"))
+        self.database.build(M,T,P,C)
+
+    def tearDown(self):
+        self.database.close()
+        self.folder.cleanup()
+
+    def test_player_matches(self):
+        R = self.database.player_matches(big3_ids[0])
+        self.assertEqual(list(R["match_id"]),["m1","m2","m3"])
+        self.assertEqual(R.loc[2,"date2"],datetime(2010,5,1)) # the date of the tournament if the date of the match is missing
+        self.assertEqual(list(R["surface"]),["Hard","Hard","Clay"])
+        self.assertEqual(list(self.database.player_matches(big3_ids[0],datetime(2010,1,2),datetime(2010,5,1))["match_id"]),["m2"])
+
+    def test_head_to_head_and_dates(self):
+        self.assertEqual(list(self.database.head_to_head(big3_ids[2],big3_ids[0])["match_id"]),["m2","m3"])
+        self.assertEqual(list(self.database.matches_between(datetime(2010,5,1))["match_id"]),["m3","m4"])
+        self.assertEqual(len(self.database.read_table("players")),3)
+
+
+class TestGithubFetcher(unittest.TestCase):
+
+    def setUp(self):
+        import http.server, threading
+        files = self.files = {"atp_players.csv": b"player_id,name_first\n1,Rafael\n", "atp_matches_2024.csv": b"tourney_id\n2024-1\n"}
+        requests_log = self.requests_log = []
+        class Handler(http.server.BaseHTTPRequestHandler): # a stand-in for GitHub that answers conditional requests like it
+            def do_GET(self):
+                name = self.path.lstrip("/")
+                requests_log.append((name, self.headers.get("If-None-Match")))
+                if name not in files:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                etag = '"' + hashlib.sha256(files[name]).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(files[name])))
+                self.end_headers()
+                self.wfile.write(files[name])
+            def log_message(self, *args):
+                pass
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        self.folder = tempfile.TemporaryDirectory()
+        self.fetcher = GithubFetcher("http://127.0.0.1:{}/".format(self.server.server_address[1]), self.folder.name, max_workers = 4)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.folder.cleanup()
+
+    def test_conditional_requests(self):
+        filenames = ["atp_players.csv","atp_matches_2024.csv","atp_matches_futures_2024.csv"]
+        result = self.fetcher.fetch(filenames)
+        self.assertEqual([changed for path, changed in result.values()],[True,True,False])
+        self.assertIsNone(result["atp_matches_futures_2024.csv"][0])
+        with open(result["atp_players.csv"][0],"rb") as f:
+            self.assertEqual(f.read(),self.files["atp_players.csv"])
+        self.files["atp_matches_2024.csv"] = b"tourney_id\n2024-1\n2024-2\n"
+        result = self.fetcher.fetch(filenames)
+        self.assertEqual([changed for path, changed in result.values()],[False,True,False])
+        with open(result["atp_matches_2024.csv"][0],"rb") as f:
+            self.assertEqual(f.read(),self.files["atp_matches_2024.csv"])
+        self.assertEqual(sum(etag is not None for name, etag in self.requests_log),2) # the second time the cached files were requested with their ETag
+
+
+class TestDownloadFromGithub(TestGithubFetcher):
+
+    def test_new_matches(self):
+        stats_columns = [prefix + column for prefix in ["w_","l_"] for column in ["ace","df","svpt","1stIn","1stWon","2ndWon","SvGms","bpSaved","bpFaced"]]
+        self.files["atp_matches_2024.csv"] = pd.DataFrame({"tourney_id": "2024-1", "tourney_name": " Doha ", "surface": "Hard", "tourney_date": 20240101, \
+            "score": ["6-4 6-4","6-3 6-3"], "best_of": 3, "round": ["F","SF"], "minutes": 90, "winner_name": ["Rafa  Nadal","Roger Federer"], \
+            "loser_name": ["Roger Federer","Carlos Alcaraz"]}).assign(**{column: 1 for column in stats_columns}).to_csv(index = False).encode()
+        self.files["atp_players.csv"] = b"player_id,name_first,name_last,hand,dob,ioc,height,wikidata_id\n1,Carlos,Alcaraz,R,20030505,ESP,183,Q1\n"
+        P = big3_df.assign(name = ["Rafael Nadal","Roger Federer","Novak Djokovic"], alt_name = ["Rafa Nadal",np.nan,np.nan])
+        M = pd.DataFrame({"match_id": ["m1"]})
+        T = pd.DataFrame({"id": ["t1"]})
+        matches_new, tournaments_new, players_new = download_from_github(2024,M,P,T,fetcher = self.fetcher)
+        os.remove("matches_new_0.csv")
+        self.assertEqual(list(matches_new["winner_id"]),[big3_ids[0],big3_ids[1]]) # the alternative name and the double blank are resolved
+        self.assertEqual(list(players_new["name"]),["Carlos Alcaraz"])
+        self.assertEqual(matches_new["loser_id"].iloc[1],players_new["id"].iloc[0])
+        self.assertEqual(list(tournaments_new["name"]),["Doha"])
+
+    def test_unresolved_names(self):
+        stats_columns = [prefix + column for prefix in ["w_","l_"] for column in ["ace","df","svpt","1stIn","1stWon","2ndWon","SvGms","bpSaved","bpFaced"]]
+        self.files["atp_matches_2024.csv"] = pd.DataFrame({"tourney_id": "2024-1", "tourney_name": "Doha", "surface": "Hard", "tourney_date": 20240101, \
+            "score": ["6-4 6-4","6-3 6-3"], "best_of": 3, "round": ["F","SF"], "minutes": 90, "winner_name": ["Rafael Nadal","Roger Federer"], \
+            "loser_name": ["Roger Federer","Jannik Sinner"]}).assign(**{column: 1 for column in stats_columns}).to_csv(index = False).encode()
+        self.files["atp_players.csv"] = b"player_id,name_first,name_last,hand,dob,ioc,height,wikidata_id\n1,Carlos,Alcaraz,R,20030505,ESP,183,Q1\n"
+        P = big3_df.assign(name = ["Rafael Nadal","Roger Federer","Novak Djokovic"], alt_name = np.nan)
+        with self.assertWarns(UserWarning) as warning:
+            matches_new, tournaments_new, players_new = download_from_github(2024,pd.DataFrame({"match_id": ["m1"]}),P,pd.DataFrame({"id": ["t1"]}),fetcher = self.fetcher)
+        os.remove("matches_new_0.csv")
+        self.assertIn("Jannik Sinner",str(warning.warning)) # not in the players table and not a new player from GitHub
+        self.assertEqual(list(matches_new["winner_id"]),[big3_ids[0]])
+        self.assertFalse(matches_new["match_id"].isna().any())
+
+
+class TestPlayerNameIndex(unittest.TestCase):
+
+    def setUp(self):
+        P = pd.DataFrame({"id": ["rafael nadal-es-86","novak djokovic-rs-87","marko djokovic-rs-91","jo-wilfried tsonga-fr-85"], \
+            "name": ["Rafael Nadal","Novak Djokovic","Marko Djokovic","Jo-Wilfried Tsonga"], "alt_name": ["Rafa Nadal",np.nan,np.nan,np.nan], \
+            "surname_tennis_explorer": ["nadal","djokovic","djokovic","tsonga"], "surname_tennis_explorer2": [np.nan,np.nan,np.nan,"tsonga"]})
+        self.name_index = PlayerNameIndex(P)
+
+    def test_exact(self):
+        self.assertEqual(self.name_index.resolve("rafa  nadal"),"rafael nadal-es-86")
+        self.assertEqual(self.name_index.resolve("Jo Wilfried Tsonga"),"jo-wilfried tsonga-fr-85")
+        self.assertEqual(self.name_index.resolve("Tsonga"),"jo-wilfried tsonga-fr-85") # by the Tennis Explorer surname
+        self.assertIsNone(self.name_index.resolve("Djokovic")) # two players
+        self.assertEqual(len(self.name_index.ids("Djokovic")),2)
+        ids = self.name_index.resolve_names(pd.Series(["Rafael Nadal","Novák Djokovic",np.nan,"Roger Federer","Tsonga"]))
+        self.assertEqual(list(ids[:2]),["rafael nadal-es-86","novak djokovic-rs-87"])
+        self.assertTrue(ids[2:].isna().all()) # surnames are not used for the names of matches
+
+    def test_suggestions(self):
+        S = self.name_index.suggestions("Novak Djokovich")
+        self.assertEqual(S.loc[0,"name"],"Novak Djokovic")
+        self.assertEqual(len(S),len(set(S["id"])))
+        self.assertEqual(self.name_index.suggestions("Rafa Nadal").loc[0,"score"],1)
+        with self.assertRaises(LookupError):
+            player_names_to_ids(None,"Rafael Nadal, Rafel Nadall",self.name_index)
+
+
+class TestInterpolateWeather(unittest.TestCase):
+
+    def test_interpolation(self):
+        W = pd.DataFrame({"date": [datetime(2020,5,1,15),datetime(2020,5,1,12),datetime(2020,5,1,18)], "temp_c": [24.0,18.0,20.0], "hum_perc": [40.0,60.0,50.0], \
+            "pressure_mmHg": [760.0,762.0,759.0], "windspeed_ms": [4.0,2.0,3.0]})
+        dates = pd.Series([datetime(2020,5,1,13),datetime(2020,5,1,15),datetime(2020,5,1,16,30),datetime(2020,5,1,11),datetime(2020,5,1,19),pd.NaT], index = [5,4,3,2,1,0])
+        R = interpolate_weather(dates,W)
+        self.assertEqual(list(R.index),[5,4,3,2,1,0])
+        self.assertEqual(list(R["temp_c"][:3]),[20.0,24.0,22.0])
+        self.assertEqual(list(R["hum_perc"][:3]),[53.3,40.0,45.0])
+        self.assertEqual(list(R["windspeed_ms"][:3]),[2.5,4.0,3.5]) # rounded to 0.5
+        self.assertTrue(R.iloc[3:].isna().all().all()) # outside of the readings
+
+
+class TestWeatherForMatches(unittest.TestCase):
+
+    def test_stations(self):
+        cities_table = pd.DataFrame({"city": ["Rome, Italy","Paris, France","Oslo, Norway"], "URL": ["https://rp5.ru/Weather_archive_in_Rome_(airport)", \
+            "https://rp5.ru/Weather_archive_in_Paris_(Orly)","https://rp5.ru/Weather_archive_in_Oslo"], "URL2": [np.nan,"https://rp5.ru/Weather_archive_in_Paris_(Le_Bourget)",np.nan], \
+            "URL3": np.nan, "relevant_for_weather": [True,True,False]})
+        matches_table = pd.DataFrame({"match_id": ["m1","m2","m3","m4","m5"], "city": ["Rome, Italy","Paris, France","Paris, France","Oslo, Norway","Rome, Italy"], \
+            "date": [datetime(2020,5,1,13),datetime(2020,5,1,16,30),datetime(2020,5,3,13),datetime(2020,5,1,13),datetime(2020,5,1,0)], "temp": [np.nan,np.nan,np.nan,np.nan,10.0], "wind": np.nan, "hum": np.nan})
+        with tempfile.TemporaryDirectory() as folder:
+            station = pd.DataFrame({"date": [20200501]*3, "hour": [12,15,18], "temp_c": [18.0,24.0,20.0], "hum_perc": [60.0,40.0,50.0], "pressure_mmHg": [762.0,760.0,759.0], "windspeed_ms": [2.0,4.0,3.0]})
+            station.to_csv(weather_station_filename(cities_table["URL"][0], folder), index = False)
+            station.to_csv(weather_station_filename(cities_table["URL"][1], folder), index = False) # no readings on 3 May, URL2 is used there
+            station.assign(date = 20200503, temp_c = 30.0).to_csv(weather_station_filename(cities_table["URL2"][1], folder), index = False)
+            station.to_csv(weather_station_filename(cities_table["URL"][2], folder), index = False) # not relevant_for_weather
+            W = weather_for_matches(matches_table, cities_table, folder, processes = 1)
+        self.assertEqual(sorted(W["match_id"]),["m1","m2","m3"]) # m5 has no time
+        W = W.set_index("match_id")
+        self.assertEqual(list(W.loc[["m1","m2","m3"],"temp_c"]),[20.0,22.0,30.0])
+        M = update_match_weather(matches_table, W.reset_index())
+        self.assertEqual(list(M["temp"][:3]),[20.0,22.0,30.0])
+        self.assertTrue(np.isnan(M["temp"][3]))
+        self.assertEqual(M["temp"][4],10.0)
+        self.assertEqual(list(M["hum"][:3]),[53.3,45.0,53.3])
+        self.assertEqual(list(M["wind"][:3]),[2.5,3.5,2.5])
+        self.assertTrue(np.isnan(matches_table["temp"][0])) # the input is not changed
+
+
+class TestWeatherStore(unittest.TestCase):
+
+    def test_store(self):
+        cities_table = pd.DataFrame({"city": ["Rome, Italy","Paris, France"], "URL": ["https://rp5.ru/Weather_archive_in_Rome_(airport)","https://rp5.ru/Weather_archive_in_Paris_(Orly)"], \
+            "URL2": [np.nan,"https://rp5.ru/Weather_archive_in_Paris_(Le_Bourget)"], "URL3": np.nan, "relevant_for_weather": True})
+        matches_table = pd.DataFrame({"match_id": ["m1","m2","m3"], "city": ["Rome, Italy","Paris, France","Paris, France"], \
+            "date": [datetime(2020,5,1,13),datetime(2020,5,1,16,30),datetime(2020,5,3,13)]})
+        with tempfile.TemporaryDirectory() as folder:
+            station_folder, store_folder = os.path.join(folder, "stations"), os.path.join(folder, "store")
+            os.makedirs(station_folder)
+            station = pd.DataFrame({"date": [20200501]*3, "hour": [12,15,18], "temp_c": [18.0,24.0,20.0], "hum_perc": [60.0,40.0,50.0], "pressure_mmHg": [762.0,760.0,759.0], "windspeed_ms": [2.0,4.0,3.0]})
+            station.to_csv(weather_station_filename(cities_table["URL"][0], station_folder), index = False)
+            station.to_csv(weather_station_filename(cities_table["URL"][1], station_folder), index = False)
+            weather_store = read_weather_store(cities_table, station_folder, store_folder, processes = 1)
+            self.assertEqual(weather_store.readings.dtype, np.float32)
+            W = weather_for_matches(matches_table, cities_table, weather_store = weather_store)
+            pd.testing.assert_frame_equal(W, weather_for_matches(matches_table, cities_table, station_folder, processes = 1))
+            self.assertEqual(list(W["temp_c"]),[20.0,22.0]) # no readings on 3 May
+            # A new station file builds the store again, otherwise it is memory-mapped from the folder
+            station.assign(date = 20200503, temp_c = 30.0).to_csv(weather_station_filename(cities_table["URL2"][1], station_folder), index = False)
+            weather_store = read_weather_store(cities_table, station_folder, store_folder, processes = 1)
+            weather_store = read_weather_store(cities_table, station_folder, store_folder, processes = 1)
+            self.assertIsInstance(weather_store.times, np.memmap)
+            R = weather_store.weather(["Paris, France","Paris, France","Berlin, Germany"], [datetime(2020,5,1,16,30),datetime(2020,5,3,13),datetime(2020,5,1,13)])
+            self.assertEqual(list(R["temp_c"][:2]),[22.0,30.0])
+            self.assertTrue(R.iloc[2].isna().all())
+            readings = weather_store.station_readings(cities_table["URL"][0])
+            self.assertEqual(list(readings["date"]),[datetime(2020,5,1,12),datetime(2020,5,1,15),datetime(2020,5,1,18)])
+            # weather_data takes the station from the title of the Google Drive page first and then finds it in the store without downloading the csv file
+            class Response:
+                content = b"<html><head><title>Rome_(airport).csv - Google Drive</title></head></html>"
+            M = pd.DataFrame({"URL": cities_table["URL"][0], "date": [datetime(2020,5,1,13),datetime(2020,5,1,0)]})
+            with unittest.mock.patch("tennis_functions.requests.get", return_value = Response()), \
+                unittest.mock.patch("tennis_functions.read_weather_station", side_effect = AssertionError("downloaded")):
+                W_data = weather_data("https://drive.google.com/file/d/abc/view", M, weather_store = weather_store)
+            self.assertEqual(list(W_data["temp_c"]),[20.0]) # the match without start time gets no weather
+            del weather_store, readings # release the memory-mapped files before the folder is removed
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        players_table = big3_df.assign(name = ["Rafael Nadal","Roger Federer","Novak Djokovic"], alt_name = [np.nan,"Roger Federer Jr",np.nan], \
+            elo_hard = [1950,2150,2000], elo_clay = [2100,2000,1950], elo_grass = big3_elos, match_number_hard = 0, match_number_clay = 0, match_number_grass = 0)
+        master_table = pd.DataFrame({"winner_id": [big3_ids[0],big3_ids[2],big3_ids[0]], "loser_id": [big3_ids[1],big3_ids[0],big3_ids[2]], \
+            "date": [datetime(2010,1,1),datetime(2010,1,3),datetime(2010,1,2)], "tourney_id": "id1", "surface": "Hard", "round": "F", "score": "6-4 6-4", \
+            "winner_elo": [2010,1960,2020], "loser_elo": [2090,2000,1940], "winner_elo_surface": [1960,2010,1970], "loser_elo_surface": [2140,1960,1990]})
+        self.state = {"ratings": current_ratings_table(players_table), "lookup": player_lookup_table(players_table), "master_table": master_table, \
+            "match_rows": player_match_rows(master_table["winner_id"],master_table["loser_id"],master_table["date"])}
+
+    def test_queries(self):
+        import tennis_server
+        status, elo = tennis_server.handle_request(self.state,"GET","/elo?player=roger%20federer%20jr")
+        self.assertEqual((status,elo["elo_overall"]),(200,2100))
+        status, winprob = tennis_server.handle_request(self.state,"GET","/winprob?player1=Rafael%20Nadal&player2=Novak%20Djokovic&surface=Clay&best_of=5")
+        status_reverse, winprob_reverse = tennis_server.handle_request(self.state,"GET","/winprob?player1=Novak%20Djokovic&player2=Rafael%20Nadal&surface=Clay&best_of=5")
+        self.assertGreater(winprob["player1_winprob"],0.5)
+        self.assertAlmostEqual(winprob["player1_winprob"]+winprob_reverse["player1_winprob"],1)
+        status, history = tennis_server.handle_request(self.state,"GET","/history?player=Rafael%20Nadal")
+        self.assertEqual([match["elo"] for match in history["matches"]],[2000,2020,2010]) # most recent first
+        self.assertEqual(tennis_server.handle_request(self.state,"GET","/elo?player=nobody")[0],404)
+
+    def test_concurrent_clients(self):
+        import asyncio
+        import tennis_server
+        async def client(port, player):
+            reader, writer = await asyncio.open_connection("127.0.0.1",port)
+            writer.write("GET /elo?player={} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".format(player).encode())
+            response = await reader.read()
+            writer.close()
+            return json.loads(response.split(b"\r\n\r\n",1)[1])
+        async def run():
+            server = await asyncio.start_server(lambda reader, writer: tennis_server.handle_connection(reader,writer,self.state),"127.0.0.1",0)
+            port = server.sockets[0].getsockname()[1]
+            results = await asyncio.gather(*[client(port,big3_ids[i % 3].replace(" ","%20")) for i in range(30)])
+            server.close()
+            await server.wait_closed()
+            return results
+        results = asyncio.run(run())
+        self.assertEqual([result["elo_overall"] for result in results],[big3_elos[i % 3] for i in range(30)])
+
 if __name__ == "__main__":
     unittest.main()